@@ -1,3 +1,33 @@
-from .s3 import S3
-from .dydb import DYDB
-from .sqs import SQS, SQSMessage, SQSQueueSpecifications
+import typing
+import importlib
+
+# public name -> submodule defining it, imported on first attribute access (PEP 562)
+# so `from aws import SQS` never loads the S3 or DYDB modules
+_EXPORTS = {
+    "S3": ".s3",
+    "DYDB": ".dydb",
+    "SQS": ".sqs",
+    "SQSMessage": ".sqs",
+    "SQSQueueSpecifications": ".sqs",
+}
+
+__all__ = list(_EXPORTS)
+
+if typing.TYPE_CHECKING:
+    from .s3 import S3
+    from .dydb import DYDB
+    from .sqs import SQS, SQSMessage, SQSQueueSpecifications
+
+
+def __getattr__(name: str) -> typing.Any:
+    try:
+        module = _EXPORTS[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> typing.List[str]:
+    return sorted({*globals(), *_EXPORTS})
@@ -0,0 +1,505 @@
+"""
+asyncio counterparts of S3, DYDB and SQS built on aiobotocore (pip install aiobotocore)
+Clients are shared per event loop: instances created with the same credentials, region and
+endpoint on one loop use a single client and its connection pool, so thousands of concurrent
+calls run as coroutines over max_pool_connections sockets instead of a thread per request
+"""
+import os
+import json
+import uuid
+import typing
+import asyncio
+import logging
+import weakref
+import botocore
+from boto3.s3.transfer import TransferConfig
+from .s3 import S3
+from .dydb import DYDBRequests, MAX_MAP_RETRIES
+from .sqs import MAX_BATCH_ENTRIES
+from .err import s3 as s3_err, dydb as dydb_err, sqs as sqs_err
+from .err.base import RetryPolicy, default_policy
+from .utils.fs import part_size
+from .utils.metrics import Metrics
+from .schema.s3 import S3Object
+from .schema.sqs import SQSMessage, ReceiveAttributeNames, ReturnedSQSMessages
+
+try:
+    from aiobotocore.config import AioConfig
+    from aiobotocore.session import get_session
+except ImportError:  # optional dependency, only needed once a client is created
+    AioConfig = get_session = None
+
+logger = logging.getLogger(__name__)
+
+# event loop -> client key -> task creating (then holding) the shared client
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, typing.Dict[tuple, asyncio.Task]]" = \
+    weakref.WeakKeyDictionary()
+
+
+async def client(
+    service: str,
+    aws_access_key_id: str = None,
+    aws_secret_access_key: str = None,
+    region_name: str = None,
+    endpoint_url: str = None,
+    max_pool_connections: int = 100,
+    metrics: Metrics = None
+):
+    """
+    The aiobotocore client of service shared by every caller with the same settings on the running loop
+    metrics instruments the client when it is created (see Metrics)
+    """
+    if get_session is None:
+        raise ImportError("The asyncio clients need aiobotocore: pip install aiobotocore")
+    clients = _clients.setdefault(asyncio.get_running_loop(), {})
+    key = (service, aws_access_key_id, aws_secret_access_key, region_name, endpoint_url, max_pool_connections, metrics)
+    task = clients.get(key)
+    if task is None:
+        task = clients[key] = asyncio.ensure_future(_create_client(*key))
+    try:
+        # shielded so a cancelled caller does not cancel the creation other callers wait for
+        return await asyncio.shield(task)
+    except Exception:
+        if clients.get(key) is task and task.done():
+            del clients[key]
+        raise
+
+
+async def _create_client(
+    service, aws_access_key_id, aws_secret_access_key, region_name, endpoint_url, max_pool_connections, metrics
+):
+    context = get_session().create_client(
+        service,
+        aws_access_key_id=aws_access_key_id,
+        aws_secret_access_key=aws_secret_access_key,
+        region_name=region_name,
+        endpoint_url=endpoint_url,
+        # retries are the RetryPolicy's, botocore retrying as well would multiply them
+        config=AioConfig(max_pool_connections=max_pool_connections, retries={"total_max_attempts": 1})
+    )
+    shared = await context.__aenter__()
+    if metrics is not None:
+        metrics.attach(shared)
+    return shared
+
+
+async def close_clients() -> None:
+    """Close the clients (and their connection pools) shared on the running loop"""
+    for task in _clients.pop(asyncio.get_running_loop(), {}).values():
+        try:
+            shared = await task
+        except Exception:
+            continue
+        await shared.close()
+
+
+class _Shared:
+    service: str
+
+    def __init__(
+        self,
+        aws_access_key_id: str = None,
+        aws_secret_access_key: str = None,
+        region_name: str = None,
+        endpoint_url: str = None,
+        max_pool_connections: int = 100,
+        retry_policy: RetryPolicy = None,
+        metrics: Metrics = None
+    ):
+        # endpoint_url points the client at a local stub (moto server, localstack) in tests
+        self._settings = (
+            aws_access_key_id, aws_secret_access_key, region_name, endpoint_url, max_pool_connections, metrics)
+        # shared with the blocking client of the same service unless given
+        self.retry_policy = retry_policy or default_policy(self.service)
+
+    async def client(self):
+        return await client(self.service, *self._settings)
+
+    @property
+    def metrics(self) -> typing.Union[Metrics, None]:
+        """Metrics of the client, retries made along retry_policy are counted there"""
+        return self._settings[-1]
+
+
+class AsyncS3(_Shared):
+    service = "s3"
+
+    def __init__(
+        self,
+        bucket: str = None,
+        aws_access_key_id=os.environ.get("AWS_ACCESS_KEY_ID", None),
+        aws_secret_access_key=os.environ.get("AWS_SECRET_ACCESS_KEY", None),
+        region_name=os.environ.get("AWS_DEFAULT_REGION", None),
+        endpoint_url: str = None,
+        max_pool_connections: int = 100,
+        retry_policy: RetryPolicy = None,
+        transfer_config: TransferConfig = None,
+        metrics: Metrics = None
+    ):
+        super().__init__(
+            aws_access_key_id, aws_secret_access_key, region_name, endpoint_url, max_pool_connections, retry_policy,
+            metrics)
+        self.bucket = bucket
+        # multipart threshold, part size and part concurrency used by every transfer
+        self.transfer_config = transfer_config or TransferConfig()
+
+    @s3_err.errorhandler(not_found=False)
+    async def contains(self, prefix: str, bucket: str = None) -> bool:
+        """Check if prefix folder contains folder/file path"""
+        bucket = bucket or self.bucket
+        s3 = await self.client()
+        if len(prefix.split("/")[-1].split(".")) <= 1:
+            if prefix.endswith("/"):
+                prefix = prefix[:-1]
+            objects = await s3.list_objects(Bucket=bucket, Prefix=prefix, Delimiter="/", MaxKeys=1)
+            common = objects.get('CommonPrefixes') or [{}]
+            return prefix + "/" == common[0].get("Prefix")
+        await s3.head_object(Bucket=bucket, Key=prefix)
+        return True
+
+    @s3_err.errorhandler
+    async def list_all(self, prefix: str, bucket: str = None) -> list:
+        """List all files recursively within the prefix folder"""
+        return [obj.key async for obj in self.iter_objects(prefix, bucket)]
+
+    @s3_err.errorhandler
+    async def list_dirs(self, prefix: str, delimiter="/", bucket: str = None) -> list:
+        """List all folders one level within the prefix folder"""
+        paths = [path async for path in self.iter_dirs(prefix, delimiter, bucket)]
+        assert paths, "No objects found inside the directory (Please provide existed directory)"
+        return paths
+
+    async def iter_objects(self, prefix: str, bucket: str = None) -> typing.AsyncIterator[S3Object]:
+        """Lazily yield every object within the prefix, following list_objects_v2 pagination"""
+        async for page in self._paginate(bucket or self.bucket, prefix):
+            for obj in page.get("Contents", []):
+                yield S3Object.from_response(obj)
+
+    async def iter_dirs(self, prefix: str, delimiter="/", bucket: str = None) -> typing.AsyncIterator[str]:
+        """Lazily yield all folders one level within the prefix folder"""
+        async for page in self._paginate(bucket or self.bucket, prefix, delimiter):
+            for common in page.get("CommonPrefixes", []):
+                yield common["Prefix"]
+
+    async def _paginate(self, bucket: str, prefix: str, delimiter: str = None) -> typing.AsyncIterator[typing.Dict]:
+        s3 = await self.client()
+        kwargs = {"Bucket": bucket, "Prefix": prefix}
+        if delimiter:
+            kwargs["Delimiter"] = delimiter
+        async for page in s3.get_paginator("list_objects_v2").paginate(**kwargs):
+            yield page
+
+    @s3_err.errorhandler
+    async def upload_file(
+        self,
+        prefix: str,
+        path: str,
+        filename: str = "",
+        bucket: str = None,
+        config: TransferConfig = None
+    ) -> str:
+        """
+        Upload path into the prefix folder, config overrides the instance transfer_config
+        Files above the multipart threshold are sent as parts of multipart_chunksize, at most
+        max_concurrency at a time, with the file read on the default executor
+        """
+        bucket = bucket or self.bucket
+        config = config or self.transfer_config
+        prefix = S3.parse_prefix(prefix)
+        if not filename:
+            filename = os.path.basename(path)
+        elif "." not in filename:
+            _, ext = S3.parse_file_ext(path)
+            filename += ext
+        key = os.path.join(prefix, filename)
+        s3 = await self.client()
+        size = os.path.getsize(path)
+        if size < config.multipart_threshold:
+            body = await asyncio.to_thread(_read, path, 0, size)
+            await s3.put_object(Bucket=bucket, Key=key, Body=body)
+            return key
+
+        chunksize = part_size(size, config.multipart_chunksize)
+        upload_id = (await s3.create_multipart_upload(Bucket=bucket, Key=key))["UploadId"]
+        semaphore = asyncio.Semaphore(config.max_concurrency)
+
+        async def upload_part(n):
+            async with semaphore:
+                body = await asyncio.to_thread(_read, path, (n - 1) * chunksize, chunksize)
+                resp = await s3.upload_part(Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=n, Body=body)
+            return {"PartNumber": n, "ETag": resp["ETag"]}
+
+        try:
+            parts = await asyncio.gather(*(upload_part(n) for n in range(1, -(-size // chunksize) + 1)))
+            await s3.complete_multipart_upload(
+                Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts})
+        except BaseException:
+            await asyncio.shield(s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id))
+            raise
+        return key
+
+    @s3_err.errorhandler
+    async def download_file(
+        self,
+        prefix: str,
+        save_path=".",
+        rename_to="",
+        bucket: str = None,
+        config: TransferConfig = None
+    ) -> str:
+        """
+        Download the object at prefix into save_path, config overrides the instance transfer_config
+        Objects above the multipart threshold are fetched with concurrent ranged GETs pinned to
+        the object's ETag, smaller ones are streamed in a single GET
+        """
+        bucket = bucket or self.bucket
+        config = config or self.transfer_config
+        filename = os.path.basename(prefix)
+        filename = rename_to + \
+            os.path.splitext(filename)[-1] if rename_to else filename
+        path = os.path.join(save_path, filename)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        s3 = await self.client()
+        head = await s3.head_object(Bucket=bucket, Key=prefix)
+        size = head["ContentLength"]
+        chunksize = part_size(size, config.multipart_chunksize)
+        semaphore = asyncio.Semaphore(config.max_concurrency)
+
+        async def download_range(fd, offset, end=None):
+            kwargs = {"Bucket": bucket, "Key": prefix, "IfMatch": head["ETag"]}
+            if end is not None:
+                kwargs["Range"] = f"bytes={offset}-{end}"
+            async with semaphore:
+                resp = await s3.get_object(**kwargs)
+                async with resp["Body"] as body:
+                    while True:
+                        block = await body.read(config.io_chunksize)
+                        if not block:
+                            break
+                        await asyncio.to_thread(os.pwrite, fd, block, offset)
+                        offset += len(block)
+
+        tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            try:
+                if size < config.multipart_threshold:
+                    await download_range(fd, 0)
+                else:
+                    await asyncio.gather(*(
+                        download_range(fd, start, min(start + chunksize, size) - 1)
+                        for start in range(0, size, chunksize)
+                    ))
+            finally:
+                os.close(fd)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return path
+
+    @s3_err.errorhandler
+    async def download_file_from_uri(self, s3_uri, save_path=".", rename_to="", **kwargs) -> str:
+        bucket, prefix = S3.parse_s3_uri(s3_uri)
+        return await self.download_file(prefix, save_path, rename_to, bucket=bucket, **kwargs)
+
+
+def _read(path: str, offset: int, size: int) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+class AsyncDYDB(_Shared, DYDBRequests):
+    service = "dynamodb"
+
+    def __init__(
+        self,
+        table=None,
+        aws_access_key_id=os.environ.get("AWS_ACCESS_KEY_ID", None),
+        aws_secret_access_key=os.environ.get("AWS_SECRET_ACCESS_KEY", None),
+        region_name=os.environ.get("AWS_DEFAULT_REGION", None),
+        endpoint_url: str = None,
+        max_pool_connections: int = 100,
+        retry_policy: RetryPolicy = None,
+        use_decimal: bool = False,
+        metrics: Metrics = None
+    ):
+        super().__init__(
+            aws_access_key_id, aws_secret_access_key, region_name, endpoint_url, max_pool_connections, retry_policy,
+            metrics)
+        self.table = table
+        # read non integral numbers as Decimal instead of float
+        self.use_decimal = use_decimal
+
+    @dydb_err.errorhandler
+    async def get(self, key: typing.Dict, table: str = None) -> typing.Dict:
+        table = table or self.table
+        dydb = await self.client()
+        resp = await dydb.get_item(TableName=table, Key=self.mapper(key))
+        return self.unmapper(self._found(resp, key, table))
+
+    @dydb_err.errorhandler
+    async def delete(self, key: dict, table: str = None) -> None:
+        dydb = await self.client()
+        await dydb.delete_item(TableName=table or self.table, Key=self.mapper(key))
+
+    @dydb_err.errorhandler
+    async def create(self, table: str, data: typing.Dict) -> None:
+        dydb = await self.client()
+        await dydb.put_item(TableName=table, Item=self.mapper(data))
+
+    @dydb_err.errorhandler
+    async def update(
+        self,
+        key: typing.Dict,
+        data: typing.Dict = None,
+        table: str = None,
+        merge: bool = True,
+        append: typing.Dict = None,
+        add: typing.Dict = None,
+        remove: typing.List[str] = None,
+        condition: str = None,
+        names: typing.Dict[str, str] = None,
+        values: typing.Dict = None,
+        return_values: str = "NONE"
+    ) -> typing.Union[typing.Dict, None]:
+        """Same as DYDB.update"""
+        table = table or self.table
+        dydb = await self.client()
+        original = updates = self._update_values(data, merge, append, add, remove)
+        for attempt in range(MAX_MAP_RETRIES + 1):
+            try:
+                resp = await dydb.update_item(
+                    **self._update_request(key, table, updates, condition, names, values, return_values))
+                break
+            except botocore.exceptions.ClientError as err:
+                updates = self._missing_maps(err, original, updates)
+                if updates is None or attempt == MAX_MAP_RETRIES:
+                    raise
+        return self.unmapper(resp["Attributes"]) if "Attributes" in resp else None
+
+    async def query(
+        self,
+        key_condition: str,
+        values: typing.Dict = None,
+        names: typing.Dict[str, str] = None,
+        table: str = None,
+        index: str = None,
+        filter_expression: str = None,
+        projection: typing.List[str] = None,
+        limit: int = None,
+        page_size: int = None,
+        scan_forward: bool = True,
+        consistent_read: bool = False
+    ) -> typing.AsyncIterator[typing.Dict]:
+        """Same as DYDB.query, as an async generator"""
+        request = {
+            "TableName": table or self.table,
+            "KeyConditionExpression": key_condition,
+            "ScanIndexForward": scan_forward,
+            "ConsistentRead": consistent_read,
+            **self._expression_kwargs(names, values, projection),
+        }
+        if index:
+            request["IndexName"] = index
+        if filter_expression:
+            request["FilterExpression"] = filter_expression
+        if page_size:
+            request["Limit"] = page_size
+        dydb = await self.client()
+        count = 0
+        while True:
+            resp = await dydb.query(**request)
+            for item in resp.get("Items", []):
+                yield self.unmapper(item)
+                count += 1
+                if limit and count >= limit:
+                    return
+            if "LastEvaluatedKey" not in resp:
+                return
+            request["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+
+class AsyncSQS(_Shared):
+    service = "sqs"
+
+    def __init__(
+        self,
+        queue: str = None,
+        aws_access_key_id=os.environ.get("AWS_ACCESS_KEY_ID", None),
+        aws_secret_access_key=os.environ.get("AWS_SECRET_ACCESS_KEY", None),
+        region_name=os.environ.get("AWS_DEFAULT_REGION", None),
+        endpoint_url: str = None,
+        max_pool_connections: int = 100,
+        retry_policy: RetryPolicy = None,
+        metrics: Metrics = None
+    ):
+        super().__init__(
+            aws_access_key_id, aws_secret_access_key, region_name, endpoint_url, max_pool_connections, retry_policy,
+            metrics)
+        self.queue = queue
+
+    @sqs_err.errorhandler
+    async def publish(self, message: SQSMessage, queue: str = None) -> typing.Dict:
+        queue = queue or self.queue
+        request = {"QueueUrl": queue, "MessageBody": json.dumps(message.body)}
+        if queue.endswith(".fifo"):
+            request["MessageDeduplicationId"] = message.deduplication_id
+            request["MessageGroupId"] = message.group_id
+        sqs = await self.client()
+        resp = await sqs.send_message(**request)
+        logger.debug(f"Sent message to SQS ({queue}) with ID: {resp['MessageId']}")
+        return resp
+
+    @sqs_err.errorhandler
+    async def pool(
+        self,
+        queue: str = None,
+        attribute_names: typing.List[ReceiveAttributeNames] = [
+            ReceiveAttributeNames.ALL.value],
+        message_attribute_names: typing.List = [],
+        max_number_of_messages: int = 10,  # 1 - 10
+        visibility_timeout: int = 30,  # 0 - 43200
+        wait_time_seconds: int = 5,  # 0 - 20
+        receive_request_attempt_id: str = None
+    ) -> typing.List[typing.Union[ReturnedSQSMessages, None]]:
+        sqs = await self.client()
+        resp = await sqs.receive_message(
+            QueueUrl=queue or self.queue,
+            AttributeNames=attribute_names,
+            MessageAttributeNames=message_attribute_names,
+            MaxNumberOfMessages=max_number_of_messages,
+            VisibilityTimeout=visibility_timeout,
+            WaitTimeSeconds=wait_time_seconds,
+            ReceiveRequestAttemptId=receive_request_attempt_id or uuid.uuid1().hex
+        )
+        return resp.get("Messages", [])
+
+    async def delete_batch(self, receipt_handles: typing.List[str], queue: str = None) -> int:
+        """Acknowledge messages with concurrent DeleteMessageBatch calls of 10, return how many were deleted"""
+        queue = queue or self.queue
+        sqs = await self.client()
+
+        async def delete(receipts):
+            entries = [{"Id": str(n), "ReceiptHandle": receipt} for n, receipt in enumerate(receipts)]
+            try:
+                resp = await self._delete_entries(sqs, queue, entries)
+            except sqs_err.SQSError as err:
+                logger.error(f"DeleteMessageBatch on {queue} failed: {err}")
+                return 0
+            for entry in resp.get("Failed", []):
+                logger.error(f"Failed to delete message from {queue}: {entry.get('Message', entry['Code'])}")
+            return len(resp.get("Successful", []))
+
+        return sum(await asyncio.gather(*(
+            delete(receipt_handles[i:i + MAX_BATCH_ENTRIES])
+            for i in range(0, len(receipt_handles), MAX_BATCH_ENTRIES)
+        )))
+
+    @sqs_err.errorhandler
+    async def _delete_entries(self, sqs, queue: str, entries: typing.List[typing.Dict]) -> typing.Dict:
+        """One DeleteMessageBatch call, throttled and transient failures are retried along retry_policy"""
+        return await sqs.delete_message_batch(QueueUrl=queue, Entries=entries)
@@ -1,36 +1,262 @@
 import os
 import uuid
-import boto3
 import typing
 import logging
-from .err.dydb import errorhandler
+import botocore
+import functools
+import itertools
+from .err.dydb import errorhandler, ERRORS, DYDBError, TransactionCanceledException
+from .err.base import CALL_ERRORS, AWSError, NotFoundError, RetryPolicy, Retrier, ThrottlingError, default_policy
+from .utils.clients import ClientFactory, default_factory
+from .utils.metrics import Metrics
+from .utils.pool import bounded_map, chunked, interleave
+from .utils.cache import ReadCache, cache_key
+from .utils.ratelimit import RateLimiter
+from .utils.serializer import serialize, serialize_item, deserialize, deserialize_item
+from .utils.expression import UpdateShape, EMPTY_LIST, compile_update, fill_missing_maps, flatten, parents, \
+    parse_path
+from .schema.dydb import DYDBBatchResult, DYDBCancellationReason, DYDBTransactionResult
 
-logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s -- [%(module)s:%(lineno)s - %(levelname)s] -- %(message)s"
-)
 logger = logging.getLogger(__name__)
 
+# updates re-sent for maps created or removed concurrently before giving up
+MAX_MAP_RETRIES = 3
+MAX_TRANSACTION_ITEMS = 100
+MAX_TRANSACTION_BYTES = 4 * 1024 ** 2
+# cancellation reasons that say nothing about the request itself, the transaction is retried
+RETRYABLE_CANCELLATIONS = {
+    "None", "TransactionConflict", "ThrottlingError", "ProvisionedThroughputExceeded", "RequestLimitExceeded",
+}
 
-class DYDB:
+
+def request_size(value: typing.Any) -> int:
+    """
+    Bytes of the names and values of a request in wire format (strings UTF-8 encoded, binaries as
+    is), a close upper bound of the item sizes DynamoDB counts against its limits
+    """
+    if isinstance(value, dict):
+        return sum(len(name.encode()) + request_size(member) for name, member in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return sum(request_size(member) for member in value)
+    if isinstance(value, str):
+        return len(value.encode())
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    return 1
+
+
+def retryable_transaction(error: AWSError) -> typing.Union[bool, None]:
+    """
+    Whether a failed transaction can be sent again as is: True for conflicts with concurrent
+    writes, False when an operation itself was rejected, None leaves it to the error's category
+    """
+    if error.code in ("TransactionConflictException", "TransactionInProgressException"):
+        return True
+    if isinstance(error, TransactionCanceledException):
+        codes = {reason.get("Code", "None") for reason in error.response.get("CancellationReasons", [])}
+        return codes <= RETRYABLE_CANCELLATIONS
+    return None
+
+
+class DYDBRequests:
+    """Request building and (de)serialization shared by DYDB and the asyncio client"""
+
+    use_decimal = False
+
+    def _expression_kwargs(
+        self,
+        names: typing.Dict[str, str] = None,
+        values: typing.Dict = None,
+        projection: typing.List[str] = None
+    ) -> typing.Dict:
+        """ExpressionAttributeNames/Values and ProjectionExpression, projection paths get #p placeholders"""
+        kwargs = {}
+        names = dict(names or {})
+        if projection:
+            paths = []
+            for path in projection:
+                parts = []
+                for part in path.split("."):
+                    placeholder = f"#p{len(paths)}_{len(parts)}"
+                    names[placeholder] = part
+                    parts.append(placeholder)
+                paths.append(".".join(parts))
+            kwargs["ProjectionExpression"] = ", ".join(paths)
+        if names:
+            kwargs["ExpressionAttributeNames"] = names
+        if values:
+            kwargs["ExpressionAttributeValues"] = {
+                k: self.mapper(v, include=True) for k, v in values.items()}
+        return kwargs
+
+    @staticmethod
+    def _found(resp: typing.Dict, key: typing.Dict, table: str) -> typing.Dict:
+        """The wire item of a GetItem response, DYDBNotFoundError when the key has no item"""
+        if "Item" not in resp:
+            raise ERRORS.generic[NotFoundError]("ItemNotFound", f"No item with key {key} in {table}", "GetItem")
+        return resp["Item"]
+
+    @staticmethod
+    def _key_id(item: typing.Dict, key_attrs: typing.List[str]) -> typing.Any:
+        """Hashable identity of an item's primary key, the bare value for single attribute keys"""
+        if len(key_attrs) == 1:
+            return item.get(key_attrs[0])
+        return tuple(item.get(attr) for attr in key_attrs)
+
+    @staticmethod
+    def _update_values(
+        data: typing.Dict = None,
+        merge: bool = True,
+        append: typing.Dict = None,
+        add: typing.Dict = None,
+        remove: typing.List[str] = None
+    ) -> typing.Tuple[UpdateShape, typing.List[typing.Any]]:
+        """Shape of an update and its values, in the order compile_update binds them"""
+        sets = list(flatten(data or {}, merge))
+        appends, adds = list(flatten(append or {})), list(flatten(add or {}))
+        shape = UpdateShape(
+            set=tuple(path for path, _ in sets),
+            append=tuple(path for path, _ in appends),
+            add=tuple(path for path, _ in adds),
+            remove=tuple(parse_path(path) for path in remove or ()),
+            exists=parents(path for path, _ in sets),
+        )
+        return shape, [value for _, value in (*sets, *appends, *adds)]
+
+    def _missing_maps(
+        self,
+        err: botocore.exceptions.ClientError,
+        original: typing.Tuple[UpdateShape, typing.List],
+        sent: typing.Tuple[UpdateShape, typing.List]
+    ) -> typing.Union[typing.Tuple[UpdateShape, typing.List], None]:
+        """
+        The update to send instead of sent when it failed its guard on the parent maps, rewritten
+        from original for the item returned with the failure; None when nothing changes, the
+        error is then the caller's own condition (or not a condition failure at all)
+        """
+        if err.response["Error"].get("Code") != "ConditionalCheckFailedException" \
+                or not (sent[0].exists or sent[0].absent):
+            return None
+        item = err.response.get("Item")
+        updates = fill_missing_maps(*original, self.unmapper(item) if item else None)
+        return None if updates == sent else updates
+
+    def _update_request(
+        self,
+        key: typing.Dict,
+        table: str,
+        updates: typing.Tuple[UpdateShape, typing.List[typing.Any]],
+        condition: str = None,
+        names: typing.Dict[str, str] = None,
+        values: typing.Dict = None,
+        return_values: str = "NONE"
+    ) -> typing.Dict:
+        """UpdateItem keyword arguments for the (shape, values) pair of _update_values"""
+        shape, bound = updates
+        compiled = compile_update(shape)
+        if not compiled.expression:
+            raise ValueError("Nothing to update")
+        expression_attribute_names = dict(compiled.names)
+        expression_attribute_values = {
+            placeholder: self.mapper(value, include=True)
+            for placeholder, value in zip(compiled.values, bound)
+        }
+        if compiled.empty_list:
+            expression_attribute_values[EMPTY_LIST] = {"L": []}
+        request = {
+            "TableName": table,
+            "Key": self.mapper(key),
+            "UpdateExpression": compiled.expression,
+            "ReturnValues": return_values,
+        }
+        if compiled.condition:
+            request["ConditionExpression"] = compiled.condition
+            # the failure then carries the item, to tell which maps are missing
+            request["ReturnValuesOnConditionCheckFailure"] = "ALL_OLD"
+        if condition:
+            request["ConditionExpression"] = \
+                f"({condition}) AND ({compiled.condition})" if compiled.condition else condition
+            extra = self._expression_kwargs(names, values)
+            clash = (extra.get("ExpressionAttributeNames", {}).keys() & expression_attribute_names.keys()) | \
+                (extra.get("ExpressionAttributeValues", {}).keys() & expression_attribute_values.keys())
+            if clash:
+                raise ValueError(f"Condition placeholders {sorted(clash)} are reserved for the update")
+            expression_attribute_names.update(extra.get("ExpressionAttributeNames", {}))
+            expression_attribute_values.update(extra.get("ExpressionAttributeValues", {}))
+        if expression_attribute_names:
+            request["ExpressionAttributeNames"] = expression_attribute_names
+        if expression_attribute_values:
+            request["ExpressionAttributeValues"] = expression_attribute_values
+        return request
+
+    #
+    # Below are utility functions used for AWS DYDB
+    #
+    def mapper(self, data, include=False):
+        """Map plain python to DynamoDB data scheme, data is an item unless include is set"""
+        if include:
+            return serialize(data)
+        return serialize_item(data)
+
+    def unmapper(self, data: typing.Dict, include=False) -> typing.Any:
+        """Map DynamoDB data scheme back to plain python, data is an item unless include is set"""
+        if include:
+            return deserialize(data, self.use_decimal)
+        return deserialize_item(data, self.use_decimal)
+
+
+class DYDB(DYDBRequests):
     def __init__(
         self,
         table = None,
         aws_access_key_id=os.environ.get("AWS_ACCESS_KEY_ID", None),
         aws_secret_access_key=os.environ.get(
             "AWS_SECRET_ACCESS_KEY", None),
-        region_name=os.environ.get("AWS_DEFAULT_REGION", None)
+        region_name=os.environ.get("AWS_DEFAULT_REGION", None),
+        use_decimal: bool = False,
+        clients: ClientFactory = None,
+        retry_policy: RetryPolicy = None,
+        cache: ReadCache = None,
+        rate_limiter: RateLimiter = None
     ):
         self.table = table
-        self.dydb = boto3.client(
-            'dynamodb',
-            aws_access_key_id=aws_access_key_id,
-            aws_secret_access_key=aws_secret_access_key,
-            region_name=region_name
-        )
+        # read non integral numbers as Decimal instead of float
+        self.use_decimal = use_decimal
+        # the client is built on first use and shared with every instance of the same factory
+        self.clients = clients or default_factory()
+        self._credentials = {
+            "aws_access_key_id": aws_access_key_id,
+            "aws_secret_access_key": aws_secret_access_key,
+            "region_name": region_name,
+        }
+        # retries of throttled and transient errors, shared by every DYDB instance by default
+        self.retry_policy = retry_policy or default_policy("dynamodb")
+        # optional read-through cache of get/batch_get, invalidated by writes made through this instance
+        self.cache = cache
+        # table -> key attribute names, from DescribeTable
+        self._key_attrs: typing.Dict[str, typing.Tuple[str, ...]] = {}
+        # optional capacity aware pacing of this instance's calls, made through a client of its own
+        self.rate_limiter = rate_limiter
 
-    @staticmethod
-    @errorhandler
-    def exists(self, table: str = None) -> None:
+    @functools.cached_property
+    def dydb(self):
+        """
+        Client, taken from the factory's cache on first use; with a rate_limiter the instance gets
+        a client of its own so the pacing never applies to other instances of the factory
+        """
+        if self.rate_limiter is None:
+            return self.clients.client('dynamodb', **self._credentials)
+        client = self.clients.new_client('dynamodb', **self._credentials)
+        self.rate_limiter.attach(client)
+        return client
+
+    @property
+    def metrics(self) -> typing.Union[Metrics, None]:
+        """Metrics of the client factory, retries made along retry_policy are counted there"""
+        return self.clients.metrics
+
+    @errorhandler(not_found=False)
+    def exists(self, table: str = None) -> bool:
         table = table or self.table
         self.dydb.describe_table(
             TableName=table
@@ -39,119 +265,622 @@ class DYDB:
     @errorhandler
     def get(self, key: typing.Dict, table: str = None) -> typing.Dict:
         table = table or self.table
-        return self.dydb.get_item(
-            TableName=table,
-            Key=self.mapper(key)
-        )['Item']
+        if self.cache is None:
+            return self.unmapper(self._found(self.dydb.get_item(
+                TableName=table,
+                Key=self.mapper(key)
+            ), key, table))
+        cached = cache_key(table, key)
+        item = self.cache.get(cached)
+        if item is None:
+            token = self.cache.token()
+            item = self._found(self.dydb.get_item(TableName=table, Key=self.mapper(key)), key, table)
+            self.cache.key_attrs.setdefault(table, tuple(key))
+            self.cache.set(cached, item, token)
+        return self.unmapper(item)
 
     @errorhandler
     def delete(self, key: dict, table: str = None) -> None:
         table = table or self.table
-        self.dydb.delete_item(
-            TableName=table,
-            Key=self.mapper(key)
-        )
+        try:
+            self.dydb.delete_item(
+                TableName=table,
+                Key=self.mapper(key)
+            )
+        finally:
+            if self.cache is not None:
+                self.cache.invalidate(cache_key(table, key))
 
     @errorhandler
     def create(self, table: str, data: typing.Dict) -> None:
-        self.dydb.put_item(
-            TableName=table,
-            Item=self.mapper(data)
-        )
+        try:
+            self.dydb.put_item(
+                TableName=table,
+                Item=self.mapper(data)
+            )
+        finally:
+            if self.cache is not None:
+                self._invalidate_item(table, data)
 
     @errorhandler
-    def update(self, key: typing.Dict, data: typing.Dict, table: str = None) -> None:
-        """Add if don't have and merge if have (list append not supported yet)"""
+    def update(
+        self,
+        key: typing.Dict,
+        data: typing.Dict = None,
+        table: str = None,
+        merge: bool = True,
+        append: typing.Dict = None,
+        add: typing.Dict = None,
+        remove: typing.List[str] = None,
+        condition: str = None,
+        names: typing.Dict[str, str] = None,
+        values: typing.Dict = None,
+        return_values: str = "NONE"
+    ) -> typing.Union[typing.Dict, None]:
+        """
+        Add if don't have and merge if have, in a single UpdateItem call
+        Nested dicts in data are merged path by path, merge=False replaces top level attributes
+        append maps list attributes to the items appended to them (the list is created when missing),
+        add maps number attributes to increments (or set attributes to new members) through ADD,
+        remove lists attribute paths to delete
+        condition is a ConditionExpression over names/values (plain python), the write only happens
+        when it holds; do not use the #n<i>/:v<i> placeholders reserved for the update itself
+        Returns the plain attributes asked for by return_values ("ALL_NEW", "UPDATED_OLD", ...)
+        DynamoDB cannot create a missing map and set a path inside it in one expression: nested paths
+        are guarded by their parent maps existing, when one is missing the update is re-sent with
+        only the missing maps set as a whole (taken from the item returned with the failure)
+        """
         table = table or self.table
+        original = updates = self._update_values(data, merge, append, add, remove)
         try:
-            update_expression, \
-                expression_attribute_names, \
-                expression_attribute_values = self.__get_update_expressions(
-                    data)
+            for attempt in range(MAX_MAP_RETRIES + 1):
+                try:
+                    resp = self.dydb.update_item(
+                        **self._update_request(key, table, updates, condition, names, values, return_values))
+                    break
+                except botocore.exceptions.ClientError as err:
+                    updates = self._missing_maps(err, original, updates)
+                    if updates is None or attempt == MAX_MAP_RETRIES:
+                        raise
+        finally:
+            if self.cache is not None:
+                self.cache.invalidate(cache_key(table, key))
+        return self.unmapper(resp["Attributes"]) if "Attributes" in resp else None
 
-            self.dydb.update_item(
-                TableName=table,
-                Key=self.mapper(key),
-                UpdateExpression=update_expression,
-                ExpressionAttributeNames=expression_attribute_names,
-                ExpressionAttributeValues=expression_attribute_values,
-            )
-        except:
-            update_expression, \
-                expression_attribute_names, \
-                expression_attribute_values = self.__get_update_expressions(
-                    data, merge=False)
+    def batch_write(
+        self,
+        items: typing.Iterable[typing.Dict] = (),
+        deletes: typing.Iterable[typing.Dict] = (),
+        table: str = None,
+        max_workers: int = 4,
+        max_retries: int = 8,
+        key_attrs: typing.List[str] = None
+    ) -> DYDBBatchResult:
+        """
+        Put items and delete keys with BatchWriteItem, 25 requests per call sent from max_workers threads
+        Both iterables are consumed lazily, unprocessed items and throttled calls are retried along
+        the retry policy (backoff, quota, shared pause) up to max_retries times and counted as
+        failed afterwards
+        A call holds one request per key, a later write of a key replaces the earlier one instead
+        of failing the call (as boto3's overwrite_by_pkeys), only the requests sent are counted;
+        key_attrs are the table's key attribute names, read from DescribeTable when not given
+        Other errors (missing table, invalid items, ...) are raised as the typed DYDB errors
+        """
+        table = table or self.table
+        key_attrs = tuple(key_attrs or self._key_schema(table))
+        requests = itertools.chain(
+            ({"PutRequest": {"Item": self.mapper(item)}} for item in items),
+            ({"DeleteRequest": {"Key": self.mapper(key)}} for key in deletes)
+        )
+        result = DYDBBatchResult()
+        for chunk, future in bounded_map(
+            lambda chunk: self._batch_write_chunk(chunk, table, max_retries),
+            self._write_chunks(requests, key_attrs),
+            max_workers
+        ):
+            failed, error = future.result()
+            if self.cache is not None:
+                self._invalidate_requests(table, chunk)
+            puts = sum(1 for r in chunk if "PutRequest" in r)
+            failed_puts = sum(1 for r in failed if "PutRequest" in r)
+            result.written += puts - failed_puts
+            result.deleted += len(chunk) - puts - (len(failed) - failed_puts)
+            if failed:
+                result.failed += len(failed)
+                result.failed_items.extend(failed)
+                result.errors.append(error)
+        return result
 
-            self.dydb.update_item(
-                TableName=table,
-                Key=self.mapper(key),
-                UpdateExpression=update_expression,
-                ExpressionAttributeNames=expression_attribute_names,
-                ExpressionAttributeValues=expression_attribute_values,
+    @staticmethod
+    def _write_chunks(
+        requests: typing.Iterable[typing.Dict],
+        key_attrs: typing.Tuple[str, ...]
+    ) -> typing.Iterator[typing.List[typing.Dict]]:
+        """BatchWriteItem chunks of 25 distinct keys, the last request of a key within a chunk wins"""
+        chunk = {}
+        for request in requests:
+            item = request["PutRequest"]["Item"] if "PutRequest" in request else request["DeleteRequest"]["Key"]
+            key = tuple(tuple(item[attr].items()) if attr in item else None for attr in key_attrs)
+            chunk[key] = request
+            if len(chunk) == 25:
+                yield list(chunk.values())
+                chunk = {}
+        if chunk:
+            yield list(chunk.values())
+
+    @errorhandler
+    def _key_schema(self, table: str) -> typing.Tuple[str, ...]:
+        """Key attribute names of table, DescribeTable is called once per table"""
+        if table not in self._key_attrs:
+            schema = self.dydb.describe_table(TableName=table)["Table"]["KeySchema"]
+            self._key_attrs[table] = tuple(key["AttributeName"] for key in schema)
+        return self._key_attrs[table]
+
+    def _batch_write_chunk(
+        self,
+        requests: typing.List[typing.Dict],
+        table: str,
+        max_retries: int
+    ) -> typing.Tuple[typing.List[typing.Dict], typing.Union[str, None]]:
+        """Send one BatchWriteItem chunk until everything is processed, return what is left and why"""
+        retrier = Retrier(self.retry_policy, max_retries, self.metrics)
+        pending = requests
+        while True:
+            retrier.pause()
+            try:
+                resp = self.dydb.batch_write_item(RequestItems={table: pending})
+            except CALL_ERRORS as err:
+                error = ERRORS.from_exception(err)
+                if not error.retryable:
+                    raise error from err
+            else:
+                pending = resp.get("UnprocessedItems", {}).get(table, [])
+                if not pending:
+                    retrier.succeeded()
+                    return [], None
+                error = self._unprocessed(len(pending), "items", "BatchWriteItem")
+            if not retrier.retry(error):
+                break
+        logger.error(f"BatchWriteItem on {table} failed for {len(pending)} items after {retrier.retries} retries: {error}")
+        return pending, str(error)
+
+    @staticmethod
+    def _unprocessed(count: int, what: str, operation: str) -> ThrottlingError:
+        """Unprocessed entries of a batch, DynamoDB's way of throttling part of it"""
+        return ERRORS.generic[ThrottlingError](f"Unprocessed{what.title()}", f"{count} {what} unprocessed", operation)
+
+    def _invalidate_item(self, table: str, item: typing.Dict) -> None:
+        """
+        Drop the cached entry of a full item, the table's key attributes are read once from its
+        KeySchema when no get has recorded them, if that fails the whole cache is cleared
+        """
+        if table not in self.cache.key_attrs:
+            try:
+                self.cache.key_attrs.setdefault(table, self._key_schema(table))
+            except DYDBError as err:
+                logger.warning(f"Cannot read the key schema of {table} ({err}), clearing the cache")
+                self.cache.clear()
+                return
+        self.cache.invalidate_item(table, item)
+
+    def _invalidate_requests(self, table: str, requests: typing.List[typing.Dict]) -> None:
+        """Drop the cached items a BatchWriteItem chunk touched"""
+        for request in requests:
+            if "PutRequest" in request:
+                self._invalidate_item(table, self.unmapper(request["PutRequest"]["Item"]))
+            else:
+                self.cache.invalidate(cache_key(table, self.unmapper(request["DeleteRequest"]["Key"])))
+
+    def batch_get(
+        self,
+        keys: typing.Iterable[typing.Dict],
+        table: str = None,
+        projection: typing.List[str] = None,
+        as_dict: bool = False,
+        consistent_read: bool = False,
+        max_workers: int = 4,
+        max_retries: int = 8
+    ) -> typing.Union[typing.List[typing.Union[typing.Dict, None]], typing.Dict]:
+        """
+        Fetch many keys with BatchGetItem, 100 keys per call sent from max_workers threads
+        Returns plain items in the order of keys (None when missing), or with as_dict a dict from
+        the key values (a tuple for composite keys) to items
+        projection lists the attribute paths to read, the key attributes are always fetched
+        With a cache, keys it holds are not requested; reads with a projection or consistent_read
+        bypass it
+        Keys still unprocessed after max_retries raise a DYDBThrottlingError and other failures their
+        typed DYDB error, None only ever means the item does not exist
+        """
+        table = table or self.table
+        keys = list(keys)
+        if not keys:
+            return {} if as_dict else []
+        key_attrs = list(keys[0])
+        unique = {self._key_id(key, key_attrs): key for key in keys}
+
+        found = {}
+        cached = self.cache is not None and not projection and not consistent_read
+        if cached:
+            self.cache.key_attrs.setdefault(table, tuple(key_attrs))
+            token = self.cache.token()
+            pending = {}
+            for key_id, key in unique.items():
+                item = self.cache.get(cache_key(table, key))
+                if item is None:
+                    pending[key_id] = key
+                else:
+                    found[key_id] = self.unmapper(item)
+            unique = pending
+
+        request = {"ConsistentRead": consistent_read}
+        if projection:
+            request.update(self._expression_kwargs(
+                projection=[*key_attrs, *(p for p in projection if p not in key_attrs)]))
+
+        for _, future in bounded_map(
+            lambda chunk: self._batch_get_chunk(chunk, table, request, max_retries),
+            chunked((self.mapper(key) for key in unique.values()), 100),
+            max_workers
+        ):
+            for raw in future.result():
+                item = self.unmapper(raw)
+                key_id = self._key_id(item, key_attrs)
+                if cached:
+                    self.cache.set(cache_key(table, {attr: item[attr] for attr in key_attrs}), raw, token)
+                if projection:
+                    item = {k: v for k, v in item.items() if k not in key_attrs or k in projection}
+                found[key_id] = item
+
+        if as_dict:
+            return found
+        return [found.get(self._key_id(key, key_attrs)) for key in keys]
+
+    def _batch_get_chunk(
+        self,
+        keys: typing.List[typing.Dict],
+        table: str,
+        request: typing.Dict,
+        max_retries: int
+    ) -> typing.List[typing.Dict]:
+        """Send one BatchGetItem chunk, retrying UnprocessedKeys, and return the raw items"""
+        retrier = Retrier(self.retry_policy, max_retries, self.metrics)
+        items, pending = [], keys
+        while True:
+            retrier.pause()
+            try:
+                resp = self.dydb.batch_get_item(RequestItems={table: {**request, "Keys": pending}})
+            except CALL_ERRORS as err:
+                error = ERRORS.from_exception(err)
+                if not retrier.retry(error):
+                    raise error from err
+                continue
+            items.extend(resp.get("Responses", {}).get(table, []))
+            pending = resp.get("UnprocessedKeys", {}).get(table, {}).get("Keys", [])
+            if not pending:
+                retrier.succeeded()
+                return items
+            error = self._unprocessed(len(pending), "keys", "BatchGetItem")
+            if not retrier.retry(error):
+                # unanswered keys must not read as missing items
+                logger.error(f"BatchGetItem on {table} failed for {len(pending)} keys after {retrier.retries} retries")
+                raise error
+
+    def transaction(self, max_retries: int = 5, return_old_on_failure: bool = False) -> "DYDBTransaction":
+        """
+        Builder collecting puts, updates, deletes and condition checks for TransactWriteItems,
+        see DYDBTransaction; as a context manager it commits when the block exits cleanly
+        """
+        return DYDBTransaction(self, max_retries, return_old_on_failure)
+
+    def transact_get(
+        self,
+        keys: typing.Iterable[typing.Dict],
+        table: str = None,
+        projection: typing.List[str] = None,
+        max_retries: int = 5
+    ) -> typing.List[typing.Union[typing.Dict, None]]:
+        """
+        Read keys with TransactGetItems, a consistent snapshot of up to 100 keys per call
+        Returns plain items in the order of keys (None when missing), calls cancelled by a
+        concurrent transaction, throttled or failing transiently are retried along the retry
+        policy up to max_retries times
+        """
+        table = table or self.table
+        extra = self._expression_kwargs(projection=projection)
+        items = []
+        for chunk in chunked(keys, MAX_TRANSACTION_ITEMS):
+            request = [{"Get": {"TableName": table, "Key": self.mapper(key), **extra}} for key in chunk]
+            retrier = Retrier(self.retry_policy, max_retries, self.metrics)
+            while True:
+                retrier.pause()
+                try:
+                    resp = self.dydb.transact_get_items(TransactItems=request)
+                    retrier.succeeded()
+                    break
+                except CALL_ERRORS as err:
+                    error = ERRORS.from_exception(err)
+                    if not retrier.retry(error, retryable_transaction(error)):
+                        raise error from err
+            items.extend(
+                self.unmapper(response["Item"]) if "Item" in response else None
+                for response in resp["Responses"]
             )
+        return items
 
-    #
-    # Below are utility functions used for AWS DYDB
-    #
-    def mapper(self, data, include=False):
-        if include:
-            return self.__mapper(data)
-        else:
-            return self.__mapper(data)['M']
-
-    def __mapper(self, data: typing.Any) -> typing.Dict:
-        """Map dictionary data to DynamoDB-support data scheme recursively"""
-        datatype = type(data)
-        if datatype == str:
-            return {"S": data}
-        elif datatype == bool:
-            return {"BOOL": data}
-        elif datatype == float or datatype == int:
-            return {"N": str(data)}
-        elif datatype == list:
-            return {"L": [self.__mapper(x) for x in data]}
-        elif datatype == dict:
-            _map = {}
-            for k, v in data.items():
-                _map[k] = self.__mapper(v)
-            return {"M": _map}
-
-    def __flatten(self, data: typing.Dict, sep='.#') -> typing.Dict:
-        d = {}
-        for k, v in data.items():
-            if isinstance(v, dict):
-                _d = {sep.join([k, _k]): _v for _k,
-                      _v in self.__flatten(v).items()}
-                d.update(_d)
+    def query(
+        self,
+        key_condition: str,
+        values: typing.Dict = None,
+        names: typing.Dict[str, str] = None,
+        table: str = None,
+        index: str = None,
+        filter_expression: str = None,
+        projection: typing.List[str] = None,
+        limit: int = None,
+        page_size: int = None,
+        scan_forward: bool = True,
+        consistent_read: bool = False
+    ) -> typing.Iterator[typing.Dict]:
+        """
+        Lazily yield plain items matching key_condition, following LastEvaluatedKey across pages
+        values holds plain python expression values ({":id": "<id>"}), names the #placeholders
+        limit caps the number of items yielded, page_size the items evaluated per request
+        """
+        request = {
+            "TableName": table or self.table,
+            "KeyConditionExpression": key_condition,
+            "ScanIndexForward": scan_forward,
+            "ConsistentRead": consistent_read,
+            **self._expression_kwargs(names, values, projection),
+        }
+        if index:
+            request["IndexName"] = index
+        if filter_expression:
+            request["FilterExpression"] = filter_expression
+        yield from self._paginate("query", request, limit, page_size)
+
+    def scan(
+        self,
+        table: str = None,
+        filter_expression: str = None,
+        values: typing.Dict = None,
+        names: typing.Dict[str, str] = None,
+        projection: typing.List[str] = None,
+        index: str = None,
+        segments: int = 1,
+        max_workers: int = None,
+        limit: int = None,
+        page_size: int = None,
+        consistent_read: bool = False
+    ) -> typing.Iterator[typing.Dict]:
+        """
+        Lazily yield plain items of the table, with segments > 1 it runs a parallel Scan where
+        each Segment/TotalSegments slice is paginated on its own thread (max_workers, default
+        one per segment) and items are yielded in arrival order
+        limit caps the number of items yielded per segment, page_size the items evaluated per request
+        """
+        request = {
+            "TableName": table or self.table,
+            "ConsistentRead": consistent_read,
+            **self._expression_kwargs(names, values, projection),
+        }
+        if index:
+            request["IndexName"] = index
+        if filter_expression:
+            request["FilterExpression"] = filter_expression
+        if segments <= 1:
+            yield from self._paginate("scan", request, limit, page_size)
+            return
+        sources = [
+            functools.partial(
+                self._paginate, "scan",
+                {**request, "Segment": segment, "TotalSegments": segments}, limit, page_size)
+            for segment in range(segments)
+        ]
+        yield from interleave(sources, max_workers or segments)
+
+    def _paginate(
+        self,
+        operation: str,
+        request: typing.Dict,
+        limit: int = None,
+        page_size: int = None
+    ) -> typing.Iterator[typing.Dict]:
+        """Call query or scan until LastEvaluatedKey runs out (or limit is reached), yielding plain items"""
+        request = dict(request)
+        if page_size:
+            request["Limit"] = page_size
+        count = 0
+        while True:
+            resp = self._page(operation, request)
+            for item in resp.get("Items", []):
+                yield self.unmapper(item)
+                count += 1
+                if limit and count >= limit:
+                    return
+            if "LastEvaluatedKey" not in resp:
+                return
+            request["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+    @errorhandler
+    def _page(self, operation: str, request: typing.Dict) -> typing.Dict:
+        """One query or scan request, retried and typed like every other call"""
+        return getattr(self.dydb, operation)(**request)
+
+
+class DYDBTransaction:
+    """
+    Collects writes for TransactWriteItems and sends them on commit()
+    Operations are split into transactions of at most 100 items and 4MB, each of which is
+    atomic on its own; a batch that fits one transaction is all or nothing
+    A transaction cancelled only by conflicts or throttling is re-sent with backoff (up to
+    max_retries times) under the same ClientRequestToken, one cancelled by a failed condition
+    or an invalid item is reported in the result with a reason per offending operation
+    Updates take the arguments of DYDB.update, but are not re-sent when a nested path's parent map
+    is missing: the transaction is cancelled with ConditionalCheckFailed for that operation
+    """
+
+    def __init__(self, dydb: DYDB, max_retries: int = 5, return_old_on_failure: bool = False):
+        self.dydb = dydb
+        self.max_retries = max_retries
+        self.return_old_on_failure = return_old_on_failure
+        # conflicts, throttles and transient failures are retried along the table's policy
+        self.retry_policy = dydb.retry_policy
+        self.result = None
+        self._operations: typing.List[typing.Tuple[typing.Dict, str, typing.Dict]] = []
+
+    def __len__(self) -> int:
+        return len(self._operations)
+
+    def __enter__(self) -> "DYDBTransaction":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+
+    def _add(self, kind: str, request: typing.Dict, key: typing.Dict, condition: str, names, values):
+        if condition:
+            request["ConditionExpression"] = condition
+            request.update(self.dydb._expression_kwargs(names, values))
+            if self.return_old_on_failure:
+                request["ReturnValuesOnConditionCheckFailure"] = "ALL_OLD"
+        self._operations.append(({kind: request}, request["TableName"], key))
+        return self
+
+    def put(
+        self,
+        data: typing.Dict,
+        table: str = None,
+        condition: str = None,
+        names: typing.Dict[str, str] = None,
+        values: typing.Dict = None
+    ) -> "DYDBTransaction":
+        """Put data, only when condition holds (e.g. "attribute_not_exists(id)") if given"""
+        request = {"TableName": table or self.dydb.table, "Item": self.dydb.mapper(data)}
+        return self._add("Put", request, data, condition, names, values)
+
+    def update(
+        self,
+        key: typing.Dict,
+        data: typing.Dict = None,
+        table: str = None,
+        merge: bool = True,
+        append: typing.Dict = None,
+        add: typing.Dict = None,
+        remove: typing.List[str] = None,
+        condition: str = None,
+        names: typing.Dict[str, str] = None,
+        values: typing.Dict = None
+    ) -> "DYDBTransaction":
+        """Update key as DYDB.update does"""
+        table = table or self.dydb.table
+        updates = self.dydb._update_values(data, merge, append, add, remove)
+        request = self.dydb._update_request(key, table, updates, condition, names, values)
+        request.pop("ReturnValues")
+        if self.return_old_on_failure and condition:
+            request["ReturnValuesOnConditionCheckFailure"] = "ALL_OLD"
+        self._operations.append(({"Update": request}, table, key))
+        return self
+
+    def delete(
+        self,
+        key: typing.Dict,
+        table: str = None,
+        condition: str = None,
+        names: typing.Dict[str, str] = None,
+        values: typing.Dict = None
+    ) -> "DYDBTransaction":
+        request = {"TableName": table or self.dydb.table, "Key": self.dydb.mapper(key)}
+        return self._add("Delete", request, key, condition, names, values)
+
+    def condition_check(
+        self,
+        key: typing.Dict,
+        condition: str,
+        table: str = None,
+        names: typing.Dict[str, str] = None,
+        values: typing.Dict = None
+    ) -> "DYDBTransaction":
+        """Cancel the transaction unless condition holds on key, nothing is written to it"""
+        request = {"TableName": table or self.dydb.table, "Key": self.dydb.mapper(key)}
+        return self._add("ConditionCheck", request, key, condition, names, values)
+
+    def commit(self) -> DYDBTransactionResult:
+        """Send the collected operations and clear them, returns what committed and why the rest failed"""
+        operations, self._operations = self._operations, []
+        result = DYDBTransactionResult()
+        try:
+            for offset, chunk in self._split(operations):
+                committed, reasons = self._send(chunk, offset)
+                result.transactions += 1
+                if committed:
+                    result.committed += len(chunk)
+                else:
+                    result.failed += len(chunk)
+                    result.reasons.extend(reasons)
+        finally:
+            if self.dydb.cache is not None:
+                for request, table, key in operations:
+                    if "Put" in request:
+                        self.dydb._invalidate_item(table, key)
+                    else:
+                        self.dydb.cache.invalidate(cache_key(table, key))
+        self.result = result
+        return result
+
+    @staticmethod
+    def _split(operations: typing.List[typing.Tuple]) -> typing.Iterator[typing.Tuple[int, typing.List[typing.Tuple]]]:
+        """(offset, operations) groups within the item and payload limits of one transaction"""
+        start, size = 0, 0
+        for i, operation in enumerate(operations):
+            weight = request_size(operation[0])
+            if i > start and (i - start == MAX_TRANSACTION_ITEMS or size + weight > MAX_TRANSACTION_BYTES):
+                yield start, operations[start:i]
+                start, size = i, 0
+            size += weight
+        if start < len(operations):
+            yield start, operations[start:]
+
+    def _send(
+        self,
+        chunk: typing.List[typing.Tuple],
+        offset: int
+    ) -> typing.Tuple[bool, typing.List[DYDBCancellationReason]]:
+        request = {
+            "TransactItems": [operation for operation, _, _ in chunk],
+            "ClientRequestToken": uuid.uuid4().hex,
+        }
+        retrier = Retrier(self.retry_policy, self.max_retries, self.dydb.metrics)
+        while True:
+            retrier.pause()
+            try:
+                self.dydb.dydb.transact_write_items(**request)
+                retrier.succeeded()
+                return True, []
+            except CALL_ERRORS as err:
+                error = ERRORS.from_exception(err)
+            if isinstance(error, TransactionCanceledException):
+                reasons = self._reasons(error.response.get("CancellationReasons", []), chunk, offset)
             else:
-                d[k] = v
-        return d
-
-    def __get_update_expressions(self, data: typing.Dict, merge: bool = True):
-        update_expression = "SET "
-        expression_attribute_names = {}
-        expression_attribute_values = {}
-
-        if merge:
-            flattened = self.__flatten(data)
-            for i, (k, v) in enumerate(flattened.items()):
-                # uid = uuid.uuid1().hex
-                update_expression += f"{k} = :{k}"
-                if i < len(flattened) - 1:
-                    update_expression += ", "
-                for sep in k.split("."):
-                    if "#" not in sep:
-                        continue
-                    expression_attribute_names[f"{sep}"] = sep.replace("#", "")
-                expression_attribute_values[f":{k}"] = self.mapper(
-                    v, include=True)
-        else:
-            for i, (k, v) in enumerate(data.items()):
-                update_expression += f"#{k} = :{k}"
-                if i < len(data) - 1:
-                    update_expression += ","
-                expression_attribute_names[f"#{k}"] = k
-                expression_attribute_values[f":{k}"] = self.mapper(
-                    v, include=True)
-
-        return update_expression, expression_attribute_names, expression_attribute_values
+                reasons = [DYDBCancellationReason(offset, chunk[0][1], chunk[0][2], error.code, error.message)]
+            if not retrier.retry(error, retryable_transaction(error)):
+                break
+        logger.error(f"TransactWriteItems of {len(chunk)} operations failed after {retrier.retries} retries: {error}")
+        return False, reasons
+
+    def _reasons(
+        self,
+        cancellations: typing.List[typing.Dict],
+        chunk: typing.List[typing.Tuple],
+        offset: int
+    ) -> typing.List[DYDBCancellationReason]:
+        reasons = []
+        for i, (cancellation, (_, table, key)) in enumerate(zip(cancellations, chunk)):
+            if cancellation.get("Code", "None") == "None":
+                continue
+            item = cancellation.get("Item")
+            reasons.append(DYDBCancellationReason(
+                offset + i, table, key, cancellation["Code"], cancellation.get("Message", ""),
+                self.dydb.unmapper(item) if item else None))
+        return reasons
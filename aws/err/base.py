@@ -0,0 +1,398 @@
+"""
+Error layer shared by the S3, DYDB and SQS wrappers
+botocore ClientErrors are raised again as typed exceptions: every code of a service's
+*_ERROR_LIST enum gets a class deriving from the service error and from the category
+(throttling, transient, not found, conflict) that decides how the RetryPolicy reacts
+"""
+import enum
+import time
+import typing
+import asyncio
+import logging
+import botocore.exceptions
+import boto3.exceptions
+import functools
+import threading
+from ..utils.retry import backoff
+
+logger = logging.getLogger(__name__)
+
+
+class AWSError(Exception):
+    """A failed AWS call, code and message come from the error response"""
+
+    service: str = None  # botocore name of the service, set on each service's base error
+
+    def __init__(
+        self,
+        code: str,
+        message: str = "",
+        operation: str = None,
+        status: int = None,
+        response: typing.Dict = None
+    ):
+        super().__init__(f"{code}: {message}" if message else code)
+        self.code = code
+        self.message = message
+        self.operation = operation
+        self.status = status
+        self.response = response or {}
+
+    def __reduce__(self):
+        return type(self), (self.code, self.message, self.operation, self.status, self.response)
+
+    @property
+    def retryable(self) -> bool:
+        return isinstance(self, (ThrottlingError, TransientError))
+
+
+class ThrottlingError(AWSError):
+    """The service asked the caller to slow down"""
+
+
+class TransientError(AWSError):
+    """A server side failure, the same request may succeed later"""
+
+
+class NotFoundError(AWSError):
+    """The bucket, key, table, item or queue does not exist"""
+
+
+class ConflictError(AWSError):
+    """A condition, existence or concurrent modification check failed"""
+
+
+CATEGORIES = (ThrottlingError, TransientError, NotFoundError, ConflictError)
+
+# the request never got a complete response, retried as TransientError
+CONNECTION_ERRORS = (botocore.exceptions.ConnectionError, botocore.exceptions.HTTPClientError)
+# what a failed client call raises
+CALL_ERRORS = (botocore.exceptions.ClientError, *CONNECTION_ERRORS)
+
+THROTTLING_CODES = {
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "RequestThrottled",
+    "RequestThrottledException",
+    "TooManyRequestsException",
+    "ProvisionedThroughputExceededException",
+    "RequestLimitExceeded",
+    "SlowDown",
+    "OverLimit",
+    "BandwidthLimitExceeded",
+}
+TRANSIENT_CODES = {
+    "InternalError",
+    "InternalFailure",
+    "InternalServerError",
+    "ServiceUnavailable",
+    "RequestTimeout",
+    "RequestTimeoutException",
+}
+CONFLICT_CODES = {
+    "ConditionalCheckFailedException",
+    "TransactionConflictException",
+    "TransactionCanceledException",
+    "TransactionInProgressException",
+    "PreconditionFailed",
+    "OperationAborted",
+}
+
+
+def category(code: str, status: int = None) -> type:
+    """The category class of an error code (AWSError when none applies)"""
+    if code in THROTTLING_CODES or status == 429:
+        return ThrottlingError
+    if code in TRANSIENT_CODES or (status or 0) >= 500:
+        return TransientError
+    if code.startswith("NoSuch") or code.endswith(("NotFound", "NotFoundException", "NonExistentQueue")) \
+            or code == "404" or status == 404:
+        return NotFoundError
+    if code in CONFLICT_CODES or "AlreadyExists" in code or "AlreadyOwnedByYou" in code or status in (409, 412):
+        return ConflictError
+    return AWSError
+
+
+class ErrorTable:
+    """
+    Exception classes of one service: one per member of its error enum plus one per category
+    for codes outside of it, named after the service (S3ThrottlingError, ...)
+    """
+
+    def __init__(self, base: type, codes: typing.Type[enum.Enum]):
+        self.base = base
+        self.prefix = base.__name__[:-len("Error")]
+        self.by_code: typing.Dict[str, type] = {}
+        self.by_name: typing.Dict[str, type] = {}
+        for member in codes:
+            cls = self._build(member.name, category(member.value), member.value)
+            self.by_code[member.value] = self.by_name[member.name] = cls
+        self.generic = {
+            cat: self._build(f"{self.prefix}{cat.__name__}", cat)
+            for cat in CATEGORIES
+        }
+        self.by_name.update((cls.__name__, cls) for cls in self.generic.values())
+
+    def _build(self, name: str, cat: type, code: str = None) -> type:
+        bases = (self.base,) if cat is AWSError else (self.base, cat)
+        doc = f"{code} returned by {self.prefix}" if code else f"{cat.__doc__} ({self.prefix})"
+        return type(name, bases, {"__module__": self.base.__module__, "__doc__": doc})
+
+    def from_client_error(self, err: botocore.exceptions.ClientError) -> AWSError:
+        """The typed exception of a ClientError"""
+        error = err.response.get("Error", {})
+        status = err.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+        return self.from_code(
+            error.get("Code", "Unknown"), error.get("Message", ""), err.operation_name, status, err.response)
+
+    def from_code(
+        self,
+        code: str,
+        message: str = "",
+        operation: str = None,
+        status: int = None,
+        response: typing.Dict = None
+    ) -> AWSError:
+        """The typed exception of an error code, e.g. one reported per entry of a batch"""
+        cls = self.by_code.get(code) or self.generic.get(category(code, status), self.base)
+        return cls(code, message, operation, status, response)
+
+    def from_exception(self, err: BaseException) -> typing.Union[AWSError, None]:
+        """
+        The typed exception of a ClientError, of a connection failure (a TransientError) or of a
+        managed upload failure (the ClientError behind it if any), None for anything else
+        """
+        if isinstance(err, AWSError):
+            return err
+        if isinstance(err, botocore.exceptions.ClientError):
+            return self.from_client_error(err)
+        if isinstance(err, CONNECTION_ERRORS):
+            return self.generic[TransientError](type(err).__name__, str(err))
+        if isinstance(err, boto3.exceptions.S3UploadFailedError):
+            cause = self.from_exception(err.__context__) if err.__context__ is not None else None
+            # without a ClientError behind it the upload was rejected on its content (checksum)
+            return cause or self.generic[TransientError]("S3UploadFailed", str(err))
+        return None
+
+
+class RetryQuota:
+    """
+    Client-side token bucket drained by retries and refilled by successes (the AWS retry quota)
+    Once a burst of failures empties it, errors surface at once instead of piling more retries
+    on a service that is already struggling
+    """
+
+    def __init__(self, capacity: int = 500, retry_cost: int = 5, refill: int = 1):
+        self.capacity = capacity
+        self.retry_cost = retry_cost
+        self.refill = refill
+        self.tokens = capacity
+        self._lock = threading.Lock()
+
+    def acquire(self) -> bool:
+        with self._lock:
+            if self.tokens < self.retry_cost:
+                return False
+            self.tokens -= self.retry_cost
+            return True
+
+    def release(self) -> None:
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + self.refill)
+
+
+class RetryPolicy:
+    """
+    How errorhandler retries a failed call: budgets caps the retries per error category, the
+    delay is exponential backoff with full jitter, and every retry spends from the quota
+    A throttled call also pushes back every other call sharing the policy for its delay, so a
+    throttled burst slows down as a whole instead of each caller finding out on its own
+    """
+
+    def __init__(
+        self,
+        budgets: typing.Dict[type, int] = None,
+        base: float = 0.1,
+        cap: float = 20.0,
+        quota: RetryQuota = None
+    ):
+        self.budgets = {ThrottlingError: 4, TransientError: 2} if budgets is None else dict(budgets)
+        self.base = base
+        self.cap = cap
+        self.quota = quota or RetryQuota()
+        self._lock = threading.Lock()
+        self._resume_at = 0.0
+
+    def retry_delay(
+        self,
+        error: AWSError,
+        attempts: typing.Dict[type, int],
+        budget: int = None
+    ) -> typing.Union[float, None]:
+        """
+        Seconds to wait before retrying error, None to give up, attempts counts retries per category
+        Retries botocore already made for the call count against the budget, so client retries
+        never multiply the policy's; budget replaces the category budget (for callers that have
+        decided the error is retryable)
+        """
+        cat = next((cat for cat in self.budgets if isinstance(error, cat)), None)
+        if budget is None:
+            if cat is None:
+                return None
+            budget = self.budgets[cat]
+        cat = cat or type(error)
+        attempt = attempts.get(cat, 0) + error.response.get("ResponseMetadata", {}).get("RetryAttempts", 0)
+        if attempt >= budget or not self.quota.acquire():
+            return None
+        attempts[cat] = attempt + 1
+        delay = backoff(attempt, self.base, self.cap)
+        if isinstance(error, ThrottlingError):
+            with self._lock:
+                self._resume_at = max(self._resume_at, time.monotonic() + delay)
+        return delay
+
+    def pause(self) -> float:
+        """Seconds left before calls sharing the policy may be sent again after a throttle"""
+        return max(0.0, self._resume_at - time.monotonic())
+
+    def succeeded(self) -> None:
+        self.quota.release()
+
+
+class Retrier:
+    """
+    Retry state of one operation for loops errorhandler cannot wrap (batches with partial failures,
+    transfers that report a record per file): delays, budgets, quota and pause come from the
+    same RetryPolicy as the decorated calls
+    max_retries, when given, replaces the category budgets for the errors that are retryable
+    metrics (a utils.metrics.Metrics) counts every retry made
+    """
+
+    def __init__(self, policy: RetryPolicy, max_retries: int = None, metrics=None):
+        self.policy = policy
+        self.max_retries = max_retries
+        self.metrics = metrics
+        self.attempts: typing.Dict[type, int] = {}
+
+    @property
+    def retries(self) -> int:
+        return sum(self.attempts.values())
+
+    def pause(self) -> None:
+        """Wait while a throttle holds back every caller of the policy"""
+        delay = self.policy.pause()
+        if delay:
+            time.sleep(delay)
+
+    def retry(self, error: AWSError, retryable: bool = None) -> bool:
+        """
+        Sleep before the next attempt and return True, or return False when error has to surface
+        retryable overrides the category of error, e.g. for a transaction cancelled by a conflict
+        """
+        if retryable is None and self.max_retries is None:
+            delay = self.policy.retry_delay(error, self.attempts)
+        elif retryable or retryable is None and error.retryable:
+            delay = self.policy.retry_delay(error, self.attempts, self.max_retries)
+        else:
+            return False
+        if delay is None:
+            return False
+        logger.warning(f"{error.code}, retrying in {delay:.2f}s")
+        if self.metrics is not None:
+            self.metrics.record_retry(error)
+        time.sleep(delay)
+        return True
+
+    def succeeded(self) -> None:
+        self.policy.succeeded()
+
+
+_policies: typing.Dict[str, RetryPolicy] = {}
+_policies_lock = threading.Lock()
+
+
+def default_policy(service: str) -> RetryPolicy:
+    """The RetryPolicy shared by every instance of a service created without one"""
+    with _policies_lock:
+        if service not in _policies:
+            _policies[service] = RetryPolicy()
+        return _policies[service]
+
+
+_RAISE = object()
+
+
+def errorhandler_for(table: ErrorTable) -> typing.Callable:
+    """
+    Build a service's errorhandler: ClientErrors and connection failures raised by the decorated
+    method are retried along the instance's retry_policy (and counted by its metrics, if any) and
+    raised again as the service's typed exceptions
+    Use as @errorhandler, or @errorhandler(not_found=<value>) to return value when the error
+    is a NotFoundError, and @errorhandler(retry=False) for calls that must not be repeated
+    Successful calls return their result, or True for methods returning None
+    """
+
+    def errorhandler(func=None, *, not_found=_RAISE, retry: bool = True):
+        def decorate(func):
+            def retry_delay(policy, err, attempts, metrics):
+                """Seconds to wait before the next attempt, None when not_found is returned instead"""
+                error = table.from_exception(err)
+                delay = policy.retry_delay(error, attempts) if policy else None
+                if delay is None:
+                    if not_found is not _RAISE and isinstance(error, NotFoundError):
+                        return None
+                    raise error from err
+                logger.warning(f"{error.code} in {func.__qualname__}, retrying in {delay:.2f}s")
+                if metrics is not None:
+                    metrics.record_retry(error)
+                return delay
+
+            if asyncio.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def _async_wrap(*args, **kwargs):
+                    policy = getattr(args[0], "retry_policy", None) if args and retry else None
+                    metrics = getattr(args[0], "metrics", None) if policy else None
+                    attempts = {}
+                    while True:
+                        if policy and policy.pause():
+                            await asyncio.sleep(policy.pause())
+                        try:
+                            ret = await func(*args, **kwargs)
+                        except CALL_ERRORS as err:
+                            delay = retry_delay(policy, err, attempts, metrics)
+                            if delay is None:
+                                return not_found
+                            await asyncio.sleep(delay)
+                            continue
+                        if policy:
+                            policy.succeeded()
+                        return True if ret is None else ret
+
+                return _async_wrap
+
+            @functools.wraps(func)
+            def _wrap(*args, **kwargs):
+                policy = getattr(args[0], "retry_policy", None) if args and retry else None
+                metrics = getattr(args[0], "metrics", None) if policy else None
+                attempts = {}
+                while True:
+                    if policy and policy.pause():
+                        time.sleep(policy.pause())
+                    try:
+                        ret = func(*args, **kwargs)
+                    except CALL_ERRORS as err:
+                        delay = retry_delay(policy, err, attempts, metrics)
+                        if delay is None:
+                            return not_found
+                        time.sleep(delay)
+                        continue
+                    if policy:
+                        policy.succeeded()
+                    return True if ret is None else ret
+
+            return _wrap
+
+        return decorate(func) if func is not None else decorate
+
+    return errorhandler
@@ -1,12 +1,5 @@
 import enum
-import logging
-import botocore
-import functools
-
-logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s -- [%(module)s:%(lineno)s - %(levelname)s] -- %(message)s"
-)
-logger = logging.getLogger(__name__)
+from .base import AWSError, ErrorTable, errorhandler_for
 
 
 class DYDB_ERROR_LIST(enum.Enum):
@@ -43,14 +36,14 @@ class DYDB_ERROR_LIST(enum.Enum):
     TransactionInProgressException = "TransactionInProgressException"
 
 
-def errorhandler(func):
-    @functools.wraps(func)
-    def _wrap(*args, **kwargs):
-        try:
-            ret = func(*args, **kwargs)
-            return ret or True
-        except botocore.exceptions.ClientError as err:
-            logging.error(err.response['Error']['Message'])
-            return False
+class DYDBError(AWSError):
+    """Error returned by DYDB"""
+
+    service = "dynamodb"
+
+
+# one exception class per DYDB_ERROR_LIST code plus DYDBThrottlingError, DYDBNotFoundError, ...
+ERRORS = ErrorTable(DYDBError, DYDB_ERROR_LIST)
+globals().update(ERRORS.by_name)
 
-    return _wrap
+errorhandler = errorhandler_for(ERRORS)
@@ -1,12 +1,5 @@
 import enum
-import logging
-import botocore
-import functools
-
-logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s -- [%(module)s:%(lineno)s - %(levelname)s] -- %(message)s"
-)
-logger = logging.getLogger(__name__)
+from .base import AWSError, ErrorTable, errorhandler_for
 
 
 class S3_ERROR_LIST(enum.Enum):
@@ -20,14 +13,14 @@ class S3_ERROR_LIST(enum.Enum):
     ObjectNotInActiveTierError = "ObjectNotInActiveTierError"
 
 
-def errorhandler(func):
-    @functools.wraps(func)
-    def _wrap(*args, **kwargs):
-        try:
-            ret = func(*args, **kwargs)
-            return ret or True
-        except botocore.exceptions.ClientError as err:
-            logging.error(err.response['Error']['Message'])
-            return False
+class S3Error(AWSError):
+    """Error returned by S3"""
+
+    service = "s3"
+
+
+# one exception class per S3_ERROR_LIST code plus S3ThrottlingError, S3NotFoundError, ...
+ERRORS = ErrorTable(S3Error, S3_ERROR_LIST)
+globals().update(ERRORS.by_name)
 
-    return _wrap
+errorhandler = errorhandler_for(ERRORS)
@@ -1,12 +1,5 @@
 import enum
-import logging
-import botocore
-import functools
-
-logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s -- [%(module)s:%(lineno)s - %(levelname)s] -- %(message)s"
-)
-logger = logging.getLogger(__name__)
+from .base import AWSError, ErrorTable, errorhandler_for
 
 
 class SQS_ERROR_LIST(enum.Enum):
@@ -28,14 +21,14 @@ class SQS_ERROR_LIST(enum.Enum):
     UnsupportedOperation = "AWS.SimpleQueueService.UnsupportedOperation"
 
 
-def errorhandler(func):
-    @functools.wraps(func)
-    def _wrap(*args, **kwargs):
-        try:
-            ret = func(*args, **kwargs)
-            return ret or True
-        except botocore.exceptions.ClientError as err:
-            logging.error(err.response['Error']['Message'])
-            return False
+class SQSError(AWSError):
+    """Error returned by SQS"""
+
+    service = "sqs"
+
+
+# one exception class per SQS_ERROR_LIST code plus SQSThrottlingError, SQSNotFoundError, ...
+ERRORS = ErrorTable(SQSError, SQS_ERROR_LIST)
+globals().update(ERRORS.by_name)
 
-    return _wrap
+errorhandler = errorhandler_for(ERRORS)
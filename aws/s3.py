@@ -1,18 +1,35 @@
+import io
 import os
-import tqdm
-import glob
-import boto3
 import typing
 import logging
-from pathlib import Path
-from .err.s3 import errorhandler
+import botocore
+import functools
+import boto3.exceptions
+from boto3.s3.transfer import TransferConfig
+from .err.s3 import errorhandler, ERRORS
+from .err.base import CALL_ERRORS, RetryPolicy, Retrier, default_policy
+from .utils.clients import ClientFactory, default_factory
+from .utils.metrics import Metrics
+from .utils.fs import LocalFile, iter_files, file_etag
+from .utils.manifest import SyncManifest, ManifestEntry
+from .utils.scan import ScannedFile, scan_dir
+from .utils.multipart import resumable_upload, resumable_download, upload_buffer, download_buffer, copy_object
+from .utils.pool import bounded_map, interleave
+from .utils.progress import ByteProgress
+from .utils.stream import S3Reader, S3Writer, TextWriter, GzipReader, split_records
+from .schema.s3 import S3Object, S3TransferRecord, S3TransferResult, TransferStatus
 
 
-logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s -- [%(module)s:%(lineno)s - %(levelname)s] -- %(message)s"
-)
 logger = logging.getLogger(__name__)
 
+# failures of a whole file transfer, ERRORS.from_exception tells which of them are worth a retry
+TRANSFER_ERRORS = (
+    botocore.exceptions.ClientError,
+    botocore.exceptions.BotoCoreError,
+    boto3.exceptions.S3UploadFailedError,
+    OSError,
+)
+
 
 class S3():
     def __init__(
@@ -20,26 +37,40 @@ class S3():
         bucket: str = None,
         aws_access_key_id=os.environ.get("AWS_ACCESS_KEY_ID", None),
         aws_secret_access_key=os.environ.get("AWS_SECRET_ACCESS_KEY", None),
-        region_name=os.environ.get("AWS_DEFAULT_REGION", None)
+        region_name=os.environ.get("AWS_DEFAULT_REGION", None),
+        transfer_config: TransferConfig = None,
+        clients: ClientFactory = None,
+        retry_policy: RetryPolicy = None
     ):
         self.bucket = bucket
-        # resource
-        self.s3r = boto3.resource(
-            's3',
-            aws_access_key_id=aws_access_key_id,
-            aws_secret_access_key=aws_secret_access_key,
-            region_name=region_name
-        )
-
-        # client
-        self.s3c = boto3.client(
-            's3',
-            aws_access_key_id=aws_access_key_id,
-            aws_secret_access_key=aws_secret_access_key,
-            region_name=region_name
-        )
+        # multipart threshold, part size and part concurrency used by every transfer
+        self.transfer_config = transfer_config or TransferConfig()
+        # clients are built on first use and shared with every instance of the same factory
+        self.clients = clients or default_factory()
+        self._credentials = {
+            "aws_access_key_id": aws_access_key_id,
+            "aws_secret_access_key": aws_secret_access_key,
+            "region_name": region_name,
+        }
+        # retries of throttled and transient errors, shared by every S3 instance by default
+        self.retry_policy = retry_policy or default_policy("s3")
 
-    @errorhandler
+    @functools.cached_property
+    def s3r(self):
+        """Resource, built on first use over the shared client"""
+        return self.clients.resource('s3', **self._credentials)
+
+    @functools.cached_property
+    def s3c(self):
+        """Client, taken from the factory's cache on first use"""
+        return self.clients.client('s3', **self._credentials)
+
+    @property
+    def metrics(self) -> typing.Union[Metrics, None]:
+        """Metrics of the client factory, retries made along retry_policy are counted there"""
+        return self.clients.metrics
+
+    @errorhandler(not_found=False)
     def contains(self, prefix: str, bucket: str = None) -> bool:
         """Check if prefix folder contains folder/file path"""
         bucket = bucket or self.bucket
@@ -48,35 +79,51 @@ class S3():
                 prefix = prefix[:-1]
             objects = self.s3c.list_objects(
                 Bucket=bucket, Prefix=prefix, Delimiter="/", MaxKeys=1)
-            return prefix + "/" == objects.get('CommonPrefixes')[0].get("Prefix")
+            common = objects.get('CommonPrefixes') or [{}]
+            return prefix + "/" == common[0].get("Prefix")
         else:
-            self.s3r.Object(bucket, os.path.join(prefix)).load()
+            self.s3c.head_object(Bucket=bucket, Key=prefix)
         return True
 
     @errorhandler
     def list_all(self, prefix: str, bucket: str = None) -> list:
-        """
-        List all files recursively within the prefix folder 
-        Maximum Len Returns: 1000
-        """
-        bucket = bucket or self.bucket
-        objects = self.s3c.list_objects(Bucket=bucket, Prefix=prefix)
-        paths = [x.get("Key") for x in objects.get("Contents", [])]
-        return paths
+        """List all files recursively within the prefix folder"""
+        return [obj.key for obj in self.iter_objects(prefix, bucket)]
 
     @errorhandler
     def list_dirs(self, prefix: str, delimiter="/", bucket: str = None) -> list:
+        """List all folders one level within the prefix folder"""
+        paths = list(self.iter_dirs(prefix, delimiter, bucket))
+        assert paths, "No objects found inside the directory (Please provide existed directory)"
+        return paths
+
+    def iter_objects(
+        self,
+        prefix: str,
+        bucket: str = None,
+        parallel: bool = False,
+        max_workers: int = 8
+    ) -> typing.Iterator[S3Object]:
         """
-        List all folders one level within the prefix folder
-        Maximum Len Returns: 1000
+        Lazily yield every object within the prefix, following list_objects_v2 pagination
+        With parallel, each sub-prefix one level below prefix is listed on its own thread
+        and objects are yielded in completion order instead of key order
         """
         bucket = bucket or self.bucket
-        objects = self.s3c.list_objects(
-            Bucket=bucket, Prefix=prefix, Delimiter=delimiter)
-        assert objects.get(
-            "CommonPrefixes"), "No objects found inside the directory (Please provide existed directory)"
-        paths = [x.get("Prefix") for x in objects.get("CommonPrefixes")]
-        return paths
+        if parallel:
+            for obj in self._list_sharded(prefix, bucket, max_workers):
+                yield S3Object.from_response(obj)
+            return
+        for page in self._paginate(bucket, prefix):
+            for obj in page.get("Contents", []):
+                yield S3Object.from_response(obj)
+
+    def iter_dirs(self, prefix: str, delimiter="/", bucket: str = None) -> typing.Iterator[str]:
+        """Lazily yield all folders one level within the prefix folder"""
+        bucket = bucket or self.bucket
+        for page in self._paginate(bucket, prefix, delimiter):
+            for common in page.get("CommonPrefixes", []):
+                yield common["Prefix"]
 
     @errorhandler
     def upload_file(
@@ -84,18 +131,30 @@ class S3():
         prefix: str,
         path: str,
         filename: str = "",
-        bucket: str = None
-    ) -> None:
+        bucket: str = None,
+        config: TransferConfig = None,
+        resumable: bool = False,
+        checkpoint: str = None
+    ) -> str:
+        """
+        Upload path into the prefix folder, config overrides the instance transfer_config
+        With resumable, files above the multipart threshold record their finished parts in
+        checkpoint (path + ".s3upload" by default) and a retry only uploads the missing parts
+        """
         bucket = bucket or self.bucket
+        config = config or self.transfer_config
         prefix = self.parse_prefix(prefix)
         if not filename:
-            file = os.path.basename(path)
-            self.s3c.upload_file(path, bucket, os.path.join(prefix, file))
+            filename = os.path.basename(path)
+        elif "." not in filename:
+            _, ext = self.parse_file_ext(path)
+            filename += ext
+        key = os.path.join(prefix, filename)
+        if resumable and os.path.getsize(path) >= config.multipart_threshold:
+            resumable_upload(self.s3c, path, bucket, key, config, checkpoint)
         else:
-            if "." not in filename:
-                _, ext = self.parse_file_ext(path)
-                filename += ext
-            self.s3c.upload_file(path, bucket, os.path.join(prefix, filename))
+            self.s3c.upload_file(path, bucket, key, Config=config)
+        return key
 
     @errorhandler
     def upload_dir(
@@ -105,31 +164,157 @@ class S3():
         include_root: bool = False,
         folder_name: str = "",
         upload_only: typing.List = [],
-        bucket: str = None
-    ):
+        bucket: str = None,
+        max_workers: int = 8,
+        max_retries: int = 3,
+        skip: typing.Callable[[LocalFile, str], bool] = None,
+        progress: bool = True,
+        checksums: bool = False,
+        hash_workers: int = None,
+        manifest: str = None
+    ) -> S3TransferResult:
+        """
+        Upload every file below path concurrently (see iter_upload_dir)
+        Returns the uploaded, skipped and failed keys
+        """
+        result = S3TransferResult()
+        for record in self.iter_upload_dir(
+            prefix, path, include_root, folder_name, upload_only, bucket,
+            max_workers, max_retries, skip, progress, checksums, hash_workers, manifest
+        ):
+            result.add(record)
+        return result
+
+    def iter_upload_dir(
+        self,
+        prefix: str,
+        path: str,
+        include_root: bool = False,
+        folder_name: str = "",
+        upload_only: typing.List = [],
+        bucket: str = None,
+        max_workers: int = 8,
+        max_retries: int = 3,
+        skip: typing.Callable[[LocalFile, str], bool] = None,
+        progress: bool = True,
+        checksums: bool = False,
+        hash_workers: int = None,
+        manifest: str = None
+    ) -> typing.Iterator[S3TransferRecord]:
+        """
+        Walk path once and upload its files from a pool of max_workers threads sharing one client
+        Records are yielded as uploads finish, failed files are retried up to max_retries times
+        skip(file, key) is evaluated in the workers, return True to leave a file out
+        With checksums, files are first hashed on hash_workers processes (see scan_dir) and:
+        files whose ETag matches the object already at their key are skipped, single part uploads
+        carry Content-MD5 and multipart ones are checked against the ETag S3 returns
+        manifest keeps the hashes between runs so only files whose size or mtime changed are read
+        """
         bucket = bucket or self.bucket
-        if not folder_name:
-            folder_name = self.parse_prefix(path).split("/")[-1]
-        path = self.parse_prefix(path)
-        cwd = str(Path.cwd())
-        p = Path(os.path.join(Path.cwd(), path))
-        dir = list(p.glob('**'))
-        for d in tqdm.tqdm(dir, desc=f"Uploading artifacts"):
-            files = glob.glob(os.path.join(d, "*"))
-            for file in files:
-                if not Path(file).is_dir():
-                    file = self.parse_prefix(str(file).replace(cwd, ''), True)
-                    if len(upload_only) > 0 and file.replace(path + "/", "").split("/")[0] not in upload_only:
-                        continue
-                    path = path.replace(".", "").replace("/", "")
-                    if include_root:
-                        s3Path = self.parse_prefix(
-                            file.replace(path, folder_name), True)
-                    else:
-                        s3Path = self.parse_prefix(
-                            file.replace(path, ""), True)
-                    s3Path = os.path.join(self.parse_prefix(prefix), s3Path)
-                    self.s3c.upload_file(file, bucket, s3Path)
+        root = os.path.abspath(path)
+        base = self.parse_prefix(prefix) if prefix.strip("/") else ""
+        if include_root:
+            folder_name = folder_name or os.path.basename(root)
+            base = f"{base}/{folder_name}" if base else folder_name
+
+        def selected(file: LocalFile) -> bool:
+            return not upload_only or file.rel.split("/")[0] in upload_only
+
+        def key_of(file: LocalFile) -> str:
+            return f"{base}/{file.rel}" if base else file.rel
+
+        remote = {}
+        if checksums:
+            remote = {obj.key: obj.etag for obj in self.iter_objects(f"{base}/" if base else "", bucket)}
+
+        with ByteProgress("Uploading artifacts", progress) as bar:
+            def files():
+                if checksums:
+                    config = self.transfer_config
+                    for digest in scan_dir(
+                        root, config.multipart_threshold, config.multipart_chunksize,
+                        hash_workers, manifest, include=selected
+                    ):
+                        bar.add_total(digest.size)
+                        yield digest.file, key_of(digest.file), digest
+                    return
+                for file in iter_files(root):
+                    if selected(file):
+                        bar.add_total(file.size)
+                        yield file, key_of(file), None
+
+            def upload(item):
+                file, key, digest = item
+                if (digest is not None and remote.get(key) == digest.etag) or \
+                        (skip is not None and skip(file, key)):
+                    bar.update(file.size)
+                    return S3TransferRecord(key, file.path, file.size, TransferStatus.SKIPPED)
+                return self._upload_with_retry(file, key, bucket, max_retries, bar, digest)
+
+            for _, future in bounded_map(upload, files(), max_workers):
+                yield future.result()
+
+    def _upload_with_retry(
+        self,
+        file: LocalFile,
+        key: str,
+        bucket: str,
+        max_retries: int,
+        bar: ByteProgress,
+        digest: ScannedFile = None
+    ) -> S3TransferRecord:
+        sent = 0
+
+        def callback(n):
+            nonlocal sent
+            sent += n
+            bar.update(n)
+
+        retrier = Retrier(self.retry_policy, max_retries, self.metrics)
+        while True:
+            retrier.pause()
+            try:
+                if digest is None:
+                    self.s3c.upload_file(
+                        file.path, bucket, key, Callback=callback, Config=self.transfer_config)
+                else:
+                    self._upload_verified(file, key, bucket, digest, callback)
+                retrier.succeeded()
+                return S3TransferRecord(key, file.path, file.size, TransferStatus.TRANSFERRED, retrier.retries + 1)
+            except TRANSFER_ERRORS as err:
+                bar.update(-sent)
+                sent = 0
+                error = ERRORS.from_exception(err)
+                if error is None or not retrier.retry(error):
+                    logger.error(f"Failed to upload {file.path} to {key}: {err}")
+                    return S3TransferRecord(
+                        key, file.path, file.size, TransferStatus.FAILED, retrier.retries + 1, str(err))
+
+    def _upload_verified(
+        self,
+        file: LocalFile,
+        key: str,
+        bucket: str,
+        digest: ScannedFile,
+        callback: typing.Callable[[int], None]
+    ) -> None:
+        """
+        Single part: PutObject with Content-MD5, S3 rejects a body that does not match (BadDigest)
+        Multipart: managed upload, then the object's ETag must equal the scanned one (SSE-KMS
+        objects are not checked, their ETag is not an MD5)
+        """
+        if digest.content_md5 is not None:
+            with open(file.path, "rb") as body:
+                self.s3c.put_object(Bucket=bucket, Key=key, Body=body, ContentMD5=digest.content_md5)
+            callback(file.size)
+            return
+        self.s3c.upload_file(file.path, bucket, key, Callback=callback, Config=self.transfer_config)
+        head = self.s3c.head_object(Bucket=bucket, Key=key)
+        if head.get("ServerSideEncryption", "").startswith("aws:kms"):
+            return
+        if head["ETag"].strip('"') != digest.etag:
+            raise boto3.exceptions.S3UploadFailedError(
+                f"ETag of {key} is {head['ETag']}, expected {digest.etag} from {file.path}")
 
     @errorhandler
     def download_file(
@@ -137,16 +322,28 @@ class S3():
         prefix: str,
         save_path=".",
         rename_to="",
-        bucket: str = None
+        bucket: str = None,
+        config: TransferConfig = None,
+        resumable: bool = False,
+        checkpoint: str = None
     ) -> str:
+        """
+        Download the object at prefix into save_path, config overrides the instance transfer_config
+        With resumable, the object is fetched with parallel ranged GETs whose progress is kept in
+        checkpoint (path + ".s3download" by default) so a retry only fetches the missing ranges
+        """
         bucket = bucket or self.bucket
+        config = config or self.transfer_config
         filename = os.path.basename(prefix)
         filename = rename_to + \
             os.path.splitext(filename)[-1] if rename_to else filename
         path = os.path.join(save_path, filename)
         if not os.path.exists(os.path.dirname(path)):
             os.makedirs(os.path.dirname(path))
-        self.s3c.download_file(bucket, prefix, path)
+        if resumable:
+            resumable_download(self.s3c, bucket, prefix, path, config, checkpoint)
+        else:
+            self.s3c.download_file(bucket, prefix, path, Config=config)
         return os.path.join(path)
 
     @errorhandler
@@ -154,25 +351,656 @@ class S3():
         self,
         s3_uri,
         save_path=".",
-        rename_to=""
+        rename_to="",
+        **kwargs
     ) -> str:
         bucket, prefix = self.parse_s3_uri(s3_uri)
-        return self.download_file(prefix, save_path, rename_to, bucket=bucket)
+        return self.download_file(prefix, save_path, rename_to, bucket=bucket, **kwargs)
 
     @errorhandler
-    def download_dir(self, prefix: str, save_path=".", bucket: str = None) -> None:
+    def download_dir(
+        self,
+        prefix: str,
+        save_path=".",
+        bucket: str = None,
+        max_workers: int = 8,
+        list_workers: int = 4,
+        max_retries: int = 3,
+        skip: typing.Callable[[typing.Dict, str], bool] = None,
+        progress: bool = True
+    ) -> S3TransferResult:
+        """
+        Download every object within the prefix concurrently (see iter_download_dir)
+        Returns the downloaded, skipped and failed keys
+        """
+        result = S3TransferResult()
+        for record in self.iter_download_dir(
+            prefix, save_path, bucket, max_workers, list_workers, max_retries, skip, progress
+        ):
+            result.add(record)
+        return result
+
+    def iter_download_dir(
+        self,
+        prefix: str,
+        save_path=".",
+        bucket: str = None,
+        max_workers: int = 8,
+        list_workers: int = 4,
+        max_retries: int = 3,
+        skip: typing.Callable[[typing.Dict, str], bool] = None,
+        progress: bool = True
+    ) -> typing.Iterator[S3TransferRecord]:
+        """
+        Download objects while they are still being listed, listing is sharded across the
+        sub-prefixes of prefix by list_workers threads and downloads run on max_workers threads
+        Files whose local size and mtime already match the object are skipped,
+        pass skip(obj, path) to replace that check, keys that would land outside save_path fail
+        """
+        skip = skip or self._same_size_and_mtime
         bucket = bucket or self.bucket
-        bucket = self.s3r.Bucket(bucket)
-        for obj in bucket.objects.filter(Prefix=prefix):
-            path = os.path.join(save_path, os.path.relpath(obj.key, prefix))
-            if not os.path.exists(os.path.dirname(path)):
-                os.makedirs(os.path.dirname(path))
-            bucket.download_file(obj.key, path)
+        prefix = self._folder(prefix)
+        created = set()
+
+        with ByteProgress("Downloading artifacts", progress) as bar:
+            def objects():
+                for obj in self._list_sharded(prefix, bucket, list_workers):
+                    bar.add_total(obj["Size"])
+                    yield obj
+
+            def download(obj):
+                key = obj["Key"]
+                try:
+                    path = self._local_path(save_path, key, prefix)
+                except ValueError as err:
+                    bar.update(obj["Size"])
+                    return S3TransferRecord(key, "", obj["Size"], TransferStatus.FAILED, error=str(err))
+                if key.endswith("/"):
+                    bar.update(obj["Size"])
+                    return S3TransferRecord(key, path, obj["Size"], TransferStatus.SKIPPED)
+                if skip(obj, path):
+                    bar.update(obj["Size"])
+                    return S3TransferRecord(key, path, obj["Size"], TransferStatus.SKIPPED)
+                directory = os.path.dirname(path)
+                if directory not in created:
+                    os.makedirs(directory, exist_ok=True)
+                    created.add(directory)
+                return self._download_with_retry(obj, path, bucket, max_retries, bar)
+
+            for _, future in bounded_map(download, objects(), max_workers):
+                yield future.result()
+
+    @staticmethod
+    def _local_path(save_path: str, key: str, prefix: str) -> str:
+        """Local path of key under save_path, raises ValueError when it resolves outside of it"""
+        path = os.path.join(save_path, key[len(prefix):] if key.startswith(prefix) else key)
+        root, resolved = os.path.realpath(save_path), os.path.realpath(path)
+        if resolved != root and not resolved.startswith(os.path.join(root, "")):
+            raise ValueError(f"Key {key} resolves outside of {save_path}")
+        return path
+
+    @staticmethod
+    def _same_size_and_mtime(obj: typing.Dict, path: str) -> bool:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return False
+        return st.st_size == obj["Size"] and int(st.st_mtime) == int(obj["LastModified"].timestamp())
+
+    def _download_with_retry(
+        self,
+        obj: typing.Dict,
+        path: str,
+        bucket: str,
+        max_retries: int,
+        bar: ByteProgress
+    ) -> S3TransferRecord:
+        key, size = obj["Key"], obj["Size"]
+        mtime = int(obj["LastModified"].timestamp())
+        received = 0
+
+        def callback(n):
+            nonlocal received
+            received += n
+            bar.update(n)
+
+        retrier = Retrier(self.retry_policy, max_retries, self.metrics)
+        while True:
+            retrier.pause()
+            try:
+                self.s3c.download_file(
+                    bucket, key, path, Callback=callback, Config=self.transfer_config)
+                os.utime(path, (mtime, mtime))
+                retrier.succeeded()
+                return S3TransferRecord(key, path, size, TransferStatus.TRANSFERRED, retrier.retries + 1)
+            except TRANSFER_ERRORS as err:
+                bar.update(-received)
+                received = 0
+                error = ERRORS.from_exception(err)
+                if error is None or not retrier.retry(error):
+                    logger.error(f"Failed to download {key} to {path}: {err}")
+                    return S3TransferRecord(key, path, size, TransferStatus.FAILED, retrier.retries + 1, str(err))
+
+    def _paginate(self, bucket: str, prefix: str, delimiter: str = None) -> typing.Iterator[typing.Dict]:
+        """Yield every list_objects_v2 page within the prefix"""
+        kwargs = {"Bucket": bucket, "Prefix": prefix}
+        if delimiter:
+            kwargs["Delimiter"] = delimiter
+        while True:
+            page = self._list_page(kwargs)
+            yield page
+            if not page.get("IsTruncated"):
+                return
+            kwargs["ContinuationToken"] = page["NextContinuationToken"]
+
+    @errorhandler
+    def _list_page(self, kwargs: typing.Dict) -> typing.Dict:
+        """One list_objects_v2 request, retried and typed like every other call"""
+        return self.s3c.list_objects_v2(**kwargs)
+
+    def _list_sharded(
+        self,
+        prefix: str,
+        bucket: str,
+        max_workers: int = 4,
+        maxsize: int = 10000
+    ) -> typing.Iterator[typing.Dict]:
+        """
+        Yield every object within the prefix, the objects directly under prefix come from the
+        delimited listing (as in list_dirs) and each of its sub-prefixes is listed on its own thread
+        """
+        def list_shard(shard):
+            for page in self._paginate(bucket, shard):
+                yield from page.get("Contents", [])
+
+        def sources():
+            for page in self._paginate(bucket, prefix, delimiter="/"):
+                contents = page.get("Contents", [])
+                yield lambda contents=contents: contents
+                for common in page.get("CommonPrefixes", []):
+                    yield functools.partial(list_shard, common["Prefix"])
+
+        return interleave(sources(), max_workers, maxsize)
 
     @errorhandler
-    def download_dir_from_uri(self, s3_uri: str, save_path=".") -> None:
+    def download_dir_from_uri(self, s3_uri: str, save_path=".", **kwargs) -> S3TransferResult:
         bucket, prefix = self.parse_s3_uri(s3_uri)
-        self.download_dir(prefix, save_path, bucket=bucket)
+        return self.download_dir(prefix, save_path, bucket=bucket, **kwargs)
+
+    @errorhandler
+    def put_bytes(
+        self,
+        key: str,
+        data,
+        bucket: str = None,
+        config: TransferConfig = None,
+        extra_args: typing.Dict = None
+    ) -> str:
+        """
+        Upload an in-memory buffer to key without a temporary file, data is anything exposing the
+        buffer protocol (bytes, bytearray, memoryview, an mmap of a local file, a numpy array)
+        Parts above the multipart threshold are sent in parallel straight from the buffer
+        """
+        bucket = bucket or self.bucket
+        upload_buffer(self.s3c, data, bucket, key, config or self.transfer_config, extra_args)
+        return key
+
+    @errorhandler
+    def get_bytes(self, key: str, bucket: str = None, config: TransferConfig = None) -> bytearray:
+        """Download key into a new bytearray of its size with parallel ranged GETs"""
+        bucket = bucket or self.bucket
+        buffer, _ = download_buffer(self.s3c, bucket, key, config or self.transfer_config)
+        return buffer
+
+    @errorhandler
+    def get_into(self, key: str, buffer, bucket: str = None, config: TransferConfig = None) -> int:
+        """
+        Download key into a preallocated writable buffer (bytearray, writable mmap, numpy array)
+        with parallel ranged GETs written in place, returns the object size
+        Raises ValueError when the buffer is smaller than the object
+        """
+        bucket = bucket or self.bucket
+        _, size = download_buffer(self.s3c, bucket, key, config or self.transfer_config, buffer)
+        return size
+
+    def open(
+        self,
+        key: str,
+        mode: str = "rb",
+        bucket: str = None,
+        encoding: str = None,
+        newline: str = None,
+        compression: str = None,
+        block_size: int = None,
+        read_ahead: int = 2,
+        extra_args: typing.Dict = None
+    ) -> typing.IO:
+        """
+        File-like access to an object without a local copy, block_size defaults to the
+        transfer_config multipart_chunksize
+        "rb"/"r": seekable buffered reader over ranged GETs, read_ahead blocks are prefetched
+        while reads are sequential; compression="gzip" (or "auto" for keys ending in .gz)
+        decompresses on the fly
+        "wb"/"w": writer streaming multipart parts of block_size, the object is created on
+        close and nothing is written if the with block raises; extra_args go to the upload
+        (ContentType, Metadata, ...)
+        """
+        bucket = bucket or self.bucket
+        block_size = block_size or self.transfer_config.multipart_chunksize
+        if mode in ("r", "rb"):
+            stream = io.BufferedReader(S3Reader(self.s3c, bucket, key, block_size, read_ahead), 256 * 1024)
+            if compression == "gzip" or (compression == "auto" and key.endswith(".gz")):
+                stream = GzipReader(fileobj=stream, mode="rb")
+            if mode == "r":
+                stream = io.TextIOWrapper(stream, encoding or "utf-8", newline=newline)
+            return stream
+        if mode in ("w", "wb"):
+            if compression not in (None, "auto"):
+                raise ValueError("Compressed writes are not supported, wrap the writer in gzip.GzipFile")
+            writer = S3Writer(
+                self.s3c, bucket, key, block_size, self.transfer_config.max_concurrency, extra_args)
+            if mode == "w":
+                return TextWriter(writer, encoding or "utf-8", newline=newline)
+            return writer
+        raise ValueError(f"Unsupported mode {mode!r}, use one of 'r', 'rb', 'w', 'wb'")
+
+    def iter_chunks(
+        self,
+        key: str,
+        chunk_size: int = 1024 ** 2,
+        bucket: str = None,
+        compression: str = "auto"
+    ) -> typing.Iterator[bytes]:
+        """Stream an object as chunks of chunk_size bytes (decompressed for .gz keys)"""
+        with self.open(key, "rb", bucket, compression=compression) as stream:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    def iter_records(
+        self,
+        key: str,
+        delimiter: bytes = b"\n",
+        bucket: str = None,
+        compression: str = "auto"
+    ) -> typing.Iterator[bytes]:
+        """Stream the delimiter separated records of an object (e.g. JSON lines), without the delimiter"""
+        yield from split_records(self.iter_chunks(key, bucket=bucket, compression=compression), delimiter)
+
+    def iter_lines(
+        self,
+        key: str,
+        bucket: str = None,
+        encoding: str = "utf-8",
+        compression: str = "auto"
+    ) -> typing.Iterator[str]:
+        """Stream the lines of a text object, without their line endings"""
+        for record in self.iter_records(key, b"\n", bucket, compression):
+            yield record.decode(encoding).rstrip("\r")
+
+    @errorhandler
+    def sync_dir(
+        self,
+        prefix: str,
+        path: str,
+        direction: str = "up",
+        delete: bool = False,
+        manifest: str = None,
+        refresh: bool = False,
+        bucket: str = None,
+        max_workers: int = 8,
+        max_retries: int = 3,
+        progress: bool = True
+    ) -> S3TransferResult:
+        """
+        Transfer only the files that differ between path and the prefix ("up" or "down")
+        Sizes, mtimes and ETags are kept in a SQLite manifest (see SyncManifest) so unchanged files
+        are never re-hashed, files are only hashed when their size or mtime changed
+        Uploads trust the manifest instead of listing the prefix, it is seeded from a listing when
+        empty or when refresh is set, downloads always list the prefix
+        With delete, keys tracked by the manifest that no longer exist at the source are removed
+        from the destination
+        Objects with non-MD5 ETags (SSE-KMS, non default part sizes) always compare as changed
+        """
+        bucket = bucket or self.bucket
+        if direction not in ("up", "down"):
+            raise ValueError(f"direction must be 'up' or 'down', got {direction!r}")
+        base = self.parse_prefix(prefix) if prefix.strip("/") else ""
+        manifest = manifest or SyncManifest.default_path(bucket, base, path)
+        with SyncManifest(manifest) as index:
+            if refresh:
+                index.clear()
+            if direction == "up":
+                return self._sync_up(base, path, delete, index, bucket, max_workers, max_retries, progress)
+            return self._sync_down(base, path, delete, index, bucket, max_workers, max_retries, progress)
+
+    def _sync_up(
+        self,
+        base: str,
+        path: str,
+        delete: bool,
+        index: SyncManifest,
+        bucket: str,
+        max_workers: int,
+        max_retries: int,
+        progress: bool
+    ) -> S3TransferResult:
+        if not len(index):
+            for obj in self.iter_objects(f"{base}/" if base else "", bucket):
+                index.put(obj.key, obj.size, None, obj.etag)
+
+        seen, hashed = set(), {}
+        etag_config = (self.transfer_config.multipart_threshold, self.transfer_config.multipart_chunksize)
+
+        def skip(file: LocalFile, key: str) -> bool:
+            seen.add(key)
+            entry = index.get(key)
+            if entry and entry.size == file.size and entry.mtime_ns == file.mtime_ns:
+                return True
+            etag = file_etag(file.path, *etag_config)
+            if entry and entry.size == file.size and entry.etag == etag:
+                index.put(key, file.size, file.mtime_ns, etag)
+                return True
+            hashed[key] = ManifestEntry(file.size, file.mtime_ns, etag)
+            return False
+
+        result = S3TransferResult()
+        for record in self.iter_upload_dir(
+            base, path, bucket=bucket, max_workers=max_workers,
+            max_retries=max_retries, skip=skip, progress=progress
+        ):
+            if record.status == TransferStatus.TRANSFERRED:
+                index.put(record.key, *hashed.pop(record.key))
+            result.add(record)
+
+        if delete and not result.failed:
+            extra = [key for key in index.keys() if key not in seen]
+            for record in self._delete_keys(extra, bucket):
+                if record.status == TransferStatus.DELETED:
+                    index.delete(record.key)
+                result.add(record)
+        return result
+
+    def _sync_down(
+        self,
+        base: str,
+        path: str,
+        delete: bool,
+        index: SyncManifest,
+        bucket: str,
+        max_workers: int,
+        max_retries: int,
+        progress: bool
+    ) -> S3TransferResult:
+        prefix = f"{base}/" if base else ""
+        seen, etags = set(), {}
+        etag_config = (self.transfer_config.multipart_threshold, self.transfer_config.multipart_chunksize)
+
+        def skip(obj: typing.Dict, local: str) -> bool:
+            key, etag = obj["Key"], obj["ETag"].strip('"')
+            seen.add(key)
+            try:
+                st = os.stat(local)
+            except FileNotFoundError:
+                etags[key] = etag
+                return False
+            entry = index.get(key)
+            if entry and entry.etag == etag and entry.size == st.st_size and entry.mtime_ns == st.st_mtime_ns:
+                return True
+            if st.st_size == obj["Size"] and file_etag(local, *etag_config) == etag:
+                index.put(key, st.st_size, st.st_mtime_ns, etag)
+                return True
+            etags[key] = etag
+            return False
+
+        result = S3TransferResult()
+        for record in self.iter_download_dir(
+            prefix, path, bucket, max_workers, max_retries=max_retries, skip=skip, progress=progress
+        ):
+            if record.status == TransferStatus.TRANSFERRED:
+                st = os.stat(record.path)
+                index.put(record.key, st.st_size, st.st_mtime_ns, etags.pop(record.key))
+            result.add(record)
+
+        if delete and not result.failed:
+            for key in index.keys():
+                if key in seen:
+                    continue
+                try:
+                    local = self._local_path(path, key, prefix)
+                except ValueError:
+                    index.delete(key)
+                    continue
+                try:
+                    os.remove(local)
+                except FileNotFoundError:
+                    pass
+                index.delete(key)
+                result.add(S3TransferRecord(key, local, status=TransferStatus.DELETED))
+        return result
+
+    @errorhandler
+    def delete_prefix(self, prefix: str, bucket: str = None, progress: bool = True) -> S3TransferResult:
+        """
+        Delete every object within the prefix folder, keys are fed from the listing into
+        DeleteObjects batches of 1000 as pages arrive, returns the deleted and failed keys
+        """
+        result = S3TransferResult()
+        for record in self.iter_delete_prefix(prefix, bucket, progress):
+            result.add(record)
+        return result
+
+    def iter_delete_prefix(
+        self,
+        prefix: str,
+        bucket: str = None,
+        progress: bool = True
+    ) -> typing.Iterator[S3TransferRecord]:
+        """Delete every object within the prefix folder and yield a record per key"""
+        bucket = bucket or self.bucket
+        base = self._folder(prefix)
+        if not base:
+            raise ValueError("Refusing to delete a whole bucket, pass a non empty prefix")
+
+        with ByteProgress("Deleting objects", progress, unit="obj") as bar:
+            def keys():
+                for obj in self.iter_objects(base, bucket):
+                    bar.add_total(1)
+                    yield obj.key
+
+            for record in self._delete_keys(keys(), bucket):
+                bar.update(1)
+                yield record
+
+    @errorhandler
+    def copy_prefix(
+        self,
+        prefix: str,
+        dst_prefix: str,
+        bucket: str = None,
+        dst_bucket: str = None,
+        max_workers: int = 16,
+        max_retries: int = 3,
+        progress: bool = True
+    ) -> S3TransferResult:
+        """
+        Copy every object within the prefix folder to dst_prefix server-side (see iter_copy_prefix)
+        Returns the copied and failed source keys
+        """
+        result = S3TransferResult()
+        for record in self.iter_copy_prefix(
+            prefix, dst_prefix, bucket, dst_bucket, max_workers, max_retries, progress
+        ):
+            result.add(record)
+        return result
+
+    @errorhandler
+    def move_prefix(
+        self,
+        prefix: str,
+        dst_prefix: str,
+        bucket: str = None,
+        dst_bucket: str = None,
+        max_workers: int = 16,
+        max_retries: int = 3,
+        progress: bool = True
+    ) -> S3TransferResult:
+        """
+        Copy every object within the prefix folder to dst_prefix, then delete the sources that
+        were copied in batches of 1000 while the copy goes on, failed copies keep their source
+        """
+        bucket = bucket or self.bucket
+        result, copied = S3TransferResult(), []
+        for record in self.iter_copy_prefix(
+            prefix, dst_prefix, bucket, dst_bucket, max_workers, max_retries, progress
+        ):
+            result.add(record)
+            if record.status == TransferStatus.TRANSFERRED:
+                copied.append(record.key)
+            if len(copied) == 1000:
+                for deleted in self._delete_batch(copied, bucket, max_retries):
+                    result.add(deleted)
+                copied = []
+        if copied:
+            for deleted in self._delete_batch(copied, bucket, max_retries):
+                result.add(deleted)
+        return result
+
+    def iter_copy_prefix(
+        self,
+        prefix: str,
+        dst_prefix: str,
+        bucket: str = None,
+        dst_bucket: str = None,
+        max_workers: int = 16,
+        max_retries: int = 3,
+        progress: bool = True
+    ) -> typing.Iterator[S3TransferRecord]:
+        """
+        Copy objects server-side while they are still being listed, on max_workers threads
+        Objects above the multipart threshold are copied as parallel UploadPartCopy ranges
+        Records are yielded as copies finish, their path is the destination key
+        """
+        bucket = bucket or self.bucket
+        dst_bucket = dst_bucket or bucket
+        base, dst_base = self._folder(prefix), self._folder(dst_prefix)
+        if dst_bucket == bucket and (dst_base.startswith(base) or base.startswith(dst_base)):
+            raise ValueError(f"Cannot copy {prefix!r} to {dst_prefix!r}, the prefixes overlap")
+
+        with ByteProgress("Copying objects", progress) as bar:
+            def objects():
+                for obj in self.iter_objects(base, bucket):
+                    bar.add_total(obj.size)
+                    yield obj
+
+            def copy(obj):
+                dst_key = dst_base + obj.key[len(base):]
+                return self._copy_with_retry(obj, dst_key, bucket, dst_bucket, max_retries, bar)
+
+            for _, future in bounded_map(copy, objects(), max_workers):
+                yield future.result()
+
+    def _copy_with_retry(
+        self,
+        obj: S3Object,
+        dst_key: str,
+        bucket: str,
+        dst_bucket: str,
+        max_retries: int,
+        bar: ByteProgress
+    ) -> S3TransferRecord:
+        copied = 0
+
+        def callback(n):
+            nonlocal copied
+            copied += n
+            bar.update(n)
+
+        retrier = Retrier(self.retry_policy, max_retries, self.metrics)
+        while True:
+            retrier.pause()
+            try:
+                copy_object(
+                    self.s3c, bucket, obj.key, dst_bucket, dst_key, obj.size, self.transfer_config, callback)
+                retrier.succeeded()
+                return S3TransferRecord(obj.key, dst_key, obj.size, TransferStatus.TRANSFERRED, retrier.retries + 1)
+            except TRANSFER_ERRORS as err:
+                bar.update(-copied)
+                copied = 0
+                error = ERRORS.from_exception(err)
+                if error is None or not retrier.retry(error):
+                    logger.error(f"Failed to copy {obj.key} to {dst_key}: {err}")
+                    return S3TransferRecord(
+                        obj.key, dst_key, obj.size, TransferStatus.FAILED, retrier.retries + 1, str(err))
+
+    @staticmethod
+    def _folder(prefix: str) -> str:
+        """prefix as a folder ("a/b" -> "a/b/"), so "a/b" never matches "a/bc" keys"""
+        prefix = prefix.strip("/")
+        return f"{prefix}/" if prefix else ""
+
+    def _delete_keys(
+        self,
+        keys: typing.Iterable[str],
+        bucket: str
+    ) -> typing.Iterator[S3TransferRecord]:
+        """Delete keys with DeleteObjects in batches of 1000 and yield a record per key"""
+        batch = []
+        for key in keys:
+            batch.append(key)
+            if len(batch) == 1000:
+                yield from self._delete_batch(batch, bucket)
+                batch = []
+        if batch:
+            yield from self._delete_batch(batch, bucket)
+
+    def _delete_batch(
+        self,
+        keys: typing.List[str],
+        bucket: str,
+        max_retries: int = 3
+    ) -> typing.Iterator[S3TransferRecord]:
+        """
+        One DeleteObjects call, retried through the retry policy as a whole on a retryable error
+        and for the keys it reports as throttled or transient; other failures are recorded per key
+        """
+        retrier = Retrier(self.retry_policy, max_retries, self.metrics)
+        pending = keys
+        while True:
+            retrier.pause()
+            try:
+                resp = self.s3c.delete_objects(
+                    Bucket=bucket,
+                    Delete={"Objects": [{"Key": key} for key in pending], "Quiet": True}
+                )
+            except CALL_ERRORS as err:
+                error = ERRORS.from_exception(err)
+                if error.retryable and retrier.retry(error):
+                    continue
+                logger.error(f"DeleteObjects on {bucket} failed for {len(pending)} keys: {err}")
+                for key in pending:
+                    yield S3TransferRecord(key, "", status=TransferStatus.FAILED, error=str(error))
+                return
+            errors = {
+                e["Key"]: ERRORS.from_code(e.get("Code", "Unknown"), e.get("Message", ""), "DeleteObjects")
+                for e in resp.get("Errors", [])
+            }
+            retry = [key for key in pending if key in errors and errors[key].retryable]
+            for key in pending:
+                if key not in errors:
+                    yield S3TransferRecord(key, "", status=TransferStatus.DELETED)
+                elif key not in retry:
+                    yield S3TransferRecord(key, "", status=TransferStatus.FAILED, error=str(errors[key]))
+            if not retry:
+                retrier.succeeded()
+                return
+            if not retrier.retry(errors[retry[0]]):
+                for key in retry:
+                    yield S3TransferRecord(key, "", status=TransferStatus.FAILED, error=str(errors[key]))
+                return
+            pending = retry
 
     @staticmethod
     def parse_s3_uri(s3_uri: str) -> typing.Tuple[str, str]:
@@ -0,0 +1,52 @@
+import typing
+import dataclasses
+
+
+@dataclasses.dataclass
+class DYDBBatchResult:
+    written: int = 0
+    deleted: int = 0
+    failed: int = 0
+    failed_items: typing.List[typing.Dict] = dataclasses.field(default_factory=list)
+    errors: typing.List[str] = dataclasses.field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.failed
+
+
+@dataclasses.dataclass
+class DYDBCacheStats:
+    hits: int = 0
+    misses: int = 0
+    shared_hits: int = 0  # hits served by the shared backend (counted in hits too)
+    evictions: int = 0
+    expirations: int = 0
+    invalidations: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+@dataclasses.dataclass
+class DYDBCancellationReason:
+    index: int  # position of the operation in the transaction builder
+    table: str
+    key: typing.Dict  # key of the operation, the whole item for puts
+    code: str  # ConditionalCheckFailed, TransactionConflict, ValidationError, ...
+    message: str = ""
+    item: typing.Union[typing.Dict, None] = None  # item as it was, with return_old_on_failure
+
+
+@dataclasses.dataclass
+class DYDBTransactionResult:
+    transactions: int = 0  # TransactWriteItems calls that settled, each one is atomic on its own
+    committed: int = 0
+    failed: int = 0
+    reasons: typing.List[DYDBCancellationReason] = dataclasses.field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.failed
@@ -0,0 +1,19 @@
+import typing
+import dataclasses
+
+
+@dataclasses.dataclass
+class CallMetrics:
+    """One finished client call, as passed to Metrics hooks"""
+    service: str
+    operation: str
+    latency: float  # seconds, botocore retries included
+    status: typing.Union[int, None] = None
+    error: typing.Union[str, None] = None  # error code of a failed call
+    retries: int = 0  # retries made by botocore, the retry policy's are counted by Metrics.record_retry
+    throttles: int = 0  # attempts answered with a throttling error
+    bytes_sent: int = 0
+    bytes_received: int = 0
+    # DynamoDB consumed capacity per table
+    read_units: typing.Dict[str, float] = dataclasses.field(default_factory=dict)
+    write_units: typing.Dict[str, float] = dataclasses.field(default_factory=dict)
@@ -0,0 +1,61 @@
+import enum
+import typing
+import datetime
+import dataclasses
+
+
+@dataclasses.dataclass
+class S3Object:
+    key: str
+    size: int
+    etag: str
+    last_modified: datetime.datetime
+    storage_class: str = "STANDARD"
+
+    @classmethod
+    def from_response(cls, obj: typing.Dict) -> "S3Object":
+        return cls(
+            obj["Key"], obj["Size"], obj["ETag"].strip('"'),
+            obj["LastModified"], obj.get("StorageClass", "STANDARD"))
+
+
+class TransferStatus(enum.Enum):
+    TRANSFERRED = "transferred"
+    SKIPPED = "skipped"
+    FAILED = "failed"
+    DELETED = "deleted"
+
+
+@dataclasses.dataclass
+class S3TransferRecord:
+    key: str
+    path: str
+    size: int = 0
+    status: TransferStatus = TransferStatus.TRANSFERRED
+    attempts: int = 0
+    error: typing.Union[str, None] = None
+
+
+@dataclasses.dataclass
+class S3TransferResult:
+    transferred: typing.List[str] = dataclasses.field(default_factory=list)
+    skipped: typing.List[str] = dataclasses.field(default_factory=list)
+    failed: typing.Dict[str, str] = dataclasses.field(default_factory=dict)
+    deleted: typing.List[str] = dataclasses.field(default_factory=list)
+    bytes: int = 0
+
+    def add(self, record: S3TransferRecord) -> S3TransferRecord:
+        if record.status == TransferStatus.TRANSFERRED:
+            self.transferred.append(record.key)
+            self.bytes += record.size
+        elif record.status == TransferStatus.SKIPPED:
+            self.skipped.append(record.key)
+        elif record.status == TransferStatus.DELETED:
+            self.deleted.append(record.key)
+        else:
+            self.failed[record.key] = record.error
+        return record
+
+    @property
+    def ok(self) -> bool:
+        return not self.failed
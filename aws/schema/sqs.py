@@ -24,11 +24,31 @@ class SQSQueueSpecifications:
 
 @dataclasses.dataclass
 class SQSMessage:
-    deduplication_id: str = uuid.uuid1().hex
-    group_id: str = uuid.uuid1().hex
+    deduplication_id: str = dataclasses.field(default_factory=lambda: uuid.uuid1().hex)
+    group_id: str = dataclasses.field(default_factory=lambda: uuid.uuid1().hex)
     body: typing.Dict = dataclasses.field(default_factory=dict)
 
 
+@dataclasses.dataclass
+class SQSBatchResult:
+    sent: int = 0
+    failed: int = 0
+    failed_messages: typing.List[typing.Tuple[SQSMessage, str]] = dataclasses.field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.failed
+
+
+@dataclasses.dataclass
+class SQSConsumerStats:
+    received: int = 0
+    processed: int = 0
+    failed: int = 0
+    deleted: int = 0
+    extended: int = 0
+
+
 class ReceiveAttributeNames(enum.Enum):
     ALL = "All"
     POLICY = "Policy"
@@ -1,19 +1,26 @@
 import os
 import json
 import uuid
-import boto3
+import zlib
 import typing
 import logging
-from .err.sqs import errorhandler
-from .schema.sqs import SQSQueueSpecifications, \
+import functools
+import threading
+import queue as _queue
+from .err.sqs import errorhandler, ERRORS, SQSError
+from .err.base import CALL_ERRORS, RetryPolicy, Retrier, TransientError, default_policy
+from .utils.clients import ClientFactory, default_factory
+from .utils.metrics import Metrics
+from .utils.consumer import Consumer
+from .schema.sqs import SQSQueueSpecifications, SQSBatchResult, SQSConsumerStats, \
     SQSMessage, ReceiveAttributeNames, ReturnedSQSMessages
 
 
-logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s -- [%(module)s:%(lineno)s - %(levelname)s] -- %(message)s"
-)
 logger = logging.getLogger(__name__)
 
+MAX_BATCH_ENTRIES = 10
+MAX_BATCH_BYTES = 262144  # 256kb, the payload limit of a whole SendMessageBatch
+
 
 class SQS:
     def __init__(
@@ -22,15 +29,30 @@ class SQS:
         aws_access_key_id=os.environ.get("AWS_ACCESS_KEY_ID", None),
         aws_secret_access_key=os.environ.get(
             "AWS_SECRET_ACCESS_KEY", None),
-        region_name=os.environ.get("AWS_DEFAULT_REGION", None)
+        region_name=os.environ.get("AWS_DEFAULT_REGION", None),
+        clients: ClientFactory = None,
+        retry_policy: RetryPolicy = None
     ):
         self.queue = queue
-        self.sqs = boto3.client(
-            'sqs',
-            aws_access_key_id=aws_access_key_id,
-            aws_secret_access_key=aws_secret_access_key,
-            region_name=region_name
-        )
+        # the client is built on first use and shared with every instance of the same factory
+        self.clients = clients or default_factory()
+        self._credentials = {
+            "aws_access_key_id": aws_access_key_id,
+            "aws_secret_access_key": aws_secret_access_key,
+            "region_name": region_name,
+        }
+        # retries of throttled and transient errors, shared by every SQS instance by default
+        self.retry_policy = retry_policy or default_policy("sqs")
+
+    @functools.cached_property
+    def sqs(self):
+        """Client, taken from the factory's cache on first use"""
+        return self.clients.client('sqs', **self._credentials)
+
+    @property
+    def metrics(self) -> typing.Union[Metrics, None]:
+        """Metrics of the client factory, retries made along retry_policy are counted there"""
+        return self.clients.metrics
 
     @errorhandler
     def publish(self, message: SQSMessage, queue: str = None) -> typing.Dict:
@@ -49,11 +71,152 @@ class SQS:
                 QueueUrl=queue,
                 MessageBody=json.dumps(message['body']),
             )
-        logging.info(
-            f"Sent message ID {message['body']} to SQS ({queue}) with ID: {resp['MessageId']}"
-        )
+        logger.debug(f"Sent message to SQS ({queue}) with ID: {resp['MessageId']}")
         return resp
 
+    def publish_batch(
+        self,
+        messages: typing.Iterable[SQSMessage],
+        queue: str = None,
+        max_workers: int = 4,
+        max_retries: int = 5,
+        max_batch_bytes: int = MAX_BATCH_BYTES
+    ) -> SQSBatchResult:
+        """
+        Publish messages with SendMessageBatch, packing up to 10 entries under max_batch_bytes per call
+        Messages are spread over max_workers lanes that each send their batches in order, fifo
+        queues keep every group_id on one lane so per-group ordering holds across batches
+        Only the entries that failed are retried (with jittered backoff), on fifo queues only while
+        no later message of their group was sent; once a fifo group has a failed message its later
+        messages are failed without being sent. Errors other than the service's fail the batch
+        """
+        queue = queue or self.queue
+        fifo = queue.endswith(".fifo")
+        result = SQSBatchResult()
+        lock = threading.Lock()
+        done = object()
+        lanes = [_queue.Queue(maxsize=MAX_BATCH_ENTRIES * 10) for _ in range(max_workers)]
+
+        def record(sent, failed):
+            with lock:
+                result.sent += sent
+                result.failed += len(failed)
+                result.failed_messages.extend(failed)
+
+        def run(lane):
+            failed_groups = set()
+            for batch in self._pack(lane, done, max_batch_bytes):
+                if fifo:
+                    skipped = [m for m, _, _ in batch if m.group_id in failed_groups]
+                    batch = [entry for entry in batch if entry[0].group_id not in failed_groups]
+                    record(0, [(m, "an earlier message of the group failed") for m in skipped])
+                try:
+                    failed = self._send_batch(batch, queue, fifo, max_retries) if batch else []
+                except Exception as err:
+                    # keep draining the lane, a dead worker would leave the producer blocked on it
+                    logger.error(f"SendMessageBatch to {queue} failed: {err}")
+                    failed = [(m, str(err)) for m, _, _ in batch]
+                failed_groups.update(m.group_id for m, _ in failed)
+                record(len(batch) - len(failed), failed)
+
+        threads = [threading.Thread(target=run, args=(lane,), daemon=True) for lane in lanes]
+        for thread in threads:
+            thread.start()
+        try:
+            for i, message in enumerate(messages):
+                body = json.dumps(message.body)
+                size = len(body.encode())
+                if size > max_batch_bytes:
+                    record(0, [(message, "message larger than the batch payload limit")])
+                    continue
+                n = zlib.crc32(message.group_id.encode()) if fifo else i
+                lanes[n % max_workers].put((message, body, size))
+        finally:
+            for lane in lanes:
+                lane.put(done)
+            for thread in threads:
+                thread.join()
+        return result
+
+    @staticmethod
+    def _pack(
+        lane: "_queue.Queue",
+        done: object,
+        max_batch_bytes: int
+    ) -> typing.Iterator[typing.List[typing.Tuple[SQSMessage, str, int]]]:
+        """Group a lane into batches of at most 10 entries and max_batch_bytes, flushing when it runs dry"""
+        carry = None
+        while True:
+            item = carry or lane.get()
+            carry = None
+            if item is done:
+                return
+            batch, size = [item], item[2]
+            while len(batch) < MAX_BATCH_ENTRIES:
+                try:
+                    item = lane.get_nowait()
+                except _queue.Empty:
+                    break
+                if item is done or size + item[2] > max_batch_bytes:
+                    carry = item
+                    break
+                batch.append(item)
+                size += item[2]
+            yield batch
+
+    def _send_batch(
+        self,
+        batch: typing.List[typing.Tuple[SQSMessage, str, int]],
+        queue: str,
+        fifo: bool,
+        max_retries: int
+    ) -> typing.List[typing.Tuple[SQSMessage, str]]:
+        """Send one batch, retrying the entries that failed without SenderFault, return what failed"""
+        retrier = Retrier(self.retry_policy, max_retries, self.metrics)
+        pending = dict(enumerate(batch))
+        failed = []
+        while True:
+            retrier.pause()
+            entries = []
+            for i, (message, body, _) in pending.items():
+                entry = {"Id": str(i), "MessageBody": body}
+                if fifo:
+                    entry["MessageDeduplicationId"] = message.deduplication_id
+                    entry["MessageGroupId"] = message.group_id
+                entries.append(entry)
+            try:
+                resp = self.sqs.send_message_batch(QueueUrl=queue, Entries=entries)
+            except CALL_ERRORS as err:
+                error = ERRORS.from_exception(err)
+                if not retrier.retry(error):
+                    break
+                continue
+            errors = {int(entry["Id"]): entry for entry in resp.get("Failed", [])}
+            # last entry of each fifo group that made it, a failed one before it cannot be resent in order
+            sent = {pending[i][0].group_id: i for i in pending if i not in errors} if fifo else {}
+            blocked, retry = set(), {}
+            for i in sorted(errors):
+                message, entry = pending[i][0], errors[i]
+                if fifo and message.group_id in blocked:
+                    failed.append((message, "an earlier message of the group failed"))
+                elif entry.get("SenderFault") or sent.get(message.group_id, -1) > i:
+                    failed.append((message, entry.get("Message", entry["Code"])))
+                    if fifo:
+                        blocked.add(message.group_id)
+                else:
+                    retry[i] = pending[i]
+            pending = retry
+            if not pending:
+                retrier.succeeded()
+                return failed
+            # entries failed without SenderFault, a server side failure
+            error = ERRORS.generic[TransientError](
+                "BatchEntriesFailed", f"{len(pending)} entries failed", "SendMessageBatch")
+            if not retrier.retry(error):
+                break
+        logger.error(f"SendMessageBatch to {queue} failed for {len(pending)} messages after {retrier.retries} retries")
+        return failed + [(m, str(error)) for m, _, _ in pending.values()]
+
     @errorhandler
     def pool(
         self,
@@ -62,11 +225,12 @@ class SQS:
             ReceiveAttributeNames.ALL.value],
         message_attribute_names: typing.List = [],
         max_number_of_messages: int = 10,  # 1 - 10
-        visibility_timeout: int = 1,  # 1 - 20
-        wait_time_seconds: int = 5,
-        receive_request_attempt_id: str = uuid.uuid1().hex
+        visibility_timeout: int = 30,  # 0 - 43200
+        wait_time_seconds: int = 5,  # 0 - 20
+        receive_request_attempt_id: str = None
     ) -> typing.List[typing.Union[ReturnedSQSMessages, None]]:
         queue = queue or self.queue
+        receive_request_attempt_id = receive_request_attempt_id or uuid.uuid1().hex
         resp = self.sqs.receive_message(
             QueueUrl=queue,
             AttributeNames=attribute_names,
@@ -78,6 +242,60 @@ class SQS:
         )
         return resp.get("Messages", [])
 
+    def consume(
+        self,
+        handler: typing.Callable[[ReturnedSQSMessages], typing.Any],
+        queue: str = None,
+        concurrency: int = 8,
+        receivers: int = 2,
+        max_in_flight: int = None,
+        visibility_timeout: int = 30,
+        wait_time_seconds: int = 20,
+        release_on_error: bool = False,
+        max_messages: int = None
+    ) -> SQSConsumerStats:
+        """
+        Run handler(message) for every message of the queue until interrupted (or max_messages were
+        handled), see utils.consumer.Consumer
+        receivers threads long-poll the queue and concurrency threads run the handler, a message is
+        deleted (in DeleteMessageBatch calls) once its handler returns and its visibility is
+        extended while the handler runs, at most max_in_flight messages are held at once
+        """
+        consumer = Consumer(
+            self, handler, queue or self.queue,
+            concurrency=concurrency,
+            receivers=receivers,
+            max_in_flight=max_in_flight,
+            visibility_timeout=visibility_timeout,
+            wait_time_seconds=wait_time_seconds,
+            release_on_error=release_on_error,
+        )
+        return consumer.run(max_messages)
+
+    def delete_batch(self, receipt_handles: typing.List[str], queue: str = None) -> int:
+        """Acknowledge messages with DeleteMessageBatch, 10 per call, return how many were deleted"""
+        queue = queue or self.queue
+        deleted = 0
+        for i in range(0, len(receipt_handles), MAX_BATCH_ENTRIES):
+            entries = [
+                {"Id": str(n), "ReceiptHandle": receipt}
+                for n, receipt in enumerate(receipt_handles[i:i + MAX_BATCH_ENTRIES])
+            ]
+            try:
+                resp = self._delete_entries(queue, entries)
+            except SQSError as err:
+                logger.error(f"DeleteMessageBatch on {queue} failed: {err}")
+                continue
+            deleted += len(resp.get("Successful", []))
+            for entry in resp.get("Failed", []):
+                logger.error(f"Failed to delete message from {queue}: {entry.get('Message', entry['Code'])}")
+        return deleted
+
+    @errorhandler
+    def _delete_entries(self, queue: str, entries: typing.List[typing.Dict]) -> typing.Dict:
+        """One DeleteMessageBatch call, throttled and transient failures are retried along retry_policy"""
+        return self.sqs.delete_message_batch(QueueUrl=queue, Entries=entries)
+
     @staticmethod
     @errorhandler
     def create_queue(
@@ -0,0 +1,153 @@
+"""
+Read-through cache for DynamoDB items, an LRU bounded by size and TTL in front of an optional
+shared backend (any MutableMapping, e.g. a multiprocessing.Manager().dict() for workers)
+Items are kept in their wire format and deserialized on every hit, so callers can mutate
+what they get back without touching the cache, and the shared backend only stores plain dicts
+"""
+import time
+import typing
+import threading
+import collections
+from ..schema.dydb import DYDBCacheStats
+
+CacheKey = typing.Tuple[str, typing.Tuple]
+
+
+def cache_key(table: str, key: typing.Mapping) -> CacheKey:
+    """Hashable (and picklable) identity of an item, independent of the key's dict order"""
+    return table, tuple(sorted(key.items()))
+
+
+class MappingBackend:
+    """
+    Shared cache over a MutableMapping of key -> (expires_at, item), expiry uses wall time so
+    entries written by one process expire for all of them; maxsize is enforced by dropping
+    expired entries first and then the ones closest to expiring
+    """
+
+    def __init__(self, mapping: typing.MutableMapping, maxsize: int = 100000):
+        self.mapping = mapping
+        self.maxsize = maxsize
+
+    def get(self, key: CacheKey) -> typing.Union[typing.Dict, None]:
+        entry = self.mapping.get(key)
+        if entry is None:
+            return None
+        expires_at, item = entry
+        if expires_at <= time.time():
+            self.mapping.pop(key, None)
+            return None
+        return item
+
+    def set(self, key: CacheKey, item: typing.Dict, ttl: float) -> None:
+        self.mapping[key] = (time.time() + ttl, item)
+        if len(self.mapping) > self.maxsize:
+            self._trim()
+
+    def delete(self, key: CacheKey) -> None:
+        self.mapping.pop(key, None)
+
+    def clear(self) -> None:
+        self.mapping.clear()
+
+    def _trim(self) -> None:
+        now = time.time()
+        entries = sorted((expires_at, key) for key, (expires_at, _) in list(self.mapping.items()))
+        excess = len(entries) - self.maxsize
+        for expires_at, key in entries:
+            if excess <= 0 and expires_at > now:
+                break
+            self.mapping.pop(key, None)
+            excess -= 1
+
+
+class ReadCache:
+    """
+    In-process LRU of maxsize items that live ttl seconds, backed by an optional shared backend
+    A local miss falls through to the backend before DynamoDB, and writes made through the
+    owning DYDB instance invalidate both; other processes see such writes once their own
+    local copy expires, so keep ttl short for data that must converge quickly
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 10000,
+        ttl: float = 60.0,
+        backend: MappingBackend = None,
+        key_attrs: typing.Mapping[str, typing.Sequence[str]] = None
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.backend = backend
+        self.stats = DYDBCacheStats()
+        self._lock = threading.Lock()
+        self._items: "collections.OrderedDict[CacheKey, typing.Tuple[float, typing.Dict]]" = collections.OrderedDict()
+        self._epoch = 0  # bumped by every invalidation
+        # table -> key attribute names so puts can be mapped to their key, tables not given here
+        # are filled from their KeySchema by the owning DYDB before the first invalidation
+        self.key_attrs: typing.Dict[str, typing.Tuple[str, ...]] = {
+            table: tuple(attrs) for table, attrs in (key_attrs or {}).items()}
+
+    def get(self, key: CacheKey) -> typing.Union[typing.Dict, None]:
+        """The cached wire item of key, None on a miss"""
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._items.move_to_end(key)
+                    self.stats.hits += 1
+                    return entry[1]
+                del self._items[key]
+                self.stats.expirations += 1
+        item = self.backend.get(key) if self.backend is not None else None
+        with self._lock:
+            if item is None:
+                self.stats.misses += 1
+                return None
+            self.stats.hits += 1
+            self.stats.shared_hits += 1
+            self._store(key, item)
+        return item
+
+    def token(self) -> int:
+        """Taken before a read from DynamoDB and handed to set, so a read that raced a write is not cached"""
+        return self._epoch
+
+    def set(self, key: CacheKey, item: typing.Dict, token: int = None) -> None:
+        with self._lock:
+            if token is not None and token != self._epoch:
+                return
+            self._store(key, item)
+        if self.backend is not None:
+            self.backend.set(key, item, self.ttl)
+
+    def _store(self, key: CacheKey, item: typing.Dict) -> None:
+        self._items[key] = (time.monotonic() + self.ttl, item)
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+            self.stats.evictions += 1
+
+    def invalidate(self, key: CacheKey) -> None:
+        with self._lock:
+            self._items.pop(key, None)
+            self._epoch += 1
+            self.stats.invalidations += 1
+        if self.backend is not None:
+            self.backend.delete(key)
+
+    def invalidate_item(self, table: str, item: typing.Mapping) -> None:
+        """Invalidate the entry of a full (plain) item, the key attributes of table must be in key_attrs"""
+        attrs = self.key_attrs.get(table)
+        if attrs and all(attr in item for attr in attrs):
+            self.invalidate(cache_key(table, {attr: item[attr] for attr in attrs}))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._epoch += 1
+        if self.backend is not None:
+            self.backend.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
@@ -0,0 +1,144 @@
+"""
+Process-wide cache of boto3 clients, built on first use and shared by every S3/DYDB/SQS
+instance with the same settings. boto3 clients are thread-safe once built but sessions are
+not, so construction goes through one session behind a lock
+"""
+import boto3
+import typing
+import threading
+import botocore.config
+from .metrics import Metrics
+
+
+class ClientFactory:
+    """
+    Builds and caches boto3 clients keyed by service, region and credentials
+    max_pool_connections sizes each client's urllib3 pool (keep it at or above the number of
+    threads sharing the client), retry_mode/max_attempts are botocore's retry settings
+    ("legacy", "standard" or "adaptive"), config is merged over the settings when given
+    Without max_attempts botocore sends each request once and retries are left to the wrappers'
+    RetryPolicy; retries botocore makes when it is given count against the policy's budgets
+    metrics instruments every client the factory builds (see Metrics), without it the clients
+    carry no instrumentation at all
+    """
+
+    def __init__(
+        self,
+        max_pool_connections: int = 50,
+        retry_mode: str = "standard",
+        max_attempts: int = None,
+        connect_timeout: float = 10,
+        read_timeout: float = 60,
+        tcp_keepalive: bool = True,
+        endpoint_url: str = None,
+        config: botocore.config.Config = None,
+        metrics: Metrics = None
+    ):
+        retries = {"mode": retry_mode, "total_max_attempts": 1}
+        if max_attempts is not None:
+            retries = {"mode": retry_mode, "max_attempts": max_attempts}
+        self.config = botocore.config.Config(
+            max_pool_connections=max_pool_connections,
+            retries=retries,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            tcp_keepalive=tcp_keepalive,
+        )
+        if config is not None:
+            self.config = self.config.merge(config)
+        self.endpoint_url = endpoint_url
+        self.metrics = metrics
+        self._lock = threading.Lock()
+        self._session = None
+        self._clients: typing.Dict[tuple, typing.Any] = {}
+
+    def client(
+        self,
+        service: str,
+        aws_access_key_id: str = None,
+        aws_secret_access_key: str = None,
+        region_name: str = None
+    ):
+        """The shared client of service for these credentials, built on the first call"""
+        key = (service, region_name, aws_access_key_id, aws_secret_access_key)
+        try:
+            return self._clients[key]
+        except KeyError:
+            pass
+        with self._lock:
+            if key not in self._clients:
+                self._clients[key] = self._build(service, aws_access_key_id, aws_secret_access_key, region_name)
+            return self._clients[key]
+
+    def new_client(
+        self,
+        service: str,
+        aws_access_key_id: str = None,
+        aws_secret_access_key: str = None,
+        region_name: str = None
+    ):
+        """
+        A client with the factory's settings that is not cached nor shared, for callers that
+        register their own event hooks (e.g. a RateLimiter) which must not apply to other instances
+        """
+        with self._lock:
+            return self._build(service, aws_access_key_id, aws_secret_access_key, region_name)
+
+    def _build(self, service: str, aws_access_key_id: str, aws_secret_access_key: str, region_name: str):
+        client = self._get_session().client(
+            service,
+            aws_access_key_id=aws_access_key_id,
+            aws_secret_access_key=aws_secret_access_key,
+            region_name=region_name,
+            endpoint_url=self.endpoint_url,
+            config=self.config
+        )
+        if self.metrics is not None:
+            self.metrics.attach(client)
+        return client
+
+    def resource(
+        self,
+        service: str,
+        aws_access_key_id: str = None,
+        aws_secret_access_key: str = None,
+        region_name: str = None
+    ):
+        """A new resource over the shared client, resources are not thread-safe so they are never cached"""
+        shared = self.client(service, aws_access_key_id, aws_secret_access_key, region_name)
+        with self._lock:
+            resource = self._get_session().resource(
+                service,
+                aws_access_key_id=aws_access_key_id,
+                aws_secret_access_key=aws_secret_access_key,
+                region_name=region_name,
+                endpoint_url=self.endpoint_url,
+                config=self.config
+            )
+        resource.meta.client = shared
+        return resource
+
+    def _get_session(self) -> boto3.session.Session:
+        if self._session is None:
+            self._session = boto3.session.Session()
+        return self._session
+
+    def clear(self) -> None:
+        """Drop every cached client (e.g. after fork or a credential rotation)"""
+        with self._lock:
+            self._clients.clear()
+            self._session = None
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_factory() -> ClientFactory:
+    """The factory used by S3, DYDB and SQS when none is passed"""
+    global _default
+    if _default is None:
+        with _default_lock:
+            if _default is None:
+                _default = ClientFactory()
+    return _default
@@ -0,0 +1,189 @@
+import time
+import queue
+import typing
+import logging
+import threading
+import concurrent.futures
+from ..schema.sqs import SQSConsumerStats
+
+logger = logging.getLogger(__name__)
+
+
+class Consumer:
+    """
+    Long-polls a queue from several receiver threads and hands every message to handler on a
+    thread pool. Messages whose handler returns are deleted through DeleteMessageBatch, messages
+    still being handled get their visibility extended before it runs out, and receivers stop
+    polling while max_in_flight messages are waiting or being handled (backpressure)
+    A handler that raises leaves its message on the queue, it becomes visible again right away
+    with release_on_error or once its visibility timeout expires otherwise
+    """
+
+    def __init__(
+        self,
+        sqs: "SQS",
+        handler: typing.Callable[[typing.Dict], typing.Any],
+        queue_url: str,
+        concurrency: int = 8,
+        receivers: int = 2,
+        max_in_flight: int = None,
+        visibility_timeout: int = 30,
+        wait_time_seconds: int = 20,
+        release_on_error: bool = False,
+        delete_interval: float = 1.0,
+        attribute_names: typing.List[str] = ("All",),
+        message_attribute_names: typing.List[str] = ()
+    ):
+        self.sqs = sqs
+        self.handler = handler
+        self.queue_url = queue_url
+        self.concurrency = concurrency
+        self.receivers = receivers
+        self.max_in_flight = max_in_flight or concurrency * 2
+        self.visibility_timeout = visibility_timeout
+        self.wait_time_seconds = wait_time_seconds
+        self.release_on_error = release_on_error
+        self.delete_interval = delete_interval
+        self.attribute_names = list(attribute_names)
+        self.message_attribute_names = list(message_attribute_names)
+
+        self.stats = SQSConsumerStats()
+        self._stop = threading.Event()
+        self._closed = threading.Event()
+        self._slots = threading.Semaphore(self.max_in_flight)
+        self._acks = queue.Queue()
+        self._lock = threading.Lock()
+        self._in_flight: typing.Dict[str, float] = {}  # receipt handle -> visibility deadline
+        self._limit = None
+
+    def stop(self) -> None:
+        """Stop receiving, in-flight messages are still handled and acknowledged"""
+        self._stop.set()
+
+    def run(self, max_messages: int = None) -> SQSConsumerStats:
+        """Consume until stop() is called (or max_messages were handled), then drain and return stats"""
+        self._limit = max_messages
+        with concurrent.futures.ThreadPoolExecutor(self.concurrency) as executor:
+            receivers = [
+                threading.Thread(target=self._receive, args=(executor,), daemon=True)
+                for _ in range(self.receivers)
+            ]
+            background = [
+                threading.Thread(target=self._delete, daemon=True),
+                threading.Thread(target=self._heartbeat, daemon=True),
+            ]
+            for thread in receivers + background:
+                thread.start()
+            try:
+                while any(thread.is_alive() for thread in receivers):
+                    for thread in receivers:
+                        thread.join(timeout=0.5)
+            except KeyboardInterrupt:
+                self.stop()
+                for thread in receivers:
+                    thread.join()
+        self._closed.set()
+        self._acks.put(None)
+        for thread in background:
+            thread.join()
+        return self.stats
+
+    def _receive(self, executor: concurrent.futures.Executor) -> None:
+        while not self._stop.is_set():
+            if not self._slots.acquire(timeout=0.5):
+                continue
+            taken = 1
+            while taken < 10 and self._slots.acquire(blocking=False):
+                taken += 1
+            try:
+                messages = self.sqs.sqs.receive_message(
+                    QueueUrl=self.queue_url,
+                    AttributeNames=self.attribute_names,
+                    MessageAttributeNames=self.message_attribute_names,
+                    MaxNumberOfMessages=taken,
+                    VisibilityTimeout=self.visibility_timeout,
+                    WaitTimeSeconds=self.wait_time_seconds,
+                ).get("Messages", [])
+            except Exception as err:
+                logger.error(f"ReceiveMessage on {self.queue_url} failed: {err}")
+                messages = []
+                self._stop.wait(1)
+            for _ in range(taken - len(messages)):
+                self._slots.release()
+            deadline = time.monotonic() + self.visibility_timeout
+            with self._lock:
+                self.stats.received += len(messages)
+                for message in messages:
+                    self._in_flight[message["ReceiptHandle"]] = deadline
+            for message in messages:
+                executor.submit(self._handle, message)
+
+    def _handle(self, message: typing.Dict) -> None:
+        receipt = message["ReceiptHandle"]
+        try:
+            self.handler(message)
+        except Exception as err:
+            logger.error(f"Handler failed for message {message.get('MessageId')}: {err}")
+            with self._lock:
+                self.stats.failed += 1
+                self._in_flight.pop(receipt, None)
+            if self.release_on_error:
+                self._change_visibility([receipt], 0)
+        else:
+            with self._lock:
+                self.stats.processed += 1
+                self._in_flight.pop(receipt, None)
+                if self._limit and self.stats.processed + self.stats.failed >= self._limit:
+                    self._stop.set()
+            self._acks.put(receipt)
+        finally:
+            self._slots.release()
+
+    def _delete(self) -> None:
+        closing = False
+        while not closing:
+            batch, flush_at = [], time.monotonic() + self.delete_interval
+            while len(batch) < 10:
+                try:
+                    receipt = self._acks.get(timeout=max(0, flush_at - time.monotonic()))
+                except queue.Empty:
+                    break
+                if receipt is None:
+                    closing = True
+                    break
+                batch.append(receipt)
+            if not batch:
+                continue
+            try:
+                deleted = self.sqs.delete_batch(batch, self.queue_url)
+            except Exception as err:
+                # the messages become visible again, the thread keeps acknowledging the next ones
+                logger.error(f"DeleteMessageBatch on {self.queue_url} failed: {err}")
+                continue
+            with self._lock:
+                self.stats.deleted += deleted
+
+    def _heartbeat(self) -> None:
+        """Extend the visibility of messages still being handled once they are within a third of expiring"""
+        margin = max(2, self.visibility_timeout / 3)
+        while not self._closed.wait(1):
+            now = time.monotonic()
+            with self._lock:
+                due = [r for r, deadline in self._in_flight.items() if deadline - now <= margin]
+                for receipt in due:
+                    self._in_flight[receipt] = now + self.visibility_timeout
+            if due:
+                self._change_visibility(due, self.visibility_timeout)
+                with self._lock:
+                    self.stats.extended += len(due)
+
+    def _change_visibility(self, receipts: typing.List[str], timeout: int) -> None:
+        for i in range(0, len(receipts), 10):
+            entries = [
+                {"Id": str(n), "ReceiptHandle": r, "VisibilityTimeout": timeout}
+                for n, r in enumerate(receipts[i:i + 10])
+            ]
+            try:
+                self.sqs.sqs.change_message_visibility_batch(QueueUrl=self.queue_url, Entries=entries)
+            except Exception as err:
+                logger.warning(f"ChangeMessageVisibilityBatch on {self.queue_url} failed: {err}")
@@ -0,0 +1,120 @@
+"""
+Update expressions compiled once per shape (the actions and attribute paths involved)
+Every attribute name goes through a #n placeholder and every value through a :v placeholder,
+so reserved words, dots and dashes in attribute names are always safe
+Nested paths are guarded by a condition on their parent maps, DynamoDB cannot set a path inside
+a map that does not exist, see fill_missing_maps
+"""
+import typing
+import functools
+
+Path = typing.Tuple[str, ...]
+EMPTY_LIST = ":empty"
+
+
+class CompiledUpdate(typing.NamedTuple):
+    expression: str
+    names: typing.Dict[str, str]
+    values: typing.Tuple[str, ...]  # placeholders in the order of the shape's paths
+    empty_list: bool  # whether EMPTY_LIST has to be bound
+    condition: str  # guard of the shape's exists/absent paths, empty without any
+
+
+class UpdateShape(typing.NamedTuple):
+    set: typing.Tuple[Path, ...] = ()
+    append: typing.Tuple[Path, ...] = ()
+    add: typing.Tuple[Path, ...] = ()
+    remove: typing.Tuple[Path, ...] = ()
+    exists: typing.Tuple[Path, ...] = ()  # maps the nested set paths are written into
+    absent: typing.Tuple[Path, ...] = ()  # maps set as a whole because they were missing
+
+
+def flatten(data: typing.Dict, merge: bool = True, parent: Path = ()) -> typing.Iterator[typing.Tuple[Path, typing.Any]]:
+    """Yield (path, value) for data, nested non-empty dicts are descended into when merge is set"""
+    for k, v in data.items():
+        path = (*parent, k)
+        if merge and isinstance(v, dict) and v:
+            yield from flatten(v, merge, path)
+        else:
+            yield path, v
+
+
+def parents(paths: typing.Iterable[Path]) -> typing.Tuple[Path, ...]:
+    """Deepest parent maps of nested paths, a map whose child is listed is implied"""
+    found = {path[:-1] for path in paths if len(path) > 1}
+    return tuple(sorted(p for p in found if not any(q[:len(p)] == p and q != p for q in found)))
+
+
+def fill_missing_maps(
+    shape: UpdateShape,
+    values: typing.List[typing.Any],
+    item: typing.Union[typing.Dict, None]
+) -> typing.Tuple[UpdateShape, typing.List[typing.Any]]:
+    """
+    Rewrite the set paths of (shape, values) for item, the current item as plain python (None when
+    missing): the paths below a map item lacks are folded into one SET of the first missing map,
+    guarded as absent, every other path keeps its nested merge
+    """
+    n = len(shape.set)
+    sets, absent = {}, []
+    for path, value in zip(shape.set, values[:n]):
+        node, missing = item or {}, None
+        for i, part in enumerate(path[:-1]):
+            if not isinstance(node, dict):
+                break
+            if part not in node:
+                missing = i
+                break
+            node = node[part]
+        if missing is None:
+            sets[path] = value
+            continue
+        prefix = path[:missing + 1]
+        if prefix not in absent:
+            absent.append(prefix)
+        node = sets.setdefault(prefix, {})
+        for part in path[missing + 1:-1]:
+            node = node.setdefault(part, {})
+        node[path[-1]] = value
+    kept = [path for path in sets if path not in absent]
+    shape = shape._replace(set=tuple(sets), exists=parents(kept), absent=tuple(absent))
+    return shape, [*sets.values(), *values[n:]]
+
+
+def parse_path(path: typing.Union[str, Path]) -> Path:
+    """Dotted string ("a.b.c") or tuple to path tuple"""
+    return tuple(path.split(".")) if isinstance(path, str) else tuple(path)
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_update(shape: UpdateShape) -> CompiledUpdate:
+    """Build the UpdateExpression of a shape, cached so repeated shapes cost one dict lookup"""
+    names, aliases, values = {}, {}, []
+
+    def name(path: Path) -> str:
+        parts = []
+        for part in path:
+            if part not in aliases:
+                aliases[part] = f"#n{len(aliases)}"
+                names[aliases[part]] = part
+            parts.append(aliases[part])
+        return ".".join(parts)
+
+    def value() -> str:
+        values.append(f":v{len(values)}")
+        return values[-1]
+
+    assignments = [f"{name(path)} = {value()}" for path in shape.set]
+    for path in shape.append:
+        target = name(path)
+        assignments.append(f"{target} = list_append(if_not_exists({target}, {EMPTY_LIST}), {value()})")
+    clauses = []
+    if assignments:
+        clauses.append("SET " + ", ".join(assignments))
+    if shape.add:
+        clauses.append("ADD " + ", ".join(f"{name(path)} {value()}" for path in shape.add))
+    if shape.remove:
+        clauses.append("REMOVE " + ", ".join(name(path) for path in shape.remove))
+    guards = [f"attribute_exists({name(path)})" for path in shape.exists]
+    guards += [f"attribute_not_exists({name(path)})" for path in shape.absent]
+    return CompiledUpdate(" ".join(clauses), names, tuple(values), bool(shape.append), " AND ".join(guards))
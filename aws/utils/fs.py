@@ -0,0 +1,68 @@
+import os
+import mmap
+import base64
+import typing
+import hashlib
+
+
+class LocalFile(typing.NamedTuple):
+    path: str
+    rel: str  # posix path relative to the walked root
+    size: int
+    mtime_ns: int
+
+
+def iter_files(root: str) -> typing.Iterator[LocalFile]:
+    """Walk root once with os.scandir and yield every regular file below it"""
+    stack = [(root, "")]
+    while stack:
+        top, rel = stack.pop()
+        with os.scandir(top) as it:
+            for entry in it:
+                name = f"{rel}/{entry.name}" if rel else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append((entry.path, name))
+                elif entry.is_file(follow_symlinks=True):
+                    st = entry.stat()
+                    yield LocalFile(entry.path, name, st.st_size, st.st_mtime_ns)
+
+
+MAX_PARTS = 10000
+MB = 1024 ** 2
+
+
+def part_size(size: int, chunksize: int = 8 * MB) -> int:
+    """Double chunksize until size fits in S3's 10000 part limit, as s3transfer does"""
+    while -(-size // chunksize) > MAX_PARTS:
+        chunksize *= 2
+    return chunksize
+
+
+def file_digest(path: str, threshold: int = 8 * MB, chunksize: int = 8 * MB) -> typing.Tuple[str, typing.Union[str, None]]:
+    """
+    (ETag, Content-MD5) S3 assigns to path when uploaded with the given multipart threshold and
+    part size, the file is hashed through mmap so parts are never copied into Python bytes
+    Single part uploads have the plain MD5 as ETag and its base64 as Content-MD5, multipart ones
+    the MD5 of the part digests suffixed with the part count and no Content-MD5
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            digest = hashlib.md5().digest()
+            return digest.hex(), base64.b64encode(digest).decode()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            view = memoryview(mm)
+            try:
+                if size < threshold:
+                    digest = hashlib.md5(view).digest()
+                    return digest.hex(), base64.b64encode(digest).decode()
+                chunksize = part_size(size, chunksize)
+                digests = b"".join(hashlib.md5(view[i:i + chunksize]).digest() for i in range(0, size, chunksize))
+            finally:
+                view.release()
+    return f"{hashlib.md5(digests).hexdigest()}-{len(digests) // 16}", None
+
+
+def file_etag(path: str, threshold: int = 8 * MB, chunksize: int = 8 * MB) -> str:
+    """ETag S3 assigns to path when uploaded with the given multipart threshold and part size"""
+    return file_digest(path, threshold, chunksize)[0]
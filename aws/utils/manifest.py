@@ -0,0 +1,94 @@
+import os
+import typing
+import sqlite3
+import hashlib
+import threading
+
+
+class ManifestEntry(typing.NamedTuple):
+    size: int
+    mtime_ns: typing.Union[int, None]  # None when seeded from a remote listing
+    etag: str
+
+
+class SyncManifest:
+    """
+    SQLite index of the local files last synced with an S3 prefix
+    Each key maps the local size and mtime to the ETag of the matching remote object
+    """
+
+    def __init__(self, path: str, commit_every: int = 1000):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.commit_every = commit_every
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER, etag TEXT NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def default_path(bucket: str, prefix: str, local_path: str) -> str:
+        """Manifest location under ~/.cache for a (bucket, prefix, local directory) triple"""
+        ident = f"{bucket}/{prefix}|{os.path.abspath(local_path)}"
+        name = hashlib.sha1(ident.encode()).hexdigest()[:16]
+        cache = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+        return os.path.join(cache, "aws-python", "sync", f"{name}.sqlite")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def get(self, key: str) -> typing.Union[ManifestEntry, None]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime_ns, etag FROM entries WHERE key = ?", (key,)).fetchone()
+        return ManifestEntry(*row) if row else None
+
+    def put(self, key: str, size: int, mtime_ns: typing.Union[int, None], etag: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, size, mtime_ns, etag) VALUES (?, ?, ?, ?)",
+                (key, size, mtime_ns, etag))
+            self._tick()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._tick()
+
+    def keys(self) -> typing.List[str]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT key FROM entries")]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.commit()
+
+    def commit(self) -> None:
+        with self._lock:
+            self._conn.commit()
+            self._writes = 0
+
+    def close(self) -> None:
+        self.commit()
+        self._conn.close()
+
+    def _tick(self) -> None:
+        self._writes += 1
+        if self._writes >= self.commit_every:
+            self._conn.commit()
+            self._writes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,406 @@
+"""
+Per-call instrumentation of the boto3 clients behind S3, DYDB and SQS
+Metrics registers handlers on botocore's client events (before-call, before-send, needs-retry,
+after-call), so it sees every call of every wrapper sharing the client, including the calls
+retried by errorhandler. The retries themselves are decided by the wrappers' RetryPolicy, which
+reports them through record_retry. Nothing is registered unless a Metrics is attached, which
+keeps the disabled path free: pass one to the ClientFactory the wrappers are built with
+"""
+import time
+import bisect
+import socket
+import typing
+import logging
+import threading
+from ..err.base import THROTTLING_CODES, AWSError
+from ..schema.metrics import CallMetrics
+
+logger = logging.getLogger(__name__)
+
+# DynamoDB operations whose consumed capacity is read capacity
+READ_OPERATIONS = {"GetItem", "BatchGetItem", "Query", "Scan", "TransactGetItems", "ExecuteStatement"}
+
+
+def capacity_units(
+    operation: str,
+    capacity: typing.Union[typing.Dict, typing.List[typing.Dict]]
+) -> typing.Dict[str, typing.Tuple[float, float]]:
+    """(read, write) units per table of a ConsumedCapacity response field, one entry or a list"""
+    read = operation in READ_OPERATIONS
+    units = {}
+    for entry in capacity if isinstance(capacity, list) else [capacity]:
+        table = entry.get("TableName", "")
+        if "ReadCapacityUnits" in entry or "WriteCapacityUnits" in entry:
+            rcu, wcu = entry.get("ReadCapacityUnits", 0.0), entry.get("WriteCapacityUnits", 0.0)
+        else:
+            total = entry.get("CapacityUnits", 0.0)
+            rcu, wcu = (total, 0.0) if read else (0.0, total)
+        previous = units.get(table, (0.0, 0.0))
+        units[table] = (previous[0] + rcu, previous[1] + wcu)
+    return units
+
+
+class Histogram:
+    """Fixed bucket latency histogram (seconds), quantiles are interpolated within a bucket"""
+
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, buckets: typing.Sequence[float] = BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                low = self.buckets[i - 1] if i else 0.0
+                high = self.buckets[i] if i < len(self.buckets) else self.max
+                return min(self.max, low + (high - low) * (rank - seen) / n)
+            seen += n
+        return self.max
+
+    def to_dict(self) -> typing.Dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+        }
+
+
+class Metrics:
+    """
+    Latency histograms, call/error/retry/throttle counters and bytes per operation, plus the
+    DynamoDB capacity consumed per table
+    DynamoDB calls that accept it are sent with ReturnConsumedCapacity=consumed_capacity
+    ("TOTAL" by default, None leaves requests unchanged)
+    Every finished call is also passed as a CallMetrics to each hook (see StatsDExporter,
+    OpenTelemetryExporter), hooks run on the calling thread and must be quick; hooks with a
+    retried(service, operation) method are also told about every retry
+    """
+
+    def __init__(
+        self,
+        hooks: typing.Iterable[typing.Callable[[CallMetrics], None]] = (),
+        consumed_capacity: str = "TOTAL"
+    ):
+        self.hooks = list(hooks)
+        self.consumed_capacity = consumed_capacity
+        self._lock = threading.Lock()
+        # (service, operation) of the thread's last failed call, the one a retry repeats
+        self._failed = threading.local()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.started = time.monotonic()
+            self.latency: typing.Dict[typing.Tuple[str, str], Histogram] = {}
+            self.calls: typing.Dict[typing.Tuple[str, str], int] = {}
+            self.errors: typing.Dict[typing.Tuple[str, str, str], int] = {}
+            self.retries: typing.Dict[typing.Tuple[str, str], int] = {}
+            self.throttles: typing.Dict[typing.Tuple[str, str], int] = {}
+            self.bytes_sent: typing.Dict[str, int] = {}
+            self.bytes_received: typing.Dict[str, int] = {}
+            self.read_units: typing.Dict[str, float] = {}
+            self.write_units: typing.Dict[str, float] = {}
+
+    def add_hook(self, hook: typing.Callable[[CallMetrics], None]) -> None:
+        self.hooks.append(hook)
+
+    def attach(self, client) -> None:
+        """Instrument a boto3 (or aiobotocore) client, attaching twice is a no-op"""
+        events = client.meta.events
+        uid = f"aws-metrics-{id(self)}"
+        if client.meta.service_model.service_name == "dynamodb":
+            events.register("provide-client-params.dynamodb", self._provide_params, unique_id=f"{uid}-params")
+        events.register("before-call", self._before_call, unique_id=f"{uid}-before-call")
+        events.register("before-send", self._before_send, unique_id=f"{uid}-before-send")
+        events.register("needs-retry", self._needs_retry, unique_id=f"{uid}-needs-retry")
+        events.register("after-call", self._after_call, unique_id=f"{uid}-after-call")
+        events.register("after-call-error", self._after_call_error, unique_id=f"{uid}-after-call-error")
+
+    def _provide_params(self, params, model, **kwargs):
+        if self.consumed_capacity and "ReturnConsumedCapacity" in model.input_shape.members:
+            params.setdefault("ReturnConsumedCapacity", self.consumed_capacity)
+
+    def _before_call(self, model, context, **kwargs):
+        context["aws_metrics"] = {
+            "service": model.service_model.service_name,
+            "operation": model.name,
+            "start": time.perf_counter(),
+            "sent": 0,
+            "throttles": 0,
+        }
+
+    def _before_send(self, request, **kwargs):
+        state = (getattr(request, "context", None) or {}).get("aws_metrics")
+        length = request.headers.get("Content-Length")
+        if state is not None and length:
+            state["sent"] += int(length)
+
+    def _needs_retry(self, response, request_dict, **kwargs):
+        state = request_dict.get("context", {}).get("aws_metrics")
+        if state is None or response is None:
+            return None
+        http_response, parsed = response
+        code = parsed.get("Error", {}).get("Code")
+        if code in THROTTLING_CODES or http_response.status_code == 429:
+            state["throttles"] += 1
+        return None
+
+    def _after_call(self, http_response, parsed, model, context, **kwargs):
+        state = context.pop("aws_metrics", None)
+        if state is None:
+            return
+        if "Error" in parsed:
+            self._failed.call = (state["service"], state["operation"])
+        call = CallMetrics(
+            state["service"],
+            state["operation"],
+            time.perf_counter() - state["start"],
+            status=http_response.status_code,
+            error=parsed.get("Error", {}).get("Code"),
+            retries=parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0),
+            throttles=state["throttles"],
+            bytes_sent=state["sent"],
+            bytes_received=int(http_response.headers.get("content-length") or 0),
+        )
+        capacity = parsed.get("ConsumedCapacity")
+        if capacity:
+            self._add_capacity(call, capacity)
+        self.record(call)
+
+    def _after_call_error(self, exception, context, **kwargs):
+        state = context.pop("aws_metrics", None)
+        if state is None:
+            return
+        self._failed.call = (state["service"], state["operation"])
+        self.record(CallMetrics(
+            state["service"],
+            state["operation"],
+            time.perf_counter() - state["start"],
+            error=type(exception).__name__,
+            throttles=state["throttles"],
+            bytes_sent=state["sent"],
+        ))
+
+    @staticmethod
+    def _add_capacity(call: CallMetrics, capacity: typing.Union[typing.Dict, typing.List[typing.Dict]]) -> None:
+        for table, (rcu, wcu) in capacity_units(call.operation, capacity).items():
+            if rcu:
+                call.read_units[table] = call.read_units.get(table, 0.0) + rcu
+            if wcu:
+                call.write_units[table] = call.write_units.get(table, 0.0) + wcu
+
+    def record(self, call: CallMetrics) -> None:
+        """Aggregate a finished call and pass it to the hooks"""
+        op = (call.service, call.operation)
+        with self._lock:
+            if op not in self.latency:
+                self.latency[op] = Histogram()
+            self.latency[op].observe(call.latency)
+            self.calls[op] = self.calls.get(op, 0) + 1
+            if call.error:
+                key = (*op, call.error)
+                self.errors[key] = self.errors.get(key, 0) + 1
+            if call.retries:
+                self.retries[op] = self.retries.get(op, 0) + call.retries
+            if call.throttles:
+                self.throttles[op] = self.throttles.get(op, 0) + call.throttles
+            self.bytes_sent[call.service] = self.bytes_sent.get(call.service, 0) + call.bytes_sent
+            self.bytes_received[call.service] = self.bytes_received.get(call.service, 0) + call.bytes_received
+            for table, units in call.read_units.items():
+                self.read_units[table] = self.read_units.get(table, 0.0) + units
+            for table, units in call.write_units.items():
+                self.write_units[table] = self.write_units.get(table, 0.0) + units
+        for hook in self.hooks:
+            try:
+                hook(call)
+            except Exception as err:
+                logger.warning(f"Metrics hook {hook!r} failed: {err}")
+
+    def record_retry(self, error: AWSError) -> None:
+        """
+        Count a retry decided by a RetryPolicy (errorhandler, Retrier), for errors without an
+        operation (connection failures) it is the last call that failed on this thread
+        """
+        failed = getattr(self._failed, "call", (None, None))
+        op = (error.service or failed[0] or "unknown", error.operation or failed[1] or "Unknown")
+        with self._lock:
+            self.retries[op] = self.retries.get(op, 0) + 1
+        for hook in self.hooks:
+            retried = getattr(hook, "retried", None)
+            if retried is None:
+                continue
+            try:
+                retried(*op)
+            except Exception as err:
+                logger.warning(f"Metrics hook {hook!r} failed: {err}")
+
+    def snapshot(self) -> typing.Dict:
+        """Everything recorded since creation or the last reset, as plain JSON-able values"""
+        with self._lock:
+            elapsed = max(time.monotonic() - self.started, 1e-9)
+            operations = {
+                f"{service}.{operation}": {
+                    "calls": self.calls.get((service, operation), 0),
+                    "retries": self.retries.get((service, operation), 0),
+                    "throttles": self.throttles.get((service, operation), 0),
+                    "errors": {code: n for (s, o, code), n in self.errors.items() if (s, o) == (service, operation)},
+                    "latency": histogram.to_dict(),
+                }
+                for (service, operation), histogram in self.latency.items()
+            }
+            services = {
+                service: {
+                    "bytes_sent": self.bytes_sent.get(service, 0),
+                    "bytes_received": self.bytes_received.get(service, 0),
+                    "bytes_per_sec": (self.bytes_sent.get(service, 0) + self.bytes_received.get(service, 0)) / elapsed,
+                }
+                for service in {*self.bytes_sent, *self.bytes_received}
+            }
+            capacity = {
+                table: {"read_units": self.read_units.get(table, 0.0), "write_units": self.write_units.get(table, 0.0)}
+                for table in {*self.read_units, *self.write_units}
+            }
+        return {"elapsed": elapsed, "operations": operations, "services": services, "capacity": capacity}
+
+    def prometheus(self, prefix: str = "aws") -> str:
+        """The counters and histograms in Prometheus text exposition format"""
+        lines = []
+
+        def family(name, kind, doc):
+            lines.append(f"# HELP {prefix}_{name} {doc}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+
+        def labels(**values):
+            return "{" + ",".join(f'{k}="{v}"' for k, v in values.items()) + "}"
+
+        with self._lock:
+            family("call_duration_seconds", "histogram", "Latency of client calls, retries included")
+            for (service, operation), histogram in sorted(self.latency.items()):
+                cumulative = 0
+                for bound, n in zip((*histogram.buckets, "+Inf"), histogram.counts):
+                    cumulative += n
+                    lines.append(f"{prefix}_call_duration_seconds_bucket"
+                                 f"{labels(service=service, operation=operation, le=bound)} {cumulative}")
+                lines.append(f"{prefix}_call_duration_seconds_sum{labels(service=service, operation=operation)} "
+                             f"{histogram.sum}")
+                lines.append(f"{prefix}_call_duration_seconds_count{labels(service=service, operation=operation)} "
+                             f"{histogram.count}")
+            for name, doc, counter in (
+                ("calls_total", "Client calls", self.calls),
+                ("retries_total", "Retries made by botocore or the retry policy", self.retries),
+                ("throttles_total", "Attempts answered with a throttling error", self.throttles),
+            ):
+                family(name, "counter", doc)
+                for (service, operation), n in sorted(counter.items()):
+                    lines.append(f"{prefix}_{name}{labels(service=service, operation=operation)} {n}")
+            family("errors_total", "Failed client calls by error code", "counter")
+            for (service, operation, code), n in sorted(self.errors.items()):
+                lines.append(f"{prefix}_errors_total{labels(service=service, operation=operation, code=code)} {n}")
+            for name, doc, counter in (
+                ("bytes_sent_total", "Request bytes", self.bytes_sent),
+                ("bytes_received_total", "Response bytes", self.bytes_received),
+            ):
+                family(name, "counter", doc)
+                for service, n in sorted(counter.items()):
+                    lines.append(f"{prefix}_{name}{labels(service=service)} {n}")
+            for name, doc, counter in (
+                ("dynamodb_read_units_total", "Consumed read capacity units", self.read_units),
+                ("dynamodb_write_units_total", "Consumed write capacity units", self.write_units),
+            ):
+                family(name, "counter", doc)
+                for table, n in sorted(counter.items()):
+                    lines.append(f"{prefix}_{name}{labels(table=table)} {n}")
+        return "\n".join(lines) + "\n"
+
+
+class StatsDExporter:
+    """Metrics hook sending each call to a StatsD daemon over UDP, send errors are ignored"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8125, prefix: str = "aws"):
+        self.address = (host, port)
+        self.prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def __call__(self, call: CallMetrics) -> None:
+        name = f"{self.prefix}.{call.service}.{call.operation}"
+        lines = [f"{name}.latency:{call.latency * 1000:.3f}|ms", f"{name}.calls:1|c"]
+        if call.error:
+            lines.append(f"{name}.errors.{call.error}:1|c")
+        if call.retries:
+            lines.append(f"{name}.retries:{call.retries}|c")
+        if call.throttles:
+            lines.append(f"{name}.throttles:{call.throttles}|c")
+        if call.bytes_sent:
+            lines.append(f"{self.prefix}.{call.service}.bytes_sent:{call.bytes_sent}|c")
+        if call.bytes_received:
+            lines.append(f"{self.prefix}.{call.service}.bytes_received:{call.bytes_received}|c")
+        for table, units in call.read_units.items():
+            lines.append(f"{self.prefix}.dynamodb.{table}.read_units:{units}|c")
+        for table, units in call.write_units.items():
+            lines.append(f"{self.prefix}.dynamodb.{table}.write_units:{units}|c")
+        self._send(lines)
+
+    def retried(self, service: str, operation: str) -> None:
+        self._send([f"{self.prefix}.{service}.{operation}.retries:1|c"])
+
+    def _send(self, lines: typing.List[str]) -> None:
+        try:
+            self._socket.sendto("\n".join(lines).encode(), self.address)
+        except OSError:
+            pass
+
+
+class OpenTelemetryExporter:
+    """
+    Metrics hook recording each call on an OpenTelemetry meter (e.g. metrics.get_meter("aws")),
+    the meter comes from the caller so opentelemetry is not a dependency of the package
+    """
+
+    def __init__(self, meter, prefix: str = "aws"):
+        self.duration = meter.create_histogram(f"{prefix}.call.duration", unit="s", description="Client call latency")
+        self.calls = meter.create_counter(f"{prefix}.calls", description="Client calls")
+        self.errors = meter.create_counter(f"{prefix}.errors", description="Failed client calls")
+        self.retries = meter.create_counter(
+            f"{prefix}.retries", description="Retries made by botocore or the retry policy")
+        self.throttles = meter.create_counter(f"{prefix}.throttles", description="Throttled attempts")
+        self.bytes = meter.create_counter(f"{prefix}.bytes", unit="By", description="Bytes transferred")
+        self.capacity = meter.create_counter(f"{prefix}.dynamodb.capacity", description="Consumed capacity units")
+
+    def __call__(self, call: CallMetrics) -> None:
+        attributes = {"service": call.service, "operation": call.operation}
+        self.duration.record(call.latency, attributes)
+        self.calls.add(1, attributes)
+        if call.error:
+            self.errors.add(1, {**attributes, "code": call.error})
+        if call.retries:
+            self.retries.add(call.retries, attributes)
+        if call.throttles:
+            self.throttles.add(call.throttles, attributes)
+        if call.bytes_sent:
+            self.bytes.add(call.bytes_sent, {**attributes, "direction": "sent"})
+        if call.bytes_received:
+            self.bytes.add(call.bytes_received, {**attributes, "direction": "received"})
+        for table, units in call.read_units.items():
+            self.capacity.add(units, {"table": table, "kind": "read"})
+        for table, units in call.write_units.items():
+            self.capacity.add(units, {"table": table, "kind": "write"})
+
+    def retried(self, service: str, operation: str) -> None:
+        self.retries.add(1, {"service": service, "operation": operation})
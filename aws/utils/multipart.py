@@ -0,0 +1,397 @@
+import os
+import json
+import typing
+import logging
+import botocore
+import threading
+from boto3.s3.transfer import TransferConfig
+from .fs import part_size
+from .pool import bounded_map
+from .stream import BufferReader
+
+logger = logging.getLogger(__name__)
+
+# largest object a single CopyObject accepts
+MAX_COPY_SIZE = 5 * 1024 ** 3
+# headers a multipart copy has to carry over itself, CopyObject keeps them
+COPIED_HEADERS = (
+    "ContentType", "ContentEncoding", "ContentDisposition", "ContentLanguage",
+    "CacheControl", "Expires", "Metadata",
+)
+
+
+class Checkpoint:
+    """
+    Append-only JSON lines file, the first line describes the transfer and every
+    following line records one finished part, so saving a part never rewrites the file
+    """
+
+    def __init__(self, path: str, header: typing.Dict):
+        self.path = path
+        self.header = header
+        self.previous = None
+        self._lock = threading.Lock()
+        self._file = None
+
+    def load(self) -> typing.Union[typing.Dict[int, typing.Any], None]:
+        """Finished parts recorded for the same header, None when there is nothing to resume"""
+        try:
+            with open(self.path) as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return None
+        try:
+            header = json.loads(lines[0])
+        except (IndexError, ValueError):
+            return None
+        self.previous = header
+        if any(header.get(k) != v for k, v in self.header.items() if k != "upload_id"):
+            return None
+        self.header = header
+        parts = {}
+        for line in lines[1:]:
+            try:
+                part = json.loads(line)
+            except ValueError:  # torn write on the last line
+                break
+            parts[part["n"]] = part.get("v")
+        return parts
+
+    def start(self, header: typing.Dict = None) -> None:
+        self.header = header or self.header
+        self._file = open(self.path, "w")
+        self._file.write(json.dumps(self.header) + "\n")
+        self._file.flush()
+
+    def resume(self) -> None:
+        self._file = open(self.path, "a")
+
+    def record(self, n: int, value: typing.Any = None) -> None:
+        with self._lock:
+            self._file.write(json.dumps({"n": n, "v": value}) + "\n")
+            self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def remove(self) -> None:
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def resumable_upload(
+    client,
+    path: str,
+    bucket: str,
+    key: str,
+    config: TransferConfig,
+    checkpoint: str = None,
+    callback: typing.Callable[[int], None] = None
+) -> typing.Dict:
+    """
+    Multipart upload that records every finished part in a checkpoint file next to path
+    Calling it again after a failure lists the parts S3 already holds for the saved upload ID
+    and only sends the missing ones, on success the checkpoint is removed
+    """
+    st = os.stat(path)
+    chunksize = part_size(st.st_size, config.multipart_chunksize)
+    total = max(1, -(-st.st_size // chunksize))
+    state = Checkpoint(checkpoint or f"{path}.s3upload", {
+        "bucket": bucket, "key": key, "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns, "part_size": chunksize, "upload_id": None,
+    })
+
+    parts = state.load()
+    if parts is not None:
+        try:
+            parts = _list_parts(client, bucket, key, state.header["upload_id"])
+            state.resume()
+            logger.info(f"Resuming upload of {path} to {key}, {len(parts)}/{total} parts done")
+        except botocore.exceptions.ClientError as err:
+            if err.response["Error"]["Code"] != "NoSuchUpload":
+                raise
+            parts = None
+    elif state.previous and state.previous.get("upload_id"):
+        _abort_quietly(client, state.previous["bucket"], state.previous["key"], state.previous["upload_id"])
+    if parts is None:
+        upload_id = client.create_multipart_upload(Bucket=bucket, Key=key)["UploadId"]
+        state.start({**state.header, "upload_id": upload_id})
+        parts = {}
+    upload_id = state.header["upload_id"]
+
+    if callback:
+        callback(sum(min(chunksize, st.st_size - (n - 1) * chunksize) for n in parts))
+
+    def upload_part(n):
+        with open(path, "rb") as f:
+            f.seek((n - 1) * chunksize)
+            body = f.read(chunksize)
+        etag = client.upload_part(
+            Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=n, Body=body)["ETag"]
+        state.record(n, etag)
+        if callback:
+            callback(len(body))
+        return etag
+
+    try:
+        missing = (n for n in range(1, total + 1) if n not in parts)
+        for n, future in bounded_map(upload_part, missing, config.max_concurrency):
+            parts[n] = future.result()
+        resp = client.complete_multipart_upload(
+            Bucket=bucket, Key=key, UploadId=upload_id,
+            MultipartUpload={"Parts": [{"PartNumber": n, "ETag": parts[n]} for n in sorted(parts)]}
+        )
+    finally:
+        state.close()
+    state.remove()
+    return resp
+
+
+def _abort_quietly(client, bucket: str, key: str, upload_id: str) -> None:
+    """Abort a multipart upload whose checkpoint no longer matches the local file"""
+    try:
+        client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+    except botocore.exceptions.ClientError as err:
+        logger.warning(f"Could not abort stale upload {upload_id} of {key}: {err}")
+
+
+def _list_parts(client, bucket: str, key: str, upload_id: str) -> typing.Dict[int, str]:
+    parts = {}
+    pages = client.get_paginator("list_parts").paginate(Bucket=bucket, Key=key, UploadId=upload_id)
+    for page in pages:
+        for part in page.get("Parts", []):
+            parts[part["PartNumber"]] = part["ETag"]
+    return parts
+
+
+def resumable_download(
+    client,
+    bucket: str,
+    key: str,
+    path: str,
+    config: TransferConfig,
+    checkpoint: str = None,
+    callback: typing.Callable[[int], None] = None
+) -> str:
+    """
+    Download key with parallel ranged GETs into path + ".s3part" and rename it when complete
+    Finished ranges are recorded in a checkpoint so a retry only fetches the missing ones,
+    every GET is pinned to the object's ETag so a changed object restarts from zero
+    """
+    head = client.head_object(Bucket=bucket, Key=key)
+    size, etag = head["ContentLength"], head["ETag"]
+    if size == 0:
+        open(path, "wb").close()
+        return path
+    chunksize = part_size(size, config.multipart_chunksize)
+    total = max(1, -(-size // chunksize))
+    partial = f"{path}.s3part"
+    state = Checkpoint(checkpoint or f"{path}.s3download", {
+        "bucket": bucket, "key": key, "etag": etag, "size": size, "part_size": chunksize,
+    })
+
+    done = state.load() if os.path.exists(partial) else None
+    if done is None:
+        with open(partial, "wb") as f:
+            f.truncate(size)
+        state.start()
+        done = {}
+    else:
+        state.resume()
+        logger.info(f"Resuming download of {key} to {path}, {len(done)}/{total} parts done")
+
+    if callback:
+        callback(sum(min(chunksize, size - n * chunksize) for n in done))
+
+    fd = os.open(partial, os.O_WRONLY)
+    try:
+        def download_part(n):
+            start = n * chunksize
+            end = min(size, start + chunksize) - 1
+            body = client.get_object(
+                Bucket=bucket, Key=key, IfMatch=etag, Range=f"bytes={start}-{end}")["Body"]
+            offset = start
+            for block in body.iter_chunks(config.io_chunksize):
+                os.pwrite(fd, block, offset)
+                offset += len(block)
+                if callback:
+                    callback(len(block))
+            state.record(n)
+
+        missing = (n for n in range(total) if n not in done)
+        for _, future in bounded_map(download_part, missing, config.max_concurrency):
+            future.result()
+    finally:
+        os.close(fd)
+        state.close()
+    os.replace(partial, path)
+    state.remove()
+    return path
+
+
+def upload_buffer(
+    client,
+    data,
+    bucket: str,
+    key: str,
+    config: TransferConfig,
+    extra_args: typing.Dict = None,
+    callback: typing.Callable[[int], None] = None
+) -> typing.Dict:
+    """
+    Upload any buffer (bytes, bytearray, memoryview, mmap, numpy array) without staging it
+    Buffers below the multipart threshold are sent with one PutObject, larger ones as parallel
+    parts that each read their own slice of the same memory, a failed upload is aborted
+    """
+    extra_args = extra_args or {}
+    view = memoryview(data).cast("B")
+    size = view.nbytes
+    try:
+        if size < config.multipart_threshold:
+            with BufferReader(view) as body:
+                resp = client.put_object(Bucket=bucket, Key=key, Body=body, **extra_args)
+            if callback:
+                callback(size)
+            return resp
+
+        chunksize = part_size(size, config.multipart_chunksize)
+        upload_id = client.create_multipart_upload(Bucket=bucket, Key=key, **extra_args)["UploadId"]
+
+        def upload_part(n):
+            start = (n - 1) * chunksize
+            with BufferReader(view, start, start + chunksize) as body:
+                etag = client.upload_part(
+                    Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=n, Body=body)["ETag"]
+                if callback:
+                    callback(len(body))
+            return etag
+
+        try:
+            parts = {}
+            for n, future in bounded_map(upload_part, range(1, -(-size // chunksize) + 1), config.max_concurrency):
+                parts[n] = future.result()
+            return client.complete_multipart_upload(
+                Bucket=bucket, Key=key, UploadId=upload_id,
+                MultipartUpload={"Parts": [{"PartNumber": n, "ETag": parts[n]} for n in sorted(parts)]}
+            )
+        except BaseException:
+            _abort_quietly(client, bucket, key, upload_id)
+            raise
+    finally:
+        view.release()
+
+
+def download_buffer(
+    client,
+    bucket: str,
+    key: str,
+    config: TransferConfig,
+    buffer=None,
+    callback: typing.Callable[[int], None] = None
+) -> typing.Tuple[typing.Any, int]:
+    """
+    Download key straight into a writable buffer (bytearray, writable mmap, numpy array) with
+    parallel ranged GETs of multipart_chunksize, each response is read into its own slice
+    The first range also returns the object size, so small objects take a single request
+    Without buffer a bytearray of the object size is allocated, returns (buffer, size)
+    """
+    if buffer is not None and memoryview(buffer).readonly:
+        raise ValueError("Cannot download into a read-only buffer")
+    chunksize = config.multipart_chunksize
+    try:
+        first = client.get_object(Bucket=bucket, Key=key, Range=f"bytes=0-{chunksize - 1}")
+    except botocore.exceptions.ClientError as err:
+        if err.response["Error"]["Code"] != "InvalidRange":
+            raise
+        # ranged GETs of an empty object are unsatisfiable
+        return (bytearray() if buffer is None else buffer), 0
+    size = int(first["ContentRange"].rsplit("/", 1)[1]) if first.get("ContentRange") else first["ContentLength"]
+    etag = first["ETag"]
+    if buffer is None:
+        buffer = bytearray(size)
+    view = memoryview(buffer).cast("B")
+    try:
+        if view.nbytes < size:
+            raise ValueError(f"Buffer of {view.nbytes} bytes is too small for {key} ({size} bytes)")
+
+        def download_range(start):
+            end = min(size, start + chunksize)
+            if start == 0:
+                body = first["Body"]
+            else:
+                body = client.get_object(
+                    Bucket=bucket, Key=key, IfMatch=etag, Range=f"bytes={start}-{end - 1}")["Body"]
+            target = view[start:end]
+            offset = 0
+            while offset < target.nbytes:
+                n = body.readinto(target[offset:])
+                if not n:
+                    break
+                offset += n
+                if callback:
+                    callback(n)
+            target.release()
+
+        for _, future in bounded_map(download_range, range(0, size, chunksize), config.max_concurrency):
+            future.result()
+    finally:
+        first["Body"].close()
+        view.release()
+    return buffer, size
+
+
+def copy_object(
+    client,
+    bucket: str,
+    key: str,
+    dst_bucket: str,
+    dst_key: str,
+    size: int,
+    config: TransferConfig,
+    callback: typing.Callable[[int], None] = None
+) -> typing.Dict:
+    """
+    Server-side copy, no object bytes pass through the client
+    Objects below the multipart threshold (and at most 5GB) take one CopyObject, larger ones are
+    copied as parallel UploadPartCopy ranges pinned to the source ETag, with the source headers
+    and metadata carried over, a failed copy is aborted
+    """
+    source = {"Bucket": bucket, "Key": key}
+    if size < config.multipart_threshold and size <= MAX_COPY_SIZE:
+        resp = client.copy_object(Bucket=dst_bucket, Key=dst_key, CopySource=source)
+        if callback:
+            callback(size)
+        return resp
+
+    head = client.head_object(Bucket=bucket, Key=key)
+    headers = {name: head[name] for name in COPIED_HEADERS if head.get(name)}
+    chunksize = part_size(size, config.multipart_chunksize)
+    upload_id = client.create_multipart_upload(Bucket=dst_bucket, Key=dst_key, **headers)["UploadId"]
+
+    def copy_part(n):
+        start = (n - 1) * chunksize
+        end = min(size, start + chunksize) - 1
+        etag = client.upload_part_copy(
+            Bucket=dst_bucket, Key=dst_key, UploadId=upload_id, PartNumber=n, CopySource=source,
+            CopySourceRange=f"bytes={start}-{end}", CopySourceIfMatch=head["ETag"]
+        )["CopyPartResult"]["ETag"]
+        if callback:
+            callback(end - start + 1)
+        return etag
+
+    try:
+        parts = {}
+        for n, future in bounded_map(copy_part, range(1, -(-size // chunksize) + 1), config.max_concurrency):
+            parts[n] = future.result()
+        return client.complete_multipart_upload(
+            Bucket=dst_bucket, Key=dst_key, UploadId=upload_id,
+            MultipartUpload={"Parts": [{"PartNumber": n, "ETag": parts[n]} for n in sorted(parts)]}
+        )
+    except BaseException:
+        _abort_quietly(client, dst_bucket, dst_key, upload_id)
+        raise
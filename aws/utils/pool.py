@@ -0,0 +1,107 @@
+import queue
+import typing
+import threading
+import concurrent.futures
+
+
+T = typing.TypeVar("T")
+R = typing.TypeVar("R")
+
+
+def bounded_map(
+    fn: typing.Callable[[T], R],
+    iterable: typing.Iterable[T],
+    max_workers: int = 8,
+    max_pending: int = None
+) -> typing.Iterator[typing.Tuple[T, concurrent.futures.Future]]:
+    """
+    Run fn over iterable in a thread pool and yield (item, future) as they complete
+    At most max_pending items are in flight, so the iterable is consumed lazily
+    """
+    max_pending = max_pending or max_workers * 2
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    pending = {}
+    try:
+        for item in iterable:
+            if len(pending) >= max_pending:
+                done, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future
+            pending[executor.submit(fn, item)] = item
+        while pending:
+            done, _ = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def chunked(iterable: typing.Iterable[T], size: int) -> typing.Iterator[typing.List[T]]:
+    """Split iterable lazily into lists of at most size items"""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class _Failure:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def interleave(
+    sources: typing.Iterable[typing.Callable[[], typing.Iterable[T]]],
+    max_workers: int = 8,
+    maxsize: int = 10000
+) -> typing.Iterator[T]:
+    """
+    Drain every source on a pool of max_workers threads and yield their items as they arrive
+    sources is itself consumed on a background thread, so it may be discovered lazily
+    At most maxsize items are buffered, closing the generator stops every source
+    """
+    items = queue.Queue(maxsize)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                return items.put(item, timeout=0.1)
+            except queue.Full:
+                continue
+
+    def drain(source):
+        for item in source():
+            if stop.is_set():
+                return
+            put(item)
+
+    def produce():
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+                futures = [executor.submit(drain, source) for source in sources]
+                for future in concurrent.futures.as_completed(futures):
+                    future.result()
+        except BaseException as err:
+            put(_Failure(err))
+            stop.set()
+        finally:
+            put(done)
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
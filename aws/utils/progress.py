@@ -0,0 +1,37 @@
+import threading
+
+
+class ByteProgress:
+    """
+    Thread-safe tqdm bar counting bytes (or another unit), whose total grows as work is discovered
+    tqdm is only imported when the bar is enabled, a disabled bar is a no-op
+    """
+
+    def __init__(self, desc: str, enabled: bool = True, unit: str = "B"):
+        self._lock = threading.Lock()
+        self.bar = None
+        if enabled:
+            import tqdm
+
+            self.bar = tqdm.tqdm(
+                total=0, unit=unit, unit_scale=True, unit_divisor=1024 if unit == "B" else 1000, desc=desc)
+
+    def add_total(self, n: int) -> None:
+        if self.bar is not None:
+            with self._lock:
+                self.bar.total += n
+
+    def update(self, n: int) -> None:
+        if self.bar is not None:
+            with self._lock:
+                self.bar.update(n)
+
+    def close(self) -> None:
+        if self.bar is not None:
+            self.bar.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,381 @@
+"""
+Client side pacing of DynamoDB traffic for bulk workloads
+RateLimiter registers handlers on a client's events, as Metrics does: every data call is sent with
+ReturnConsumedCapacity, waits on a token bucket of read or write units per table (and per partition
+key for single item calls), then holds a slot of the table's adaptive concurrency limit
+Buckets are charged an estimate before the call and settled with the consumed capacity after it.
+Throttles halve the rate and the concurrency, saturated unthrottled traffic grows them additively
+(AIMD), so bulk jobs settle at the rate the table sustains instead of bursting into throttles
+"""
+import time
+import typing
+import logging
+import functools
+import threading
+import collections
+from ..err.base import THROTTLING_CODES
+from .metrics import capacity_units
+
+logger = logging.getLogger(__name__)
+
+# DynamoDB limits of a single partition, in units per second
+PARTITION_READ_UNITS = 3000.0
+PARTITION_WRITE_UNITS = 1000.0
+# throughput a new on-demand table serves without scaling, the starting rates of on-demand tables
+ON_DEMAND_READ_UNITS = 12000.0
+ON_DEMAND_WRITE_UNITS = 4000.0
+# partition buckets kept per limiter, idle ones are full so dropping them changes nothing
+MAX_PARTITIONS = 10000
+
+# data operations -> whether they consume read capacity
+OPERATIONS = {
+    "GetItem": True,
+    "Query": True,
+    "Scan": True,
+    "BatchGetItem": True,
+    "TransactGetItems": True,
+    "PutItem": False,
+    "UpdateItem": False,
+    "DeleteItem": False,
+    "BatchWriteItem": False,
+    "TransactWriteItems": False,
+}
+SINGLE_ITEM_OPERATIONS = {"GetItem", "PutItem", "UpdateItem", "DeleteItem"}
+
+
+class TokenBucket:
+    """
+    rate units per second, up to one second of them saved while idle
+    Calls reserve an estimate up front and settle the difference once their cost is known; the
+    balance may go negative, later calls then wait until it has been paid back
+    throttled() multiplies the rate by decrease (once per cooldown), while callers keep waiting on
+    the bucket it grows by step units per cooldown up to ceiling
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        ceiling: float = None,
+        step: float = 0.0,
+        decrease: float = 0.5,
+        minimum: float = 1.0,
+        cooldown: float = 1.0
+    ):
+        self.rate = rate
+        self.ceiling = ceiling
+        self.step = step
+        self.decrease = decrease
+        self.minimum = minimum
+        self.cooldown = cooldown
+        self.tokens = rate
+        self.throttles = 0
+        self._updated = self._changed = time.monotonic()
+        self._saturated = False
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.rate, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, units: float) -> float:
+        """Take units, returns the seconds to wait before sending"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= units
+            if self.tokens < 0:
+                self._saturated = True
+            elif self._saturated and self.step and now - self._changed >= self.cooldown:
+                # the demand reached the rate for a whole window without a throttle, probe higher
+                self.rate = min(self.ceiling or float("inf"), self.rate + self.step)
+                self._changed = now
+                self._saturated = False
+            return max(0.0, -self.tokens / self.rate)
+
+    def settle(self, units: float) -> None:
+        """Charge units more (or refund them when negative) than reserved"""
+        with self._lock:
+            self.tokens = min(self.rate, self.tokens - units)
+
+    def throttled(self) -> None:
+        with self._lock:
+            self.throttles += 1
+            now = time.monotonic()
+            if now - self._changed < self.cooldown:
+                return
+            self.rate = max(self.minimum, self.rate * self.decrease)
+            self.tokens = min(self.tokens, 0.0)
+            self._changed = now
+            self._saturated = False
+
+
+class ConcurrencyLimit:
+    """
+    Semaphore whose size adapts: halved by a throttled call (once per cooldown), one slot larger
+    after as many successful calls as it has slots, up to maximum
+    """
+
+    def __init__(self, maximum: int, cooldown: float = 1.0):
+        self.limit = self.maximum = maximum
+        self.cooldown = cooldown
+        self.active = 0
+        self._successes = 0
+        self._decreased = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._cond:
+            while self.active >= self.limit:
+                self._cond.wait()
+            self.active += 1
+
+    def release(self, throttled: bool = False) -> None:
+        with self._cond:
+            self.active -= 1
+            now = time.monotonic()
+            if throttled:
+                if now - self._decreased >= self.cooldown:
+                    self.limit = max(1, self.limit // 2)
+                    self._decreased = now
+                self._successes = 0
+            else:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.maximum:
+                    self.limit += 1
+                    self._successes = 0
+            self._cond.notify_all()
+
+
+class _Table:
+    """Buckets and concurrency of one table"""
+
+    def __init__(self, key_attr: typing.Union[str, None], read: TokenBucket, write: TokenBucket, slots: ConcurrencyLimit):
+        self.key_attr = key_attr
+        self.read = read
+        self.write = write
+        self.slots = slots
+
+
+class RateLimiter:
+    """
+    Paces the DynamoDB calls of the clients it is attached to (see DYDB(rate_limiter=...))
+    Tables start at read_rate/write_rate units per second when given, which are then also their
+    ceilings; otherwise DescribeTable is read once per table: provisioned tables start at (and never
+    exceed) utilization times their provisioned capacity, on-demand ones start at the throughput a
+    new on-demand table serves and may grow up to their maximum on-demand throughput, if any
+    On a throttle (error or unprocessed items) the table's rate is multiplied by decrease and its
+    concurrency halved; while calls keep waiting on it, the rate grows by increase times the
+    starting rate every cooldown seconds
+    With partitions, single item calls also wait on a bucket per partition key value holding the
+    per partition limits, so hot keys are paced before DynamoDB throttles them
+    The handlers block the calling thread, attach the limiter to synchronous clients only
+    """
+
+    def __init__(
+        self,
+        read_rate: float = None,
+        write_rate: float = None,
+        utilization: float = 1.0,
+        max_concurrency: int = 64,
+        partitions: bool = True,
+        increase: float = 0.05,
+        decrease: float = 0.5,
+        cooldown: float = 1.0
+    ):
+        self.read_rate = read_rate
+        self.write_rate = write_rate
+        self.utilization = utilization
+        self.max_concurrency = max_concurrency
+        self.partitions = partitions
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self._tables: typing.Dict[str, _Table] = {}
+        self._partitions: typing.OrderedDict[typing.Tuple, TokenBucket] = collections.OrderedDict()
+        # units consumed per requested item, by (table, operation)
+        self._estimates: typing.Dict[typing.Tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+
+    def attach(self, client) -> None:
+        """Pace a boto3 DynamoDB client, attaching twice is a no-op"""
+        events = client.meta.events
+        uid = f"aws-ratelimit-{id(self)}"
+        events.register("provide-client-params.dynamodb", self._provide_params, unique_id=f"{uid}-params")
+        events.register(
+            "before-call.dynamodb", functools.partial(self._before_call, client), unique_id=f"{uid}-before-call")
+        events.register("needs-retry.dynamodb", self._needs_retry, unique_id=f"{uid}-needs-retry")
+        events.register("after-call.dynamodb", self._after_call, unique_id=f"{uid}-after-call")
+        events.register("after-call-error.dynamodb", self._after_call_error, unique_id=f"{uid}-after-call-error")
+
+    def reset(self) -> None:
+        """Forget every table, their capacity is described again on their next call"""
+        with self._lock:
+            self._tables.clear()
+            self._partitions.clear()
+            self._estimates.clear()
+
+    def snapshot(self) -> typing.Dict:
+        """Current read/write rates, concurrency limit and throttles per table"""
+        with self._lock:
+            tables = dict(self._tables)
+        return {
+            name: {
+                "read_rate": table.read.rate,
+                "write_rate": table.write.rate,
+                "concurrency": table.slots.limit,
+                "throttles": table.read.throttles + table.write.throttles,
+            }
+            for name, table in tables.items()
+        }
+
+    def _provide_params(self, params, model, context, **kwargs):
+        if model.name not in OPERATIONS:
+            return
+        params.setdefault("ReturnConsumedCapacity", "TOTAL")
+        context["aws_ratelimit"] = {
+            "operation": model.name,
+            "read": OPERATIONS[model.name],
+            "items": self._requested(model.name, params),
+            "partition": (params.get("Key") or params.get("Item")) if model.name in SINGLE_ITEM_OPERATIONS else None,
+            "throttled": False,
+        }
+
+    @staticmethod
+    def _requested(operation: str, params: typing.Dict) -> typing.Dict[str, int]:
+        """Items requested per table"""
+        if "TableName" in params:
+            return {params["TableName"]: 1}
+        items = {}
+        if "RequestItems" in params:
+            for table, requests in params["RequestItems"].items():
+                items[table] = len(requests["Keys"]) if operation == "BatchGetItem" else len(requests)
+        for request in params.get("TransactItems", []):
+            for action in request.values():
+                items[action["TableName"]] = items.get(action["TableName"], 0) + 1
+        return items
+
+    def _before_call(self, client, model, context, **kwargs):
+        state = context.get("aws_ratelimit")
+        if state is None:
+            return
+        waits, charges, slots = [], [], {}
+        for name, count in state["items"].items():
+            table = self._table(client, name)
+            slots[name] = table.slots
+            bucket = table.read if state["read"] else table.write
+            units = count * self._estimates.get((name, state["operation"]), 1.0)
+            waits.append(bucket.reserve(units))
+            charges.append((name, bucket, units))
+            partition = self._partition(table, name, state)
+            if partition is not None:
+                waits.append(partition.reserve(units))
+                charges.append((name, partition, units))
+        state["charges"] = charges
+        wait = max(waits, default=0.0)
+        if wait:
+            time.sleep(wait)
+        # sorted so calls spanning tables cannot deadlock on each other's slots
+        state["slots"] = [slots[name] for name in sorted(slots)]
+        for limit in state["slots"]:
+            limit.acquire()
+
+    def _table(self, client, name: str) -> _Table:
+        table = self._tables.get(name)
+        if table is not None:
+            return table
+        key_attr, read, write = self._describe(client, name)
+        table = _Table(key_attr, read, write, ConcurrencyLimit(self.max_concurrency, self.cooldown))
+        with self._lock:
+            return self._tables.setdefault(name, table)
+
+    def _describe(self, client, name: str) -> typing.Tuple[typing.Union[str, None], TokenBucket, TokenBucket]:
+        """Partition key attribute and the read/write buckets of a table"""
+        try:
+            description = client.describe_table(TableName=name)["Table"]
+        except Exception as err:
+            logger.warning(f"Cannot describe {name} ({err}), pacing it as an on-demand table")
+            description = {}
+        key_attr = next(
+            (key["AttributeName"] for key in description.get("KeySchema", []) if key["KeyType"] == "HASH"), None)
+        provisioned = description.get("ProvisionedThroughput", {})
+        on_demand = description.get("OnDemandThroughput", {})
+        buckets = []
+        for rate, units, maximum, default in (
+            (self.read_rate, provisioned.get("ReadCapacityUnits"), on_demand.get("MaxReadRequestUnits"), ON_DEMAND_READ_UNITS),
+            (self.write_rate, provisioned.get("WriteCapacityUnits"), on_demand.get("MaxWriteRequestUnits"), ON_DEMAND_WRITE_UNITS),
+        ):
+            if rate:
+                start, ceiling = rate, rate
+            elif units:
+                start = ceiling = units * self.utilization
+            else:
+                ceiling = maximum * self.utilization if maximum and maximum > 0 else None
+                start = min(default * self.utilization, ceiling or float("inf"))
+            buckets.append(TokenBucket(start, ceiling, start * self.increase, self.decrease, cooldown=self.cooldown))
+        logger.debug(f"Pacing {name} at {buckets[0].rate:g} RCU/s and {buckets[1].rate:g} WCU/s")
+        return key_attr, buckets[0], buckets[1]
+
+    def _partition(self, table: _Table, name: str, state: typing.Dict) -> typing.Union[TokenBucket, None]:
+        key = state["partition"]
+        if not self.partitions or not key or table.key_attr not in key:
+            return None
+        # the serialized key value, e.g. {"S": "<id>"}, is stable for a given partition key
+        partition = (name, state["read"], repr(key[table.key_attr]))
+        with self._lock:
+            bucket = self._partitions.get(partition)
+            if bucket is None:
+                bucket = TokenBucket(PARTITION_READ_UNITS if state["read"] else PARTITION_WRITE_UNITS)
+                self._partitions[partition] = bucket
+                if len(self._partitions) > MAX_PARTITIONS:
+                    self._partitions.popitem(last=False)
+            else:
+                self._partitions.move_to_end(partition)
+            return bucket
+
+    def _throttled(self, state: typing.Dict, tables: typing.Iterable[str]) -> None:
+        state["throttled"] = True
+        for name in tables:
+            table = self._tables.get(name)
+            if table is not None:
+                (table.read if state["read"] else table.write).throttled()
+
+    def _needs_retry(self, response, request_dict, **kwargs):
+        state = request_dict.get("context", {}).get("aws_ratelimit")
+        if state is None or response is None:
+            return None
+        http_response, parsed = response
+        if parsed.get("Error", {}).get("Code") in THROTTLING_CODES or http_response.status_code == 429:
+            self._throttled(state, state["items"])
+        return None
+
+    def _after_call(self, parsed, context, **kwargs):
+        state = context.pop("aws_ratelimit", None)
+        if state is None or "slots" not in state:
+            return
+        unprocessed = parsed.get("UnprocessedItems") or parsed.get("UnprocessedKeys")
+        if unprocessed:
+            self._throttled(state, unprocessed)
+        consumed = capacity_units(state["operation"], parsed.get("ConsumedCapacity") or [])
+        for name, bucket, units in state["charges"]:
+            actual = consumed.get(name, (0.0, 0.0))[0 if state["read"] else 1]
+            bucket.settle(actual - units)
+        for name, count in state["items"].items():
+            if name in consumed and count:
+                per_item = consumed[name][0 if state["read"] else 1] / count
+                key = (name, state["operation"])
+                # moving average, the cost of an operation on a table barely changes between calls
+                self._estimates[key] = 0.8 * self._estimates.get(key, per_item) + 0.2 * per_item
+        self._release(state)
+
+    def _after_call_error(self, context, **kwargs):
+        state = context.pop("aws_ratelimit", None)
+        if state is None or "slots" not in state:
+            return
+        for _, bucket, units in state["charges"]:
+            bucket.settle(-units)
+        self._release(state)
+
+    @staticmethod
+    def _release(state: typing.Dict) -> None:
+        for slots in state["slots"]:
+            slots.release(state["throttled"])
@@ -0,0 +1,6 @@
+import random
+
+
+def backoff(attempt: int, base: float = 0.1, cap: float = 20.0) -> float:
+    """Exponential backoff delay with full jitter for the given attempt (0-based)"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
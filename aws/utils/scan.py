@@ -0,0 +1,166 @@
+"""
+Local scan stage of directory uploads: one os.scandir walk, then every file is hashed into the
+ETag (and Content-MD5) S3 will assign to it, on a process pool so hashing uses every core
+Files whose size and mtime match a previous ScanManifest reuse its hashes without reading them
+"""
+import os
+import json
+import typing
+import logging
+import multiprocessing
+import concurrent.futures
+import concurrent.futures.process
+from .fs import LocalFile, iter_files, file_digest, MB
+
+logger = logging.getLogger(__name__)
+
+# below this many bytes to hash, a process pool costs more than it saves
+POOL_MIN_BYTES = 64 * MB
+# workers are spawned, forking a process that already runs boto clients and thread pools can
+# deadlock the child on a lock held by another thread
+POOL_CONTEXT = "spawn"
+# files of one pool task, small files are batched so a task is worth its pickling
+BATCH_FILES = 256
+BATCH_BYTES = 256 * MB
+
+
+class ScannedFile(typing.NamedTuple):
+    path: str
+    rel: str  # posix path relative to the walked root
+    size: int
+    mtime_ns: int
+    etag: str
+    content_md5: typing.Union[str, None]  # base64 MD5 for single part uploads, None for multipart
+
+    @property
+    def file(self) -> LocalFile:
+        return LocalFile(self.path, self.rel, self.size, self.mtime_ns)
+
+
+class ScanManifest:
+    """
+    Compact record of a scan, one JSON array [rel, size, mtime_ns, etag, content_md5] per line
+    after a header holding the part settings the ETags were computed with
+    """
+
+    def __init__(self, path: str, threshold: int, chunksize: int):
+        self.path = path
+        self.header = {"threshold": threshold, "chunksize": chunksize}
+
+    def load(self) -> typing.Dict[str, typing.Tuple[int, int, str, typing.Union[str, None]]]:
+        """rel -> (size, mtime_ns, etag, content_md5), empty when missing or made with other settings"""
+        try:
+            with open(self.path) as f:
+                if json.loads(f.readline() or "null") != self.header:
+                    return {}
+                entries = {}
+                for line in f:
+                    try:
+                        rel, *entry = json.loads(line)
+                    except ValueError:  # torn write on the last line
+                        break
+                    entries[rel] = tuple(entry)
+                return entries
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def save(self, files: typing.Iterable[ScannedFile]) -> None:
+        tmp = f"{self.path}.tmp"
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(tmp, "w") as f:
+            f.write(json.dumps(self.header) + "\n")
+            for file in files:
+                f.write(json.dumps([file.rel, file.size, file.mtime_ns, file.etag, file.content_md5]) + "\n")
+        os.replace(tmp, self.path)
+
+
+def _digest_batch(
+    paths: typing.List[str],
+    threshold: int,
+    chunksize: int
+) -> typing.List[typing.Tuple[str, typing.Union[str, None]]]:
+    return [file_digest(path, threshold, chunksize) for path in paths]
+
+
+def _batches(files: typing.List[LocalFile]) -> typing.Iterator[typing.List[LocalFile]]:
+    batch, size = [], 0
+    for file in files:
+        batch.append(file)
+        size += file.size
+        if len(batch) >= BATCH_FILES or size >= BATCH_BYTES:
+            yield batch
+            batch, size = [], 0
+    if batch:
+        yield batch
+
+
+def scan_dir(
+    root: str,
+    threshold: int = 8 * MB,
+    chunksize: int = 8 * MB,
+    max_workers: int = None,
+    manifest: str = None,
+    include: typing.Callable[[LocalFile], bool] = None,
+    callback: typing.Callable[[int], None] = None
+) -> typing.Iterator[ScannedFile]:
+    """
+    Walk root and yield a ScannedFile per regular file, in completion order
+    threshold and chunksize must be the multipart settings of the upload so the ETags match
+    Hashing runs on max_workers processes (all cores by default, 0 hashes in this process), small
+    scans are hashed in process since starting workers would dominate
+    Workers are spawned and import the __main__ module again, so a script that scans (or calls
+    upload_dir with checksums) must do it under if __name__ == "__main__"; without that guard
+    the workers fail and the files are hashed in process
+    With manifest, unchanged files (same size and mtime) take their hashes from it and the
+    manifest is rewritten with every file once the walk has been consumed
+    include(file) filters the walked files, callback(n) reports hashed bytes
+    """
+    record = ScanManifest(manifest, threshold, chunksize) if manifest else None
+    previous = record.load() if record else {}
+    scanned, pending = [], []
+    for file in iter_files(os.path.abspath(root)):
+        if include is not None and not include(file):
+            continue
+        known = previous.get(file.rel)
+        if known and known[0] == file.size and known[1] == file.mtime_ns:
+            scanned.append(ScannedFile(*file, known[2], known[3]))
+            yield scanned[-1]
+        else:
+            pending.append(file)
+
+    total = sum(file.size for file in pending)
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    rest = pending
+    if max_workers and len(pending) > 1 and total >= POOL_MIN_BYTES:
+        hashed = set()
+        try:
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers, mp_context=multiprocessing.get_context(POOL_CONTEXT)
+            ) as executor:
+                futures = {
+                    executor.submit(_digest_batch, [file.path for file in batch], threshold, chunksize): batch
+                    for batch in _batches(pending)
+                }
+                for future in concurrent.futures.as_completed(futures):
+                    for file, digest in zip(futures[future], future.result()):
+                        hashed.add(file.rel)
+                        scanned.append(ScannedFile(*file, *digest))
+                        if callback:
+                            callback(file.size)
+                        yield scanned[-1]
+            rest = []
+        except concurrent.futures.process.BrokenProcessPool as err:
+            logger.warning(
+                f"Hashing workers of {root} died ({err}), hashing in process instead; "
+                "scripts have to call scan_dir under if __name__ == '__main__' to use the pool")
+            rest = [file for file in pending if file.rel not in hashed]
+    for file in rest:
+        scanned.append(ScannedFile(*file, *file_digest(file.path, threshold, chunksize)))
+        if callback:
+            callback(file.size)
+        yield scanned[-1]
+
+    if record:
+        record.save(scanned)
+    logger.debug(f"Scanned {len(scanned)} files in {root}, hashed {len(pending)} ({total} bytes)")
@@ -0,0 +1,152 @@
+"""
+Table-driven conversion between plain python values and the DynamoDB wire format
+Encoders are looked up by exact type, subclasses are resolved once through their MRO
+and cached in the same table so every later call is a single dict lookup
+"""
+import math
+import typing
+import decimal
+import collections.abc
+
+
+def _int(value: int) -> typing.Dict:
+    return {"N": int.__repr__(value)}
+
+
+def _decimal(value: decimal.Decimal) -> typing.Dict:
+    if not value.is_finite():
+        raise ValueError(f"DynamoDB does not support {value} numbers")
+    return {"N": str(value)}
+
+
+def _float(value: float) -> typing.Dict:
+    if math.isnan(value) or math.isinf(value):
+        raise ValueError(f"DynamoDB does not support {value} numbers")
+    return {"N": float.__repr__(value)}
+
+
+def _list(value) -> typing.Dict:
+    return {"L": [serialize(v) for v in value]}
+
+
+def _map(value) -> typing.Dict:
+    return {"M": {k: serialize(v) for k, v in value.items()}}
+
+
+def _set(value) -> typing.Dict:
+    if not value:
+        raise ValueError("DynamoDB does not support empty sets")
+    if all(isinstance(v, str) for v in value):
+        return {"SS": list(value)}
+    if all(isinstance(v, (bytes, bytearray, memoryview)) for v in value):
+        return {"BS": [serialize(v)["B"] for v in value]}
+    if all(isinstance(v, (int, float, decimal.Decimal)) and not isinstance(v, bool) for v in value):
+        return {"NS": [serialize(v)["N"] for v in value]}
+    raise TypeError(f"Unsupported set element types: {sorted({type(v).__name__ for v in value})}")
+
+
+_ENCODERS: typing.Dict[type, typing.Callable[[typing.Any], typing.Dict]] = {
+    str: lambda value: {"S": value},
+    bool: lambda value: {"BOOL": value},
+    int: _int,
+    float: _float,
+    decimal.Decimal: _decimal,
+    type(None): lambda value: {"NULL": True},
+    bytes: lambda value: {"B": value},
+    bytearray: lambda value: {"B": bytes(value)},
+    memoryview: lambda value: {"B": value.tobytes()},
+    list: _list,
+    tuple: _list,
+    dict: _map,
+    set: _set,
+    frozenset: _set,
+}
+
+# abstract types tried (in order) for classes without a concrete entry in their MRO
+_ABSTRACT_ENCODERS = (
+    (collections.abc.Mapping, _map),
+    (collections.abc.Set, _set),
+    (collections.abc.Sequence, _list),
+)
+
+
+def _encoder_for(datatype: type) -> typing.Callable[[typing.Any], typing.Dict]:
+    for base in datatype.__mro__:
+        if base in _ENCODERS:
+            encoder = _ENCODERS[base]
+            break
+    else:
+        for abstract, encoder in _ABSTRACT_ENCODERS:
+            if issubclass(datatype, abstract):
+                break
+        else:
+            raise TypeError(f"Unsupported type for DynamoDB: {datatype.__name__}")
+    _ENCODERS[datatype] = encoder
+    return encoder
+
+
+def serialize(value: typing.Any) -> typing.Dict:
+    """Map a python value to its DynamoDB attribute value ({"S": ...}, {"M": ...}, ...)"""
+    try:
+        encoder = _ENCODERS[value.__class__]
+    except KeyError:
+        encoder = _encoder_for(value.__class__)
+    return encoder(value)
+
+
+def serialize_item(item: typing.Mapping) -> typing.Dict:
+    """Map a python dict to a DynamoDB item (the content of its "M")"""
+    return {k: serialize(v) for k, v in item.items()}
+
+
+def _to_number(value: str) -> typing.Union[int, float]:
+    if "." in value or "e" in value or "E" in value:
+        return float(value)
+    return int(value)
+
+
+def _to_decimal(value: str) -> typing.Union[int, decimal.Decimal]:
+    if "." in value or "e" in value or "E" in value:
+        return decimal.Decimal(value)
+    return int(value)
+
+
+def _decoders(number: typing.Callable[[str], typing.Any]) -> typing.Dict[str, typing.Callable]:
+    table = {}
+    table.update({
+        "S": lambda value: value,
+        "N": number,
+        "BOOL": lambda value: value,
+        "NULL": lambda value: None,
+        "B": bytes,
+        "L": lambda value: [_decode(table, v) for v in value],
+        "M": lambda value: {k: _decode(table, v) for k, v in value.items()},
+        "SS": set,
+        "NS": lambda value: {number(v) for v in value},
+        "BS": lambda value: {bytes(v) for v in value},
+    })
+    return table
+
+
+def _decode(table: typing.Dict[str, typing.Callable], value: typing.Dict) -> typing.Any:
+    for tag, data in value.items():
+        return table[tag](data)
+    raise ValueError("Empty DynamoDB attribute value")
+
+
+_DECODERS = _decoders(_to_number)
+_DECIMAL_DECODERS = _decoders(_to_decimal)
+
+
+def deserialize(value: typing.Dict, use_decimal: bool = False) -> typing.Any:
+    """
+    Map a DynamoDB attribute value back to python
+    Numbers become int when integral and float otherwise, or Decimal with use_decimal
+    """
+    return _decode(_DECIMAL_DECODERS if use_decimal else _DECODERS, value)
+
+
+def deserialize_item(item: typing.Mapping, use_decimal: bool = False) -> typing.Dict:
+    """Map a DynamoDB item back to a python dict"""
+    table = _DECIMAL_DECODERS if use_decimal else _DECODERS
+    return {k: _decode(table, v) for k, v in item.items()}
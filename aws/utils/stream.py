@@ -0,0 +1,315 @@
+"""
+File-like access to S3 objects without local copies
+S3Reader fetches fixed size blocks with ranged GETs pinned to the object's ETag and, while
+reads stay sequential, prefetches the next read_ahead blocks on a small thread pool, so at
+most read_ahead + 1 blocks are held in memory. S3Writer fills one part at a time and uploads
+finished parts in the background (at most max_concurrency in flight) as a multipart upload,
+objects smaller than one part are sent with a single PutObject
+BufferReader hands slices of in-memory buffers to botocore as files
+"""
+import io
+import gzip
+import typing
+import threading
+import botocore.exceptions
+import concurrent.futures
+from ..err.s3 import ERRORS
+
+MIN_PART_SIZE = 5 * 1024 ** 2
+
+
+class BufferReader(io.RawIOBase):
+    """
+    Seekable read-only file over a slice of any buffer (bytes, memoryview, mmap, numpy array),
+    so botocore can send and checksum memory without a bytes copy of the whole slice
+    """
+
+    def __init__(self, data, start: int = 0, end: int = None):
+        self._view = memoryview(data).cast("B")[start:end]
+        self._pos = 0
+
+    def __len__(self) -> int:
+        return self._view.nbytes
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self)}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self) if size is None or size < 0 else min(len(self), self._pos + size)
+        data = bytes(self._view[self._pos:end])
+        self._pos = max(self._pos, end)
+        return data
+
+    def readinto(self, buffer) -> int:
+        view = self._view[self._pos:self._pos + len(buffer)]
+        n = view.nbytes
+        buffer[:n] = view
+        self._pos += n
+        return n
+
+    def close(self) -> None:
+        if not self.closed:
+            # release the export so the caller can close or resize the mmap it came from
+            self._view.release()
+        super().close()
+
+
+class S3Reader(io.RawIOBase):
+    """Seekable raw reader of one object version, wrap it in io.BufferedReader for small reads"""
+
+    def __init__(
+        self,
+        client,
+        bucket: str,
+        key: str,
+        block_size: int = 8 * 1024 ** 2,
+        read_ahead: int = 2
+    ):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.block_size = block_size
+        self.read_ahead = read_ahead
+        try:
+            head = client.head_object(Bucket=bucket, Key=key)
+        except botocore.exceptions.ClientError as err:
+            raise ERRORS.from_client_error(err) from err
+        self.size = head["ContentLength"]
+        self.etag = head["ETag"]
+        self._count = -(-self.size // block_size)
+        self._pos = 0
+        self._blocks: typing.Dict[int, concurrent.futures.Future] = {}
+        self._last = -1
+        self._pool = concurrent.futures.ThreadPoolExecutor(read_ahead) if read_ahead else None
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence ({whence})")
+        if pos < 0:
+            raise ValueError(f"Negative seek position {pos}")
+        self._pos = pos
+        return pos
+
+    def readinto(self, buffer) -> int:
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        if self._pos >= self.size:
+            return 0
+        index, offset = divmod(self._pos, self.block_size)
+        block = self._block(index)
+        view = memoryview(block)[offset:offset + len(buffer)]
+        n = len(view)
+        buffer[:n] = view
+        self._pos += n
+        return n
+
+    def _block(self, index: int) -> bytes:
+        sequential = index in (self._last, self._last + 1)
+        self._last = index
+        # keep the block being read and, on sequential reads, the next read_ahead ones
+        window = range(index, min(index + 1 + (self.read_ahead if sequential else 0), self._count))
+        for stale in [i for i in self._blocks if i not in window]:
+            self._blocks.pop(stale).cancel()
+        for i in window[1:]:
+            if i not in self._blocks:
+                self._blocks[i] = self._pool.submit(self._fetch, i)
+        if index not in self._blocks:
+            self._blocks[index] = concurrent.futures.Future()
+            self._blocks[index].set_result(self._fetch(index))
+        return self._blocks[index].result()
+
+    def _fetch(self, index: int) -> bytes:
+        start = index * self.block_size
+        end = min(start + self.block_size, self.size) - 1
+        try:
+            body = self.client.get_object(
+                Bucket=self.bucket, Key=self.key, IfMatch=self.etag, Range=f"bytes={start}-{end}")["Body"]
+            return body.read()
+        except botocore.exceptions.ClientError as err:
+            raise ERRORS.from_client_error(err) from err
+
+    def close(self) -> None:
+        if not self.closed:
+            for future in self._blocks.values():
+                future.cancel()
+            self._blocks.clear()
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+        super().close()
+
+
+class S3Writer(io.BufferedIOBase):
+    """
+    Streaming writer, the object only appears once close() succeeds; leaving a with block on
+    an exception (or calling abort) discards everything written so far
+    Parts grow from part_size by doubling every 1000 parts so any stream fits in 10000 parts
+    """
+
+    def __init__(
+        self,
+        client,
+        bucket: str,
+        key: str,
+        part_size: int = 8 * 1024 ** 2,
+        max_concurrency: int = 4,
+        extra_args: typing.Dict = None
+    ):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.extra_args = extra_args or {}
+        self.upload_id = None
+        self._buffer = bytearray()
+        self._parts: typing.List[concurrent.futures.Future] = []
+        self._slots = threading.Semaphore(max_concurrency)
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_concurrency)
+        self._written = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._written
+
+    def write(self, data) -> int:
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        view = memoryview(data).cast("B")
+        self._buffer += view
+        self._written += len(view)
+        while len(self._buffer) >= self._next_part_size():
+            size = self._next_part_size()
+            part = bytes(self._buffer[:size])
+            del self._buffer[:size]
+            self._submit(part)
+        return len(view)
+
+    def _next_part_size(self) -> int:
+        return self.part_size << (len(self._parts) // 1000)
+
+    def _submit(self, part: bytes) -> None:
+        if self.upload_id is None:
+            try:
+                self.upload_id = self.client.create_multipart_upload(
+                    Bucket=self.bucket, Key=self.key, **self.extra_args)["UploadId"]
+            except botocore.exceptions.ClientError as err:
+                raise ERRORS.from_client_error(err) from err
+        # blocks once max_concurrency parts are in flight, which bounds memory
+        self._slots.acquire()
+        number = len(self._parts) + 1
+        future = self._pool.submit(self._upload_part, number, part)
+        future.add_done_callback(lambda _: self._slots.release())
+        self._parts.append(future)
+        failed = next((f for f in self._parts if f.done() and f.exception()), None)
+        if failed is not None:
+            failed.result()
+
+    def _upload_part(self, number: int, part: bytes) -> typing.Dict:
+        try:
+            resp = self.client.upload_part(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=number, Body=part)
+        except botocore.exceptions.ClientError as err:
+            raise ERRORS.from_client_error(err) from err
+        return {"PartNumber": number, "ETag": resp["ETag"]}
+
+    def close(self) -> None:
+        """Upload what is buffered and complete the object"""
+        if self.closed:
+            return
+        try:
+            if self.upload_id is None:
+                self.client.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer), **self.extra_args)
+            else:
+                if self._buffer or not self._parts:
+                    self._submit(bytes(self._buffer))
+                parts = [future.result() for future in self._parts]
+                self.client.complete_multipart_upload(
+                    Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, MultipartUpload={"Parts": parts})
+        except BaseException as err:
+            self.abort()
+            if isinstance(err, botocore.exceptions.ClientError):
+                raise ERRORS.from_client_error(err) from err
+            raise
+        finally:
+            self._buffer = bytearray()
+            self._pool.shutdown(wait=False)
+            super().close()
+
+    def abort(self) -> None:
+        """Discard the upload, nothing is written to the key"""
+        for future in self._parts:
+            future.cancel()
+        self._pool.shutdown(wait=True)
+        if self.upload_id is not None:
+            try:
+                self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+            except botocore.exceptions.ClientError:
+                pass
+            self.upload_id = None
+        self._buffer = bytearray()
+        if not self.closed:
+            super().close()
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+
+class TextWriter(io.TextIOWrapper):
+    """TextIOWrapper over an S3Writer that aborts the upload when its with block raises"""
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.buffer.abort()
+        else:
+            self.close()
+
+
+class GzipReader(gzip.GzipFile):
+    """GzipFile that also closes the stream it decompresses"""
+
+    def close(self) -> None:
+        fileobj = self.fileobj
+        super().close()
+        if fileobj is not None:
+            fileobj.close()
+
+
+def split_records(chunks: typing.Iterable[bytes], delimiter: bytes = b"\n") -> typing.Iterator[bytes]:
+    """Split a stream of chunks on delimiter, the delimiter is not part of the records yielded"""
+    tail = b""
+    for chunk in chunks:
+        records = (tail + chunk).split(delimiter)
+        tail = records.pop()
+        yield from records
+    if tail:
+        yield tail
@@ -0,0 +1,385 @@
+"""
+Throughput and latency of the S3, DYDB and SQS hot paths against a local stub endpoint
+A moto server runs in a local subprocess and every client is built by a ClientFactory pointed at it,
+a before-send hook adds a fixed latency to each HTTP request and answers a share of them
+with the service's throttling error, so retries and backoff are exercised as well
+Each case reports calls, ops/sec, bytes/sec, p50/p99 latency per call and the tracemalloc
+peak of one call; --output writes the results as JSON and --compare checks them against a
+previous run, exiting with status 1 on a regression
+
+    python benchmarks/hot_paths.py [--filter s3.] [--latency-ms 2] [--throttle-rate 0.05]
+                                   [--scale 1] [--output run.json] [--compare base.json]
+
+Needs moto[server] (`pip install "moto[server]"`), which is not a dependency of the package
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import typing
+import argparse
+import platform
+import tempfile
+import threading
+import tracemalloc
+import subprocess
+import dataclasses
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import botocore.awsrequest  # noqa: E402
+from boto3.s3.transfer import TransferConfig  # noqa: E402
+from aws import S3, DYDB, SQS, SQSMessage  # noqa: E402
+from aws.err.base import RetryPolicy  # noqa: E402
+from aws.utils.clients import ClientFactory  # noqa: E402
+
+KB = 1024
+MB = 1024 ** 2
+CREDENTIALS = {"aws_access_key_id": "bench", "aws_secret_access_key": "bench", "region_name": "us-east-1"}
+
+# service -> (status, body) of the throttling error the stub answers with
+THROTTLES = {
+    "s3": (503, b"<Error><Code>SlowDown</Code><Message>injected</Message></Error>"),
+    "dynamodb": (400, b'{"__type": "ProvisionedThroughputExceededException", "message": "injected"}'),
+    "sqs": (400, b'{"__type": "ThrottlingException", "message": "injected"}'),
+}
+
+
+class _Body:
+    def __init__(self, content: bytes):
+        self.content = content
+
+    def stream(self, **_):
+        yield self.content
+
+
+class Injector:
+    """before-send hook: sleeps latency seconds, then throttles throttle_rate of the requests"""
+
+    def __init__(self, service: str, latency: float = 0.0, throttle_rate: float = 0.0, seed: int = 0):
+        self.service = service
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.requests = 0
+        self.throttled = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def __call__(self, request, **_):
+        with self._lock:
+            self.requests += 1
+            throttle = self._random.random() < self.throttle_rate
+            self.throttled += throttle
+        if self.latency:
+            time.sleep(self.latency)
+        if throttle:
+            status, body = THROTTLES[self.service]
+            return botocore.awsrequest.AWSResponse(request.url, status, {}, _Body(body))
+        return None
+
+
+class StubEndpoint:
+    """
+    moto server on a free local port, with an Injector on every client it hands out
+    The server runs in its own process so its CPU time and allocations stay out of the figures
+    """
+
+    def __init__(self, latency: float = 0.0, throttle_rate: float = 0.0):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.server = None
+        self.clients = ClientFactory(endpoint_url=self.url, max_pool_connections=64)
+        self.injectors = {
+            service: Injector(service, latency, throttle_rate, seed)
+            for seed, service in enumerate(THROTTLES)
+        }
+
+    def __enter__(self):
+        try:
+            import moto.server  # noqa: F401
+        except ImportError as err:
+            raise SystemExit(f"The benchmarks need moto[server] ({err}), pip install 'moto[server]'")
+        self.server = subprocess.Popen(
+            [sys.executable, "-m", "moto.server", "-H", "127.0.0.1", "-p", str(self.port)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=1).close()
+                break
+            except OSError:
+                if self.server.poll() is not None or time.monotonic() > deadline:
+                    self.server.kill()
+                    raise SystemExit(f"moto server did not start on port {self.port}")
+                time.sleep(0.1)
+        for service, injector in self.injectors.items():
+            self.clients.client(service, **CREDENTIALS).meta.events.register("before-send", injector)
+        return self
+
+    def __exit__(self, *exc):
+        self.clients.clear()
+        self.server.terminate()
+        self.server.wait()
+
+    def reset_counters(self) -> None:
+        for injector in self.injectors.values():
+            injector.requests = injector.throttled = 0
+
+
+@dataclasses.dataclass
+class Case:
+    name: str
+    group: str
+    setup: typing.Callable
+    calls: int
+
+
+CASES: typing.List[Case] = []
+
+
+def case(name: str, group: str, calls: int):
+    """Register setup(env) -> (call, ops per call, bytes per call) as a benchmark case"""
+    def register(setup):
+        CASES.append(Case(name, group, setup, calls))
+        return setup
+    return register
+
+
+class Env:
+    """Wrappers bound to the stub endpoint plus the bucket, table and queue they use"""
+
+    def __init__(self, endpoint: StubEndpoint, tmp: str):
+        self.tmp = tmp
+        # one shared policy with a short base delay keeps injected throttles visible but cheap
+        policy = RetryPolicy(base=0.01, cap=0.5)
+        config = TransferConfig(multipart_threshold=8 * MB, multipart_chunksize=8 * MB, max_concurrency=8)
+        self.s3 = S3("bench", transfer_config=config, clients=endpoint.clients, retry_policy=policy, **CREDENTIALS)
+        self.dydb = DYDB("bench", clients=endpoint.clients, retry_policy=policy, **CREDENTIALS)
+        self.sqs = SQS(clients=endpoint.clients, retry_policy=policy, **CREDENTIALS)
+        self.s3.s3c.create_bucket(Bucket="bench")
+        self.dydb.dydb.create_table(
+            TableName="bench",
+            KeySchema=[{"AttributeName": "id", "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": "id", "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        self.sqs.queue = self.sqs.sqs.create_queue(QueueName="bench")["QueueUrl"]
+        self.counter = 0
+
+    def next_id(self) -> str:
+        self.counter += 1
+        return f"item-{self.counter}"
+
+
+def sample_item(item_id: str) -> typing.Dict:
+    return {
+        "id": item_id,
+        "name": "benchmark item",
+        "count": 42,
+        "score": 0.5,
+        "tags": ["a", "b", "c"],
+        "nested": {"level": 1, "values": list(range(20)), "flags": {"x": True, "y": None}},
+    }
+
+
+@case("s3.put_bytes_64k", "single", 200)
+def s3_put_small(env: Env):
+    data = os.urandom(64 * KB)
+    return lambda: env.s3.put_bytes("single/small.bin", data), 1, len(data)
+
+
+@case("s3.get_bytes_64k", "single", 200)
+def s3_get_small(env: Env):
+    env.s3.put_bytes("single/read.bin", os.urandom(64 * KB))
+    return lambda: env.s3.get_bytes("single/read.bin"), 1, 64 * KB
+
+
+@case("s3.put_bytes_32m", "single", 5)
+def s3_put_large(env: Env):
+    data = os.urandom(32 * MB)
+    return lambda: env.s3.put_bytes("single/large.bin", data), 1, len(data)
+
+
+@case("s3.get_bytes_32m", "single", 5)
+def s3_get_large(env: Env):
+    env.s3.put_bytes("single/large-read.bin", os.urandom(32 * MB))
+    buffer = bytearray(32 * MB)
+    return lambda: env.s3.get_into("single/large-read.bin", buffer), 1, len(buffer)
+
+
+@case("s3.upload_dir_64x256k", "directory", 3)
+def s3_upload_dir(env: Env):
+    root = os.path.join(env.tmp, "upload")
+    for i in range(64):
+        os.makedirs(os.path.join(root, f"d{i % 4}"), exist_ok=True)
+        with open(os.path.join(root, f"d{i % 4}", f"f{i}.bin"), "wb") as f:
+            f.write(os.urandom(256 * KB))
+    return lambda: env.s3.upload_dir("dir", root, progress=False), 64, 64 * 256 * KB
+
+
+@case("s3.download_dir_64x256k", "directory", 3)
+def s3_download_dir(env: Env):
+    for i in range(64):
+        env.s3.put_bytes(f"download/d{i % 4}/f{i}.bin", os.urandom(256 * KB))
+
+    def call():
+        with tempfile.TemporaryDirectory(dir=env.tmp) as target:
+            env.s3.download_dir("download", target, skip=lambda obj, path: False, progress=False)
+    return call, 64, 64 * 256 * KB
+
+
+@case("dydb.create", "single", 300)
+def dydb_create(env: Env):
+    return lambda: env.dydb.create("bench", sample_item(env.next_id())), 1, 0
+
+
+@case("dydb.get", "single", 300)
+def dydb_get(env: Env):
+    env.dydb.create("bench", sample_item("read"))
+    return lambda: env.dydb.get({"id": "read"}), 1, 0
+
+
+@case("dydb.update", "single", 300)
+def dydb_update(env: Env):
+    env.dydb.create("bench", sample_item("update"))
+    return lambda: env.dydb.update({"id": "update"}, {"count": random.randint(0, 100)}, "bench"), 1, 0
+
+
+@case("dydb.batch_write_100", "batch", 20)
+def dydb_batch_write(env: Env):
+    return lambda: env.dydb.batch_write([sample_item(env.next_id()) for _ in range(100)], table="bench"), 100, 0
+
+
+@case("dydb.batch_get_100", "batch", 20)
+def dydb_batch_get(env: Env):
+    keys = [{"id": f"batch-{i}"} for i in range(100)]
+    env.dydb.batch_write([sample_item(key["id"]) for key in keys], table="bench")
+    return lambda: env.dydb.batch_get(keys, table="bench"), 100, 0
+
+
+@case("dydb.mapper_roundtrip", "cpu", 2000)
+def dydb_mapper(env: Env):
+    item = sample_item("cpu")
+    return lambda: env.dydb.unmapper(env.dydb.mapper(item)), 1, 0
+
+
+@case("sqs.publish", "single", 300)
+def sqs_publish(env: Env):
+    return lambda: env.sqs.publish(SQSMessage(body={"n": 1, "payload": "x" * 512})), 1, 0
+
+
+@case("sqs.publish_batch_100", "batch", 20)
+def sqs_publish_batch(env: Env):
+    def call():
+        env.sqs.publish_batch([SQSMessage(body={"n": i, "payload": "x" * 512}) for i in range(100)])
+    return call, 100, 0
+
+
+def percentile(samples: typing.List[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def run_case(bench: Case, env: Env, endpoint: StubEndpoint, scale: float) -> typing.Dict:
+    call, ops, size = bench.setup(env)
+    call()  # warm up connections and caches
+    endpoint.reset_counters()
+    calls = max(1, int(bench.calls * scale))
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(calls):
+        t0 = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - start
+    requests = sum(i.requests for i in endpoint.injectors.values())
+    throttled = sum(i.throttled for i in endpoint.injectors.values())
+
+    tracemalloc.start()
+    call()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "group": bench.group,
+        "calls": calls,
+        "ops_per_sec": round(calls * ops / elapsed, 2),
+        "bytes_per_sec": round(calls * size / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "requests": requests,
+        "throttled": throttled,
+        "peak_kib": round(peak / KB, 1),
+    }
+
+
+def compare(results: typing.Dict, baseline: typing.Dict, tolerance: float) -> typing.List[str]:
+    """Cases whose ops/sec fell or whose p99 rose by more than tolerance against baseline"""
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get("results", {}).get(name)
+        if not before:
+            continue
+        if before["ops_per_sec"] and result["ops_per_sec"] < before["ops_per_sec"] * (1 - tolerance):
+            regressions.append(f"{name}: ops/sec {before['ops_per_sec']} -> {result['ops_per_sec']}")
+        if before["p99_ms"] and result["p99_ms"] > before["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p99 {before['p99_ms']}ms -> {result['p99_ms']}ms")
+    return regressions
+
+
+def revision() -> typing.Union[str, None]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filter", default="", help="only run cases whose name contains it")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="added to every HTTP request")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of requests throttled")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies the number of calls per case")
+    parser.add_argument("--output", help="write the results as JSON to this path")
+    parser.add_argument("--compare", help="JSON results of a previous run to check against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative regression")
+    args = parser.parse_args()
+
+    selected = [bench for bench in CASES if args.filter in bench.name]
+    results = {}
+    with StubEndpoint(args.latency_ms / 1000, args.throttle_rate) as endpoint, \
+            tempfile.TemporaryDirectory() as tmp:
+        env = Env(endpoint, tmp)
+        for bench in selected:
+            result = results[bench.name] = run_case(bench, env, endpoint, args.scale)
+            print(f"{bench.name:<26} {result['ops_per_sec']:>10.1f} ops/s  {result['bytes_per_sec'] / MB:>8.1f} MB/s  "
+                  f"p50 {result['p50_ms']:>8.2f}ms  p99 {result['p99_ms']:>8.2f}ms  "
+                  f"throttled {result['throttled']:>4}/{result['requests']:<5}  peak {result['peak_kib']:>9.1f}KiB")
+
+    report = {
+        "revision": revision(),
+        "python": platform.python_version(),
+        "settings": {"latency_ms": args.latency_ms, "throttle_rate": args.throttle_rate, "scale": args.scale},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+"""
+Import-time benchmark and regression guard
+Every statement runs in fresh interpreters, the median wall time is reported together with
+the heavy modules it pulled in. Exits with status 1 when a statement loads a module it must
+not (e.g. `import aws` loading boto3) or its median exceeds --budget-ms
+
+    python benchmarks/import_time.py [--runs 10] [--budget-ms 0] [--json]
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# statement -> modules that must stay unloaded after it
+CASES = {
+    "import aws": ["boto3", "botocore", "tqdm", "aws.s3", "aws.dydb", "aws.sqs"],
+    "from aws import SQS": ["tqdm", "aws.s3", "aws.dydb", "boto3.s3.transfer"],
+    "from aws import DYDB": ["tqdm", "aws.s3", "aws.sqs"],
+    "from aws import S3": ["tqdm", "aws.dydb", "aws.sqs"],
+}
+WATCHED = sorted({module for forbidden in CASES.values() for module in forbidden})
+
+PROBE = """
+import sys, time, json
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"ms": elapsed * 1000, "loaded": [m for m in {watched!r} if m in sys.modules]}}))
+"""
+
+
+def measure(statement: str, runs: int) -> dict:
+    env = {**os.environ, "PYTHONPATH": ROOT + os.pathsep + os.environ.get("PYTHONPATH", "")}
+    code = PROBE.format(statement=statement, watched=WATCHED)
+    samples, loaded = [], []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", code], env=env, check=True, capture_output=True, text=True).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+        samples.append(result["ms"])
+        loaded = result["loaded"]
+    return {"median_ms": round(statistics.median(samples), 2), "min_ms": round(min(samples), 2), "loaded": loaded}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--budget-ms", type=float, default=0, help="fail when a median exceeds it (0 disables)")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    results, failures = {}, []
+    for statement, forbidden in CASES.items():
+        result = results[statement] = measure(statement, args.runs)
+        leaked = [module for module in forbidden if module in result["loaded"]]
+        if leaked:
+            failures.append(f"{statement!r} loaded {', '.join(leaked)}")
+        if args.budget_ms and result["median_ms"] > args.budget_ms:
+            failures.append(f"{statement!r} took {result['median_ms']}ms (budget {args.budget_ms}ms)")
+
+    if args.json:
+        print(json.dumps({"results": results, "failures": failures}, indent=2))
+    else:
+        for statement, result in results.items():
+            print(f"{statement:<24} {result['median_ms']:>9.2f}ms median  {result['min_ms']:>9.2f}ms min  "
+                  f"loaded: {', '.join(result['loaded']) or '-'}")
+        for failure in failures:
+            print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+import boto3
+import pytest
+from moto import mock_aws
+
+from aws.dydb import DYDB, MAX_TRANSACTION_BYTES, request_size
+from aws.err.base import NotFoundError, RetryPolicy
+from aws.err.dydb import DYDBNotFoundError
+from aws.utils.cache import ReadCache
+from aws.utils.ratelimit import RateLimiter
+
+
+@pytest.fixture
+def dydb():
+    with mock_aws():
+        boto3.client("dynamodb", region_name="us-east-1").create_table(
+            TableName="t",
+            KeySchema=[{"AttributeName": "id", "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": "id", "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        yield DYDB("t", region_name="us-east-1", retry_policy=RetryPolicy(base=0.001))
+
+
+def test_transaction_with_binary_attributes(dydb):
+    with dydb.transaction() as tx:
+        tx.put({"id": "a", "blob": b"\x00\xff" * 10, "blobs": {b"x", b"y"}}, table="t")
+    assert tx.result.committed == 1
+    assert dydb.get({"id": "a"})["blob"] == b"\x00\xff" * 10
+
+
+def test_request_size_counts_encoded_bytes():
+    assert request_size({"Item": {"k": {"S": "é"}, "b": {"B": b"\x00" * 10}}}) == 4 + 1 + 1 + 2 + 1 + 1 + 10
+    assert request_size({"Item": {"big": {"B": b"x" * MAX_TRANSACTION_BYTES}}}) > MAX_TRANSACTION_BYTES
+
+
+def test_rate_limiter_only_paces_its_instance(dydb):
+    limiter = RateLimiter(write_rate=1)
+    backfill = DYDB("t", region_name="us-east-1", rate_limiter=limiter)
+    live = DYDB("t", region_name="us-east-1")
+    assert backfill.dydb is not live.dydb and live.dydb is dydb.dydb
+    backfill.create("t", {"id": "backfill"})
+    for i in range(5):
+        live.create("t", {"id": str(i)})
+    assert "ConsumedCapacity" not in live.dydb.put_item(TableName="t", Item={"id": {"S": "x"}})
+    assert set(limiter.snapshot()) == {"t"}
+
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_get_missing_item_raises_not_found(dydb, cached):
+    if cached:
+        dydb.cache = ReadCache()
+    with pytest.raises(DYDBNotFoundError):
+        dydb.get({"id": "missing"})
+    with pytest.raises(NotFoundError):
+        dydb.get({"id": "missing"})
+    assert dydb.batch_get([{"id": "missing"}]) == [None]
+
+
+def test_batch_write_keeps_the_last_write_of_a_key(dydb):
+    items = [{"id": str(i % 10), "v": i} for i in range(30)]
+    result = dydb.batch_write(items, deletes=[{"id": "9"}], table="t")
+    assert result.ok and (result.written, result.deleted) == (9, 1)
+    assert dydb.get({"id": "3"})["v"] == 23
+    assert dydb.batch_get([{"id": "9"}], table="t") == [None]
@@ -0,0 +1,78 @@
+import boto3
+import pytest
+import botocore.exceptions
+from botocore.awsrequest import AWSResponse
+from moto import mock_aws
+
+from aws.dydb import DYDB
+from aws.err.base import RetryPolicy
+from aws.utils.clients import ClientFactory
+from aws.utils.metrics import Metrics
+
+
+class Hook:
+    def __init__(self):
+        self.retries = []
+
+    def __call__(self, call):
+        pass
+
+    def retried(self, service, operation):
+        self.retries.append((service, operation))
+
+
+@pytest.fixture
+def table():
+    with mock_aws():
+        boto3.client("dynamodb", region_name="us-east-1").create_table(
+            TableName="t",
+            KeySchema=[{"AttributeName": "id", "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": "id", "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        yield "t"
+
+
+@pytest.mark.parametrize("event, error", [
+    ("before-call.dynamodb.PutItem", botocore.exceptions.ClientError(
+        {"Error": {"Code": "ThrottlingException", "Message": "injected"}}, "PutItem")),
+    ("before-send.dynamodb.PutItem", botocore.exceptions.EndpointConnectionError(
+        endpoint_url="https://dynamodb.us-east-1.amazonaws.com")),
+])
+def test_policy_retries_are_counted(table, event, error):
+    hook = Hook()
+    metrics = Metrics(hooks=[hook])
+    dydb = DYDB(
+        table, region_name="us-east-1", clients=ClientFactory(metrics=metrics), retry_policy=RetryPolicy(base=0.001))
+    calls = []
+
+    def fail_once(**kwargs):
+        calls.append(kwargs)
+        if len(calls) == 1:
+            raise error
+
+    dydb.dydb.meta.events.register(event, fail_once)
+    dydb.create(table, {"id": "a"})
+    assert len(calls) == 2
+    assert metrics.snapshot()["operations"]["dynamodb.PutItem"]["retries"] == 1
+    assert 'aws_retries_total{service="dynamodb",operation="PutItem"} 1' in metrics.prometheus()
+    assert hook.retries == [("dynamodb", "PutItem")]
+
+
+def test_retrier_retries_are_counted(table):
+    metrics = Metrics()
+    dydb = DYDB(
+        table, region_name="us-east-1", clients=ClientFactory(metrics=metrics), retry_policy=RetryPolicy(base=0.001))
+    calls = []
+
+    def record(params, **kwargs):
+        calls.append(params)
+
+    def unprocessed_once(**kwargs):
+        if len(calls) == 1:
+            return AWSResponse("", 200, {}, None), {"UnprocessedItems": calls[0]["RequestItems"]}
+
+    dydb.dydb.meta.events.register("provide-client-params.dynamodb.BatchWriteItem", record)
+    dydb.dydb.meta.events.register("before-call.dynamodb.BatchWriteItem", unprocessed_once)
+    assert dydb.batch_write([{"id": "a"}, {"id": "b"}], table=table).written == 2
+    assert metrics.snapshot()["operations"]["dynamodb.BatchWriteItem"]["retries"] == 1
@@ -0,0 +1,57 @@
+import boto3
+import pytest
+import botocore.exceptions
+from moto import mock_aws
+
+from aws.s3 import S3
+from aws.err.base import RetryPolicy
+
+
+@pytest.fixture
+def s3():
+    with mock_aws():
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket="bkt")
+        yield S3("bkt", region_name="us-east-1", retry_policy=RetryPolicy(base=0.001))
+
+
+def keys(s3):
+    return sorted(obj.key for obj in s3.iter_objects("", "bkt"))
+
+
+@pytest.mark.parametrize("prefix, dst_prefix", [("a", "a/b"), ("a/b", "a"), ("a", "a")])
+def test_move_prefix_rejects_overlapping_prefixes(s3, prefix, dst_prefix):
+    s3.s3c.put_object(Bucket="bkt", Key="a/x", Body=b"1")
+    s3.s3c.put_object(Bucket="bkt", Key="a/b/x", Body=b"2")
+    s3.s3c.put_object(Bucket="bkt", Key="a/b/b/x", Body=b"3")
+    with pytest.raises(ValueError):
+        s3.move_prefix(prefix, dst_prefix, progress=False)
+    assert keys(s3) == ["a/b/b/x", "a/b/x", "a/x"]
+
+
+def test_move_prefix_retries_throttled_deletes(s3):
+    for i in range(3):
+        s3.s3c.put_object(Bucket="bkt", Key=f"src/{i}", Body=b"x")
+    calls = []
+
+    def throttle(params, **kwargs):
+        calls.append(params)
+        if len(calls) == 1:
+            raise botocore.exceptions.ClientError(
+                {"Error": {"Code": "SlowDown", "Message": "injected"}}, "DeleteObjects")
+
+    copies = []
+
+    def copy(params, **kwargs):
+        copies.append(params)
+
+    s3.s3c.meta.events.register("before-call.s3.DeleteObjects", throttle)
+    s3.s3c.meta.events.register("before-call.s3.CopyObject", copy)
+    try:
+        result = s3.move_prefix("src", "dst", progress=False)
+    finally:
+        s3.s3c.meta.events.unregister("before-call.s3.DeleteObjects", throttle)
+        s3.s3c.meta.events.unregister("before-call.s3.CopyObject", copy)
+    # only the delete is retried, the move is not run again
+    assert len(calls) == 2 and len(copies) == 3
+    assert sorted(result.deleted) == ["src/0", "src/1", "src/2"] and not result.failed
+    assert keys(s3) == ["dst/0", "dst/1", "dst/2"]
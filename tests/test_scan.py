@@ -0,0 +1,62 @@
+import threading
+import concurrent.futures
+
+from aws.utils import scan
+from aws.utils.fs import file_digest
+
+# held by a parent thread while scan_dir runs, a forked worker inherits it locked
+held = threading.Lock()
+
+
+def digest_batch(paths, threshold, chunksize):
+    """_digest_batch needing the lock, resolved by name so only a forked worker runs it"""
+    if not held.acquire(timeout=5):
+        raise RuntimeError("worker inherited a lock held by another thread of its parent")
+    held.release()
+    return original_digest_batch(paths, threshold, chunksize)
+
+
+original_digest_batch = scan._digest_batch
+digest_batch.__module__, digest_batch.__qualname__ = scan.__name__, "_digest_batch"
+
+
+def write_files(root, count=8):
+    for i in range(count):
+        (root / f"{i}.bin").write_bytes(bytes([i]) * (i + 1) * 4096)
+
+
+def test_scan_dir_workers_do_not_inherit_thread_locks(tmp_path, monkeypatch):
+    """Regression test for forked workers: a parent thread holds a lock the worker code needs"""
+    monkeypatch.setattr(scan, "POOL_MIN_BYTES", 0)
+    monkeypatch.setattr(scan, "_digest_batch", digest_batch)
+    write_files(tmp_path)
+    release = threading.Event()
+
+    def hold():
+        with held:
+            release.wait(30)
+
+    with concurrent.futures.ThreadPoolExecutor(2) as pool:
+        holder = pool.submit(hold)
+        try:
+            files = pool.submit(lambda: list(scan.scan_dir(str(tmp_path), max_workers=2))).result(timeout=60)
+        finally:
+            release.set()
+        holder.result()
+
+    assert sorted(file.rel for file in files) == [f"{i}.bin" for i in range(8)]
+    for file in files:
+        assert (file.etag, file.content_md5) == file_digest(file.path)
+
+
+def test_scan_dir_falls_back_in_process_when_workers_die(tmp_path, monkeypatch):
+    monkeypatch.setattr(scan, "POOL_MIN_BYTES", 0)
+
+    class Broken(concurrent.futures.ProcessPoolExecutor):
+        def submit(self, *args, **kwargs):
+            raise concurrent.futures.process.BrokenProcessPool("workers died")
+
+    monkeypatch.setattr(scan.concurrent.futures, "ProcessPoolExecutor", Broken)
+    write_files(tmp_path)
+    files = list(scan.scan_dir(str(tmp_path), max_workers=2))
+    assert sorted(file.rel for file in files) == [f"{i}.bin" for i in range(8)]
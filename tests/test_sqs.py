@@ -0,0 +1,55 @@
+import json
+
+import boto3
+import pytest
+import botocore.exceptions
+from moto import mock_aws
+
+from aws.sqs import SQS
+from aws.err.base import RetryPolicy
+
+
+@pytest.fixture
+def sqs():
+    with mock_aws():
+        client = SQS(region_name="us-east-1", retry_policy=RetryPolicy(base=0.001))
+        client.queue = boto3.client("sqs", region_name="us-east-1").create_queue(QueueName="q")["QueueUrl"]
+        yield client
+
+
+def fail_once(error):
+    calls = []
+
+    def handler(params, **kwargs):
+        calls.append(params)
+        if len(calls) == 1:
+            raise error
+
+    handler.calls = calls
+    return handler
+
+
+def test_consume_deletes_after_a_connection_error(sqs):
+    for i in range(20):
+        sqs.sqs.send_message(QueueUrl=sqs.queue, MessageBody=json.dumps({"i": i}))
+    failing = fail_once(botocore.exceptions.EndpointConnectionError(endpoint_url=sqs.queue))
+    sqs.sqs.meta.events.register("before-call.sqs.DeleteMessageBatch", failing)
+    try:
+        stats = sqs.consume(lambda message: None, receivers=1, max_messages=20, wait_time_seconds=0)
+    finally:
+        sqs.sqs.meta.events.unregister("before-call.sqs.DeleteMessageBatch", failing)
+    assert len(failing.calls) > 1
+    assert stats.processed == stats.deleted == 20
+
+
+def test_delete_batch_retries_throttling(sqs):
+    sqs.sqs.send_message(QueueUrl=sqs.queue, MessageBody="x")
+    receipt = sqs.sqs.receive_message(QueueUrl=sqs.queue)["Messages"][0]["ReceiptHandle"]
+    failing = fail_once(botocore.exceptions.ClientError(
+        {"Error": {"Code": "ThrottlingException", "Message": "injected"}}, "DeleteMessageBatch"))
+    sqs.sqs.meta.events.register("before-call.sqs.DeleteMessageBatch", failing)
+    try:
+        assert sqs.delete_batch([receipt]) == 1
+    finally:
+        sqs.sqs.meta.events.unregister("before-call.sqs.DeleteMessageBatch", failing)
+    assert len(failing.calls) == 2